@@ -128,6 +128,60 @@ requested if the url contains 'www.google.com' can be easily done::
      ...
      (u'http://www.google.com/csi?v=foo', 204)]
 
+Searches that are repeated over a big log can use Log.find instead,
+which indexes the entries by host, path, method, status, mimeType and
+pageref the first time each is searched on::
+
+    In [22]: hc.log.find(host='www.google.com', status=200)
+
+HARs that are too big to hold in memory can be streamed. Entries
+are constructed one at a time as they are reached in the file, and
+everything else in the log is available up front::
+
+    In [23]: hs = iter_entries('./huge.har')
+
+    In [24]: hs.log
+    Out[24]: <HAR 1.2 Log created by Harpy $Id$: ('version', 'creator', 'entries')>
+
+    In [25]: [ e.request.url for e in hs if e.response.status == 404 ]
+
+json is read and written with the fastest library installed, falling
+back to the standard library. Set har.JSON_BACKEND to pick one for
+every call, or pass `backend` to from_json or to_json to pick one for
+a single call. Others can be added with register_json_backend.
+
+HARs can be written the same way, one entry at a time, with a
+HarWriter. Each entry is on disk as soon as it is written, and a file
+left unfinished by a crash can be closed off with recover_har::
+
+    In [26]: with HarWriter('./capture.har') as hw:
+       ....:     for e in hs:
+       ....:         hw.write(e)
+
+When only a few entries of a big HAR are needed, MappedHar finds
+where every entry is in the file once, saves that next to it, and
+then loads any entry by its index::
+
+    In [27]: MappedHar('./huge.har')[48213].request.url
+
+Raw requests and responses can be devoured from a stream too. An
+HttpStream is fed the stream in chunks of any size, and returns each
+message as soon as it is complete, chunked and pipelined ones
+included::
+
+    In [28]: stream = HttpStream()
+
+    In [29]: [ m for chunk in iter(lambda: sock.recv(65536), '')
+                 for m in stream.feed(chunk) ]
+
+Big crawls fetch the same bodies over and over. With a BodyStore set,
+each body is kept on disk once instead of in memory, and HARs can be
+written with references to it instead of copies::
+
+    In [30]: har.BODY_STORE = BodyStore('./bodies')
+
+    In [31]: open('./crawl.har', 'w').write(hc.to_json(inline_bodies=False))
+
 We can also use comprehensions to generate objects that can be used to
 make new requests. The replace method makes this simple. Here is the
 example from the replace docstring::
@@ -141,6 +195,21 @@ example from the replace docstring::
      ...
      <Request to 'http://foo.com/9/user': ... ]
 
+Each copy has its own copies of the children it keeps, and children
+that were never loaded are not built for it, so the copy and the
+original can both be changed in place without the other seeing it.
+Fields of children and headers, cookies
+and params by name can be changed too::
+
+    In [32]: entry.replace(request__header__Cookie='session=1')
+
+To render a great many variants of one request, compile it in to a
+RequestTemplate once and substitute only the parts that change::
+
+    In [33]: t = RequestTemplate(r)
+
+    In [34]: raws = t.render_all({'query__id': str(i)} for i in xrange(10))
+
 BUG WARNING: In Python, timezone information is not populated into
 datetime objects by default. All time objects must have a time zone
 according to the specification. The dateutil module is used to manage
@@ -163,11 +232,20 @@ bug report.
 
 """
 
+import codecs
 import json
+import mmap
+import os
+import re
+import zlib
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
 from StringIO import StringIO
 from socket import inet_pton, AF_INET6, AF_INET #used to validate ip addresses
 from socket import error as socket_error #used to validate ip addresses
 from urllib2 import urlopen #this should be removed
+from urlparse import urlparse
 try:
     from dateutil import parser, tz
 except ImportError:
@@ -176,6 +254,12 @@ except ImportError:
            "python-dateutil` or `easy_install python-dateutil`.")
     raise
 from datetime import datetime
+from hashlib import sha256
+from tempfile import mkstemp
+try:
+    import numpy
+except ImportError: #Log.to_columns falls back to array.array
+    numpy = None
 
 ##############################################################################
 # Constants
@@ -185,31 +269,85 @@ __version__ = "$Id$"
 
 TIMEZONE = tz.tzlocal()
 
+# name of the json library from_json and to_json use, see
+# register_json_backend. None uses the preferred one installed.
+JSON_BACKEND = None
+
+CHUNK_SIZE = 64 * 1024 #bytes read at a time when streaming a HAR
+
+# the most a devoured response body is decompressed to, in bytes
+CONTENT_MAX_SIZE = 64 * 1024 * 1024
+
+# the BodyStore devoured response bodies are moved to, if any, and
+# whether to_dict and to_json write out the bodies kept in one or, if
+# not, references to them, see BodyStore
+BODY_STORE = None
+INLINE_BODIES = True
+
+# marks values that are missing from the arrays made by Log.to_columns
+COLUMN_MISSING = float("nan")
+
+# the columns made by Log.to_columns: name -> (child of the entry, field)
+_COLUMNS = (("time", ("entry", "time")),
+            ("blocked", ("timings", "blocked")),
+            ("dns", ("timings", "dns")),
+            ("connect", ("timings", "connect")),
+            ("send", ("timings", "send")),
+            ("wait", ("timings", "wait")),
+            ("receive", ("timings", "receive")),
+            ("ssl", ("timings", "ssl")),
+            ("requestHeadersSize", ("request", "headersSize")),
+            ("requestBodySize", ("request", "bodySize")),
+            ("status", ("response", "status")),
+            ("responseBodySize", ("response", "bodySize")),
+            ("contentSize", ("content", "size")))
+
+# instance attributes that are bookkeeping rather than HAR fields
+_HIDDEN = frozenset(["_parent", "_pending", "_trusted", "_strings",
+                     # the body of devoured Content, see Content.devour
+                     "_raw", "_body", "_coding", "_binary", "_store"])
+
+# field types used by the class schemas
+_STRING = (unicode, str)
+_DATE = (unicode, str, datetime) #parsed in to a datetime when constructed
+_ANY = None #the field must be present but may be of any type
+
 ###############################################################################
 # Exceptions
 ###############################################################################
 
 
+def _with_path(error, msg):
+    """Prefix `msg` with the location set on `error` by validate()."""
+    if error.path is None:
+        return msg
+    return "{0}: {1}".format(error.path or "(root)", msg)
+
+
 class MissingValueException(Exception):
 
+    path = None #where in the har the error is, set by validate()
+
     def __init__(self, value, in_class):
         self.value = value
         self.in_class = in_class
 
     def __str__(self):
-        return (('Field "{0}" missing from input '
-                'while trying to instantiate "{1}"').format(
-                    self.value,
-                    self.in_class))
+        return _with_path(self, ('Field "{0}" missing from input '
+                                 'while trying to instantiate "{1}"').format(
+                                     self.value,
+                                     self.in_class))
 
 
 class ValidationError(Exception):
 
+    path = None #where in the har the error is, set by validate()
+
     def __init__(self, msg):
         self.msg = msg
 
     def __str__(self):
-        return str(self.msg)
+        return _with_path(self, str(self.msg))
 
 
 class InvalidChild(Exception):
@@ -223,6 +361,81 @@ class InvalidChild(Exception):
         return str(self.msg)
 
 
+###############################################################################
+# JSON Backends
+###############################################################################
+
+_json_backends = {} #name -> (loads, dumps)
+_json_preference = [] #names, least preferred first
+
+
+def register_json_backend(name, loads, dumps=None, preferred=True):
+    """Make a json library usable by from_json and to_json as `name`.
+
+    `loads` turns a string of json in to dicts, lists and strings, and
+    `dumps` turns those back in to a string. `dumps` must give exactly
+    what json.dumps gives with its default settings, or Harpy is no
+    longer lossless. Leave it out for libraries that can not, and the
+    standard library is used for writing.
+
+    When har.JSON_BACKEND is None the most recently registered
+    `preferred` backend is used.
+
+    """
+    _json_backends[name] = (loads, dumps or json.dumps)
+    if name in _json_preference:
+        _json_preference.remove(name)
+    if preferred:
+        _json_preference.append(name)
+    else:
+        _json_preference.insert(0, name)
+
+
+def json_backends():
+    """Return the names of the registered json backends, the one used
+    by default last."""
+    return list(_json_preference)
+
+
+def _json_backend(name=None):
+    """Return the (loads, dumps) pair for `name`, falling back to
+    har.JSON_BACKEND and then to the preferred backend."""
+    if name is None:
+        name = JSON_BACKEND
+    if name is None:
+        name = _json_preference[-1]
+    try:
+        return _json_backends[name]
+    except KeyError:
+        raise ValueError("Unknown json backend {0!r}, registered backends "
+                         "are: {1}".format(name, ", ".join(json_backends())))
+
+
+register_json_backend("json", json.loads, json.dumps)
+
+try:
+    import simplejson
+except ImportError:
+    pass
+else:
+    register_json_backend("simplejson", simplejson.loads, simplejson.dumps)
+
+try:
+    import ujson
+except ImportError:
+    pass
+else:
+    # ujson escapes and spaces its output differently, so it is only
+    # used for reading
+    try:
+        ujson.loads("0", precise_float=True)
+    except TypeError: #ujson 2 always decodes floats precisely
+        register_json_backend("ujson", ujson.loads)
+    else:
+        register_json_backend("ujson", lambda data: ujson.loads(
+            data, precise_float=True))
+
+
 ###############################################################################
 # Interface Functions and Classes
 ###############################################################################
@@ -236,44 +449,674 @@ def _localize_datetime(dto):
     #YYYY-MM-DDThh:mm:ss.sTZD
 
 
+# the form nearly every HAR timestamp takes, parsed without dateutil
+_ISO_8601_RE = re.compile(r'(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d)'
+                          r'(?::(\d\d)(?:[.,](\d+))?)?'
+                          r'(?:(Z)|([+-])(\d\d):?(\d\d))?$')
+
+_DATE_CACHE_SIZE = 4096 #dates kept by _parse_date and _format_date
+_parsed_dates = {} #string -> datetime
+_formatted_dates = {} #(datetime, utc offset) -> string
+_zones = {} #utc offset in minutes -> tzinfo
+
+
+def _zone(minutes):
+    try:
+        return _zones[minutes]
+    except KeyError:
+        zone = _zones[minutes] = (tz.tzutc() if not minutes else
+                                  tz.tzoffset(None, minutes * 60))
+        return zone
+
+
+def _parse_date(value):
+    """Return the datetime for the timestamp `value`.
+
+    Strict ISO 8601 timestamps are parsed directly and anything else
+    is left to dateutil, which raises for what it can not parse either.
+    Timestamps without a zone give naive datetimes, as with dateutil.
+
+    """
+    try:
+        return _parsed_dates[value]
+    except (KeyError, TypeError): #TypeError for values that are no string
+        pass
+    match = None
+    if isinstance(value, basestring):
+        match = _ISO_8601_RE.match(value)
+    if match is None:
+        return parser.parse(value)
+    (year, month, day, hour, minute, second, fraction, utc, sign, zone_hours,
+     zone_minutes) = match.groups()
+    if utc:
+        zone = _zone(0)
+    elif sign:
+        offset = int(zone_hours) * 60 + int(zone_minutes)
+        zone = _zone(-offset if sign == '-' else offset)
+    else:
+        zone = None
+    try:
+        parsed = datetime(int(year), int(month), int(day), int(hour),
+                          int(minute), int(second or 0),
+                          int(fraction[:6].ljust(6, '0')) if fraction else 0,
+                          zone)
+    except ValueError: #out of range, let dateutil decide
+        return parser.parse(value)
+    if len(_parsed_dates) >= _DATE_CACHE_SIZE:
+        _parsed_dates.clear()
+    _parsed_dates[value] = parsed
+    return parsed
+
+
+def _format_date(value):
+    """Return the ISO 8601 string for the datetime `value`, in
+    har.TIMEZONE if it has no zone of its own."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=TIMEZONE)
+    key = (value, value.utcoffset())
+    try:
+        return _formatted_dates[key]
+    except KeyError:
+        pass
+    formatted = value.isoformat()
+    if len(_formatted_dates) >= _DATE_CACHE_SIZE:
+        _formatted_dates.clear()
+    _formatted_dates[key] = formatted
+    return formatted
+
+
+# types that are already json and need no conversion
+_PLAIN_TYPES = frozenset([unicode, str, int, long, float, bool, type(None)])
+
+
+def _to_plain(value, inline_bodies=None):
+    """Return `value` with all HAR objects and datetimes in it turned
+    in to the dicts and strings they are written out as."""
+    kind = type(value)
+    if kind in _PLAIN_TYPES:
+        return value
+    if kind is list or kind is _TrackedList or kind is _HeaderList:
+        return [ item.to_dict(inline_bodies) if isinstance(item, _MetaHar)
+                 else _to_plain(item, inline_bodies) for item in value ]
+    if isinstance(value, _MetaHar):
+        return value.to_dict(inline_bodies)
+    if isinstance(value, datetime):
+        return _format_date(value)
+    if kind is dict:
+        return dict( (k, _to_plain(v, inline_bodies))
+                     for k, v in value.iteritems() )
+    return value
+
+
 class HarEncoder(json.JSONEncoder):
     """json Encoder override.
 
     This takes care of correctly encoding time objects into json.
+    HAR objects themselves are serialized with their to_dict method,
+    which is what to_json uses, passing on `inline_bodies`.
 
     """
 
+    def __init__(self, inline_bodies=None, **kwargs):
+        json.JSONEncoder.__init__(self, **kwargs)
+        self.inline_bodies = inline_bodies
+
     def default(self, obj):
         if isinstance(obj, _MetaHar):
-            return dict( (k, v) for k, v in obj.__dict__.iteritems()
-                         if k != "_parent" )
+            return obj.to_dict(self.inline_bodies)
         if isinstance(obj, datetime):
-            obj = _localize_datetime(obj)
-            return obj.isoformat()
+            return _format_date(obj)
         return json.JSONEncoder.default(self, obj)
 
 
+class _Schema(object):
+    """The fields a HAR class requires and accepts, compiled from the
+    class's `_required` and `_optional` tables in to flat tuples so
+    that validating an object is a single pass over its fields.
+
+    A field that holds a child object also accepts the child's class,
+    so that constructed objects pass the same checks as loaded ones.
+
+    """
+
+    def __init__(self, cls):
+        name = cls.__name__
+        self.required = tuple(
+            self._compile(cls, field, types)
+            for field, types in sorted(cls._required.iteritems()))
+        self.optional = tuple(
+            self._compile(cls, field, types)
+            for field, types in sorted(cls._optional.iteritems())
+            if types is not _ANY)
+        self.class_name = name
+
+    @staticmethod
+    def _compile(cls, field, types):
+        if types is _ANY:
+            return field, None, None
+        if type(types) is tuple:
+            message = "{0} failed '{1}' must be one of types: {2}".format(
+                cls.__name__, field, list(types))
+        else:
+            message = "{0} failed '{1}' must be of type: {2}".format(
+                cls.__name__, field, types)
+            types = (types,)
+        if int in types: #json backends may load big numbers as long
+            types += (long,)
+        if list in types: #Log.entries once Log.find has been used
+            types += (_TrackedList,)
+            if field in cls._children: #headers of a devoured message
+                types += (_RawHeaders, _HeaderList)
+        if field in cls._children and not cls._children[field][1]:
+            types += (globals()[cls._children[field][0]],)
+        return field, frozenset(types), message
+
+    def check(self, fields):
+        """Raise MissingValueException or ValidationError if the dict
+        `fields` does not satisfy the schema."""
+        for field, types, message in self.required:
+            try:
+                value = fields[field]
+            except KeyError:
+                raise MissingValueException(field, self.class_name)
+            if types is not None and type(value) not in types:
+                raise ValidationError(message)
+        for field, types, message in self.optional:
+            if field in fields and type(fields[field]) not in types:
+                raise ValidationError(message)
+
+
+def _schema(cls):
+    """Return the compiled schema of HAR class `cls`."""
+    schema = cls.__dict__.get("_compiled_schema")
+    if schema is None:
+        schema = cls._compiled_schema = _Schema(cls)
+    return schema
+
+
+###############################################################################
+# Raw HTTP
+###############################################################################
+
+
+# what a header name is separated from its value by, written as ": "
+_HEADER_SEPARATOR_RE = re.compile(r":[ \t]*")
+
+# how much of a memoryview is copied at first when looking for the
+# end of the head, grown until it is found
+_HEAD_WINDOW = 4096
+
+
+def _head_end(data, start=0):
+    """Return the offset the body of the raw HTTP message `data`
+    starts at, just after the blank line that ends the head, or -1
+    if there is no blank line. The search starts at `start`."""
+    end = data.find("\n\r\n", start)
+    if end < 0:
+        end = data.find("\n\n", start)
+        return end + 2 if end >= 0 else -1
+    # a bare "\n\n" earlier on ends the head first
+    bare = data.find("\n\n", start, end)
+    return bare + 2 if bare >= 0 else end + 3
+
+
+def _message_head(data):
+    """Return (head, body_start) for the raw HTTP message `data`,
+    which may be a str, bytearray or memoryview. `head` is the start
+    line and headers, including the blank line after them.
+
+    The head is found in place. It is the only part copied out of a
+    buffer, and is not copied at all out of a str.
+
+    """
+    if type(data) is memoryview:
+        # memoryview has no find, so search ever larger copies of
+        # its start instead
+        size = _HEAD_WINDOW
+        while True:
+            window = data[:size].tobytes()
+            end = _head_end(window)
+            if end >= 0 or size >= len(data):
+                break
+            size *= 4
+    else:
+        window = data
+        end = _head_end(data)
+    if end < 0:
+        end = len(data)
+    if type(window) is bytearray:
+        return str(buffer(window, 0, end)), end
+    if end < len(window):
+        return window[:end], end
+    return window, end
+
+
+def _slice(data, start, stop):
+    """Return data[start:stop] of a str, bytearray or memoryview as a
+    string, copying it once."""
+    if type(data) is memoryview:
+        return data[start:stop].tobytes()
+    if type(data) is bytearray:
+        return str(buffer(data, start, max(stop - start, 0)))
+    return data[start:stop]
+
+
+class _RawHeaders(object):
+    """The header lines of a raw HTTP message head, kept as offsets
+    in to the head until the Header objects are first wanted.
+
+    `offsets` holds three offsets per line: where it starts, where
+    its line ending starts and where the next line starts. `eol` is
+    the line ending the message mostly uses; lines ending otherwise
+    keep theirs in an `_eol` field, and headers not written as
+    'name: value' keep what separates them in `_separator`, so that
+    they are rendered back exactly as they were read. Names and values
+    are shared through StringTable `strings` if one is given.
+
+    """
+
+    __slots__ = ("head", "offsets", "eol", "strings")
+
+    def __init__(self, head, start, stop, eol, strings=None):
+        self.head = head
+        self.eol = eol
+        self.strings = strings
+        offsets = self.offsets = []
+        find = head.find
+        while start < stop:
+            after = find("\n", start, stop) + 1 or stop
+            end = after - 1 if head[after - 1] == "\n" else after
+            if end > start and head[end - 1] == "\r":
+                end -= 1
+            offsets.extend((start, end, after))
+            start = after
+
+    def __len__(self):
+        return len(self.offsets) // 3
+
+    def values(self, name):
+        """Yield the value of each header called `name`, in any case.
+        No headers are constructed."""
+        head, offsets = self.head, self.offsets
+        name = name.lower()
+        size = len(name)
+        for i in xrange(0, len(offsets), 3):
+            start = offsets[i]
+            colon = head.find(":", start, offsets[i + 1])
+            if colon - start == size and head[start:colon].lower() == name:
+                value = head[colon:offsets[i + 1]]
+                yield value[_HEADER_SEPARATOR_RE.match(value).end():]
+
+    def get(self, name):
+        """Return the value of the first header called `name`, in any
+        case, or None."""
+        return next(self.values(name), None)
+
+    def text(self):
+        """Return the header lines as they were read."""
+        if not self.offsets:
+            return ""
+        return self.head[self.offsets[0]:self.offsets[-1]]
+
+    def fields(self):
+        """Yield the dict each header is loaded from, in order."""
+        head, offsets, eol = self.head, self.offsets, self.eol
+        match = _HEADER_SEPARATOR_RE.match
+        for i in xrange(0, len(offsets), 3):
+            start, end, after = offsets[i:i + 3]
+            line = head[start:end]
+            colon = line.find(":")
+            if colon < 0:
+                header = {"name": line, "value": "", "_separator": ""}
+            else:
+                separator = match(line, colon).end()
+                header = {"name": line[:colon], "value": line[separator:]}
+                if separator - colon != 2 or line[colon + 1] != " ":
+                    header["_separator"] = line[colon:separator]
+            if self.strings is not None:
+                header["name"] = self.strings(header["name"])
+                header["value"] = self.strings(header["value"])
+            header["_sequence"] = i // 3
+            if head[end:after] != eol:
+                header["_eol"] = head[end:after]
+            yield header
+
+    def build(self, cls, trusted=False):
+        """Return the headers as a list of `cls` objects."""
+        return [ cls(header, trusted=trusted) for header in self.fields() ]
+
+    def to_plain(self):
+        return list(self.fields())
+
+
+def _header_line(header, eol):
+    """Return the raw line of Header `header`, as it was read if it
+    was devoured."""
+    return "{0}{1}{2}{3}".format(header.name,
+                                 getattr(header, "_separator", ": "),
+                                 header.value,
+                                 getattr(header, "_eol", eol))
+
+
+def _split_params(text):
+    """Return the name=value pairs of a query string or form body as
+    param dicts, in order."""
+    params = []
+    for seq, param in enumerate(text.split('&') if text else ()):
+        if "=" in param:
+            name, value = param.split('=', 1) #= is a valid character
+                                              #in values
+            param = {"name": name, "value": value}
+        else:
+            # no value at all, which is not the same as "name="
+            param = {"name": param}
+        param["_sequence"] = seq
+        params.append(param)
+    return params
+
+
+def _split_head(head, strings=None):
+    """Return (start_line, eol, headers) of the message head `head`,
+    where `eol` is the line ending of the start line and `headers` is
+    a _RawHeaders sharing strings through `strings`."""
+    line_end = head.find("\n") + 1 or len(head)
+    line = head[:line_end].rstrip("\r\n")
+    eol = head[len(line):line_end] or "\r\n"
+    # the blank line is not a header
+    stop = len(head)
+    if head.endswith("\n"):
+        stop -= 2 if head.endswith("\r\n") else 1
+    return line, eol, _RawHeaders(head, line_end, max(stop, line_end), eol,
+                                  strings)
+
+
+def _chunked(coding):
+    """Return True if a body sent with Transfer-Encoding `coding`, or
+    None, is chunked."""
+    return (coding is not None and
+            coding.rsplit(",", 1)[-1].strip().lower() == "chunked")
+
+
+def _content_length(headers):
+    """Return the Content-Length in _RawHeaders `headers`, or None."""
+    try:
+        return int(headers.get("Content-Length"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _scan_chunks(data, pos, spans=None):
+    """Walk the chunked body in `data` from the chunk starting at
+    `pos`, adding the (start, stop) offsets of the data of each
+    complete chunk to the list `spans` if it is given.
+
+    Return (pos, done). Once the last chunk and any trailers have been
+    read `done` is True and `pos` is where the message ends; until
+    then `pos` is where the first incomplete chunk starts, for the
+    walk to be carried on from when there is more data.
+
+    """
+    find = data.find
+    size = len(data)
+    while True:
+        line_end = find("\n", pos)
+        if line_end < 0:
+            return pos, False
+        line = str(data[pos:line_end]).split(";", 1)[0].strip()
+        try:
+            length = int(line, 16)
+        except ValueError:
+            raise ValueError("Invalid chunk size: {0!r}".format(line))
+        start = line_end + 1
+        if not length:
+            # trailers, if any, end with a blank line
+            while True:
+                line_end = find("\n", start)
+                if line_end < 0:
+                    return pos, False
+                blank = data[start:line_end] in ("", "\r")
+                start = line_end + 1
+                if blank:
+                    return start, True
+        stop = start + length
+        if size < stop + 2 and data[stop:stop + 1] != "\n":
+            return pos, False
+        if spans is not None:
+            spans.append((start, stop))
+        pos = stop + (1 if data[stop:stop + 1] == "\n" else 2)
+
+
+def _message_body(data, start, headers):
+    """Return (body, size) for the message in `data` whose head ends
+    at `start`: the body with any chunked encoding removed, and the
+    number of bytes it took up in `data`. A body with neither a
+    length nor chunks is the rest of `data`."""
+    if _chunked(headers.get("Transfer-Encoding")):
+        if type(data) is memoryview:
+            data, start = data[start:].tobytes(), 0
+        spans = []
+        end, done = _scan_chunks(data, start, spans)
+        if not done:
+            raise ValueError("Chunked body ends before its last chunk")
+        return "".join(_slice(data, a, b) for a, b in spans), end - start
+    length = _content_length(headers)
+    body = _slice(data, start,
+                  len(data) if length is None else start + length)
+    return body, len(body)
+
+
+def _is_utf8(data):
+    """Return True if the bytes `data` are valid UTF-8, checked a
+    chunk at a time so that no copy of all of it is made."""
+    decoder = codecs.getincrementaldecoder('utf8')()
+    try:
+        for start in xrange(0, len(data), CHUNK_SIZE):
+            decoder.decode(data[start:start + CHUNK_SIZE])
+        decoder.decode("", True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _decompress(data, coding, limit):
+    """Return the bytes `data` decompressed as Content-Encoding
+    `coding` says, or None if they cannot be, or would come to more
+    than `limit` bytes."""
+    if coding in ("gzip", "x-gzip"):
+        formats = (16 + zlib.MAX_WBITS,)
+    elif coding == "deflate":
+        # meant to be zlib wrapped, but often sent raw
+        formats = (zlib.MAX_WBITS, -zlib.MAX_WBITS)
+    else:
+        return None
+    for wbits in formats:
+        try:
+            return _inflate(data, wbits, limit)
+        except zlib.error:
+            pass
+    return None
+
+
+def _inflate(data, wbits, limit):
+    """Decompress `data` a chunk at a time, giving up with None once
+    the output comes to more than `limit` bytes."""
+    decompressor = zlib.decompressobj(wbits)
+    pieces = []
+    size = 0
+    for start in xrange(0, len(data), CHUNK_SIZE):
+        chunk = buffer(data, start, CHUNK_SIZE)
+        while chunk:
+            piece = decompressor.decompress(chunk, CHUNK_SIZE)
+            size += len(piece)
+            if size > limit:
+                return None
+            pieces.append(piece)
+            chunk = decompressor.unconsumed_tail
+    piece = decompressor.flush()
+    if size + len(piece) > limit:
+        return None
+    pieces.append(piece)
+    return "".join(pieces)
+
+
+def _request_target(url):
+    """Return the path a request for `url` is sent to."""
+    if "://" not in url:
+        return url
+    return '/' + '/'.join(url.split("/")[3:])
+
+
+###############################################################################
+# Body Store
+###############################################################################
+
+
+class BodyStore(object):
+    """A directory of response bodies, each kept once, in a file named
+    after its SHA-256.
+
+    When har.BODY_STORE is set to one, every devoured response body of
+    at least `threshold` bytes is written to it and dropped from
+    memory, its Content keeping only a reference in `_bodyRef`. The
+    body is read back whenever the content's text is wanted. Loaded
+    contents can be moved in to a store with Content.spill.
+
+    HARs are written with the bodies in full, as usual. Pass
+    `inline_bodies=False` to to_json, to_dict or HarWriter, or set
+    har.INLINE_BODIES to False, to write the references instead, which
+    makes HARs of big crawls, where most bodies are the same few
+    scripts and error pages, a lot smaller. Such HARs keep the
+    reference in a non-standard `_bodyRef` field in place of `text`::
+
+        In [0]: har.BODY_STORE = BodyStore('./bodies')
+
+        In [1]: open('./crawl.har', 'w').write(
+                    hc.to_json(inline_bodies=False))
+
+        In [2]: open('./whole.har', 'w').write(hc.to_json())
+
+    """
+
+    def __init__(self, path, threshold=4096):
+        self.path = path
+        self.threshold = threshold
+        self._known = set()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def __repr__(self):
+        return "<BodyStore in {0!r}>".format(self.path)
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def __contains__(self, key):
+        return key in self._known or os.path.exists(self._file(key))
+
+    def put(self, data):
+        """Store the bytes `data`, unless they already are, and return
+        the key they are kept under."""
+        key = sha256(data).hexdigest()
+        if key not in self:
+            name = self._file(key)
+            directory = os.path.dirname(name)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            # written under another name first, so a body is either
+            # all there or not there at all
+            fd, temp = mkstemp(dir=directory)
+            try:
+                with os.fdopen(fd, 'wb') as out:
+                    out.write(data)
+                os.rename(temp, name)
+            except:
+                os.unlink(temp)
+                raise
+        self._known.add(key)
+        return key
+
+    def get(self, key):
+        """Return the bytes kept under `key`. Raises KeyError if there
+        are none."""
+        try:
+            with open(self._file(key), 'rb') as fd:
+                return fd.read()
+        except IOError:
+            raise KeyError(key)
+
+
 ###############################################################################
 # HAR Classes
 ###############################################################################
 
 
+def _adopt(kid, owner):
+    """Make `owner` the parent of the copy `kid`, if the original had
+    one."""
+    if getattr(kid, "_parent", None) is not None:
+        kid._parent = owner
+    return kid
+
+
+def _copy_child(value, owner):
+    """Return a copy for `owner` of the child `value`, copying each
+    member if it is a list."""
+    if isinstance(value, _MetaHar):
+        return _adopt(value._clone(), owner)
+    if isinstance(value, list):
+        kids = [ _adopt(kid._clone(), owner) if isinstance(kid, _MetaHar)
+                 else kid for kid in value ]
+        return kids if type(value) is list else type(value)(kids)
+    return value
+
+
 class _MetaHar(object):
     """This is the base class that all HAR objects use. It defines
     default methods and objects."""
     # this needs to be a tree so child objects can validate that they
     # are uniq children
 
-    def __init__(self, init_from=None, parent=None, empty=False):
-        #it should be possible to init without validataion
+    # fields that hold HAR objects: name -> (class name, is a list)
+    _children = {}
+    # list fields that are put in `_sequence` order when constructed
+    _sequenced = ()
+    # list fields constructed as a list subclass: name -> class
+    _list_types = {}
+    # prefixes replace takes to set list members by name: prefix -> field
+    _named = {}
+
+    # fields checked by validate_input: name -> type(s), or _ANY
+    _required = {}
+    _optional = {}
+
+    # subclasses that do not declare __slots__ get an instance dict
+    __slots__ = ()
+
+    def __init__(self, init_from=None, parent=None, empty=False, lazy=False,
+                 trusted=False):
         """ This is the _MetaHar object. It is used as the meta class
         for other objects. It should never be instantiated directly.
 
+        If `lazy` is set, child objects are left as they were loaded
+        until they are first accessed, and are only then constructed
+        and validated. Children that are never accessed are written
+        back out by to_json exactly as they were read.
+
+        If `trusted` is set, the object and its children are not
+        validated while they are loaded. Use this for input known to
+        be good, such as HARs written by Harpy, and call validate()
+        later if needed.
+
         """
-        assert not self.__class__ in [_MetaHar, _KeyValueHar], (
+        assert not self.__class__ in [_MetaHar, _CompactHar, _KeyValueHar], (
             "This is a meta class used to type other classes. "
             "To use this class create a new object that extends it")
         self._parent = parent
+        if self._children:
+            if lazy:
+                self._pending = {}
+            if trusted:
+                self._trusted = True
         if init_from:
             #!!! there might be a better way to do this
             assert type(init_from) in [unicode, str, file, dict], (
@@ -284,17 +1127,34 @@ class _MetaHar(object):
                     fd = StringIO(init_from)
                 else:
                     fd = init_from
-                self.from_json(fd.read())
+                self.from_json(fd.read(), trusted)
                 fd.close()
             else:
-                self.from_dict(init_from)
+                self.from_dict(init_from, trusted)
         elif not empty:
             self.set_defaults()
 
+    def __getattr__(self, name):
+        # only called when `name` is not set, which for lazily loaded
+        # objects may mean it has not been constructed yet
+        pending = self.__dict__.get("_pending")
+        if not pending or name not in pending:
+            raise AttributeError("'{0}' object has no attribute '{1}'"
+                                 .format(self.__class__.__name__, name))
+        value = self._build_child(name, pending[name], lazy=True,
+                                  trusted="_trusted" in self.__dict__)
+        del pending[name]
+        if not pending:
+            del self._pending
+        self.__dict__[name] = value
+        return value
+
     def __iter__(self):
-        return (v for k, v in self.__dict__.iteritems()
-                 if k != "_parent" and
-                 (isinstance(v, _MetaHar)
+        if self._children:
+            for name in self.__dict__.get("_pending", {}).keys():
+                getattr(self, name)
+        return (v for k, v in self._field_items()
+                 if (isinstance(v, _MetaHar)
                   or isinstance(v, list)
                   or isinstance(v, unicode)
                   or isinstance(v, str)))
@@ -308,30 +1168,33 @@ class _MetaHar(object):
     def __repr__(self):
         return "<{0} {1} {2}>".format(
             self.__class__.__name__,
-            self.__dict__.get('name',"[undefined]"),
+            getattr(self, 'name', "[undefined]"),
             self._get_printable_kids())
 
     def _get(self, name, default='[uninitialized]'):
         """Internal method to return a default value.
         """
         return (name in self and
-                self.__getattribute__(name)) or default
+                getattr(self, name)) or default
 
     def _get_printable_kids(self):
         """Return a tuple of all objects that are children of the
         object on which the method is called.
 
         """
-        return tuple( str(k) for k, v in self.__dict__.iteritems()
-                 if (str(k) != "_parent" and
-                     (isinstance(v, _MetaHar)
-                      or isinstance(v, list)
-                      or isinstance(v, unicode)
-                      or isinstance(v, str)))) or '(empty)'
+        kids = [ str(k) for k, v in self._field_items()
+                 if (isinstance(v, _MetaHar)
+                     or isinstance(v, list)
+                     or isinstance(v, unicode)
+                     or isinstance(v, str)) ]
+        if self._children:
+            kids.extend(str(k) for k in self.__dict__.get("_pending", ()))
+        return tuple(kids) or '(empty)'
 
 
-    def replace(self, **kwarg):
-        """Return a copy of the object with a varabile set to a value.
+    def replace(self, **changes):
+        """Return a copy of the object with the given fields set to new
+        values.
 
         This is essentially __setattr__ except that it returns an
         instance of the object with the new value when called. This
@@ -350,12 +1213,103 @@ class _MetaHar(object):
         As a request object can always be turned back in to a raw
         request, this is useful for testing by taking a known good
         request and modifying it to observe different results.
+
+        The copy gets its own copies of the children it keeps, so it
+        and the original can both be changed in place without the
+        other seeing it; children that were never loaded stay unbuilt
+        in both. Fields of children are reached with `__`, as in
+        `entry.replace(request__url=url)`, and members of the lists in
+        `_named` by their name, as in `replace(header__Cookie='a=b')`.
+        A named member set to None is removed, and one that is not
+        there is added. Header names are matched in any case, and as
+        they are seldom identifiers `header__User_Agent` also matches
+        User-Agent.
+
         """
-        #I imagine this will get really confusing at some point
-        new_req = Request(self.to_json())
-        for key, value in kwarg.iteritems():
-            new_req.__dict__[key] = value
-        return new_req
+        fields = {}
+        nested = {}
+        for key, value in changes.iteritems():
+            name, nest, rest = key.partition("__")
+            if nest:
+                nested.setdefault(name, {})[rest] = value
+            else:
+                fields[name] = value
+        clone = self._clone(skip=set(fields).union(
+            name for name in nested if name not in self._named))
+        for name, value in fields.iteritems():
+            clone._replace_field(name, value)
+        for name, kid_changes in nested.iteritems():
+            if name in self._named:
+                clone._replace_named(self._named[name], kid_changes)
+                continue
+            pending = self.__dict__.get("_pending")
+            if pending and name in pending:
+                #build a copy without loading the original's
+                kid = self._build_child(name, pending[name], lazy=True,
+                                        trusted="_trusted" in self.__dict__)
+            else:
+                kid = getattr(self, name)
+            if not isinstance(kid, _MetaHar):
+                raise AttributeError("'{0}' field '{1}' is not a HAR object"
+                                     .format(self.__class__.__name__, name))
+            clone._replace_field(name,
+                                 _adopt(kid.replace(**kid_changes), clone))
+        return clone
+
+    def _clone(self, skip=()):
+        """Return a copy of the object with copies of its children,
+        but for those named in `skip`, which the caller replaces.
+        Children that were never loaded stay pending in both, as
+        nothing changes them there."""
+        clone = object.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        if "_pending" in clone.__dict__:
+            clone._pending = dict(clone._pending)
+        for name in self._children:
+            if name in self.__dict__ and name not in skip:
+                clone.__dict__[name] = _copy_child(self.__dict__[name],
+                                                   clone)
+        return clone
+
+    def _replace_field(self, name, value):
+        pending = self.__dict__.get("_pending") if self._children else None
+        if pending and name in pending:
+            del pending[name]
+            if not pending:
+                del self._pending
+        setattr(self, name, value)
+
+    def _replace_named(self, field, changes):
+        """Set the members of list `field` named by the keys of
+        `changes` on a copy of the list, as replace does."""
+        kids = list(getattr(self, field, None) or ())
+        fold = ((lambda name: name.lower()) if field == "headers"
+                else (lambda name: name))
+        for name, value in changes.iteritems():
+            found = [ i for i, kid in enumerate(kids)
+                      if fold(kid.name) == fold(name) ]
+            if not found and field == "headers" and "_" in name:
+                name = name.replace("_", "-")
+                found = [ i for i, kid in enumerate(kids)
+                          if fold(kid.name) == fold(name) ]
+            if value is None:
+                drop = found
+            elif found:
+                kids[found[0]].value = value
+                drop = found[1:]
+            else:
+                kid = globals()[self._children[field][0]](
+                    {"name": name, "value": value})
+                sequence = (getattr(kids[-1], "_sequence", None) if kids
+                            else None)
+                if sequence is not None:
+                    kid._sequence = sequence + 1
+                kids.append(kid)
+                drop = ()
+            for i in reversed(drop):
+                del kids[i]
+        list_type = self._list_types.get(field)
+        self._replace_field(field, list_type(kids) if list_type else kids)
 
     def get_children(self):
         """Return all objects that are children of the object on which
@@ -365,20 +1319,53 @@ class _MetaHar(object):
         return [ kid for kid in self ] # this comes from
                                        # _get_printable_kids()
 
-    def from_json(self, json_data):
-        json_data = json.loads(json_data)
-        self.from_dict(json_data) #get first element
+    def from_json(self, json_data, trusted=False, backend=None):
+        """Load the object from a string of json, parsed with the json
+        backend named `backend` or with the default one."""
+        json_data = _json_backend(backend)[0](json_data)
+        self.from_dict(json_data, trusted) #get first element
 
-    def from_dict(self, json_dict):
+    def from_dict(self, json_dict, trusted=False):
         assert type(json_dict) is dict, "from_dict must be passed a dictionary"
-        self.__dict__.update(json_dict)
-        self.validate_input()
+        self._update_fields(json_dict)
+        if not trusted:
+            self.validate_input()
         self._construct()
 
     def _construct(self):
         #when constructing child objects, pass self so parent hierachy
         #can exist
-        pass
+        if not self._children:
+            return
+        pending = self.__dict__.get("_pending")
+        for name in self._children:
+            if name not in self.__dict__:
+                continue
+            if pending is not None:
+                pending[name] = self.__dict__.pop(name)
+            else:
+                self.__dict__[name] = self._build_child(
+                    name, self.__dict__[name],
+                    trusted="_trusted" in self.__dict__)
+        if pending == {}:
+            del self._pending
+
+    def _build_child(self, name, value, lazy=False, trusted=False):
+        """Construct the child object(s) for field `name` from the
+        loaded `value`."""
+        class_name, is_list = self._children[name]
+        cls = globals()[class_name]
+        if not is_list:
+            return cls(value, lazy=lazy, trusted=trusted)
+        if type(value) is _RawHeaders:
+            kids = value.build(cls, trusted)
+        else:
+            if (name in self._sequenced and
+                all('_sequence' in kid for kid in value)):
+                value = sorted(value, key=lambda kid: kid['_sequence'])
+            kids = [ cls(kid, lazy=lazy, trusted=trusted) for kid in value ]
+        list_type = self._list_types.get(name)
+        return list_type(kids) if list_type else kids
 
     def set_defaults(self):
         """This method sets defaults for objects not instantiated via
@@ -386,45 +1373,122 @@ class _MetaHar(object):
         also be used to reset a har to a default state."""
         pass
 
-    def to_json(self):
+    def to_dict(self, inline_bodies=None):
+        """Return the object as the plain dicts, lists and strings it
+        is written out as, converting every object under it in the
+        same pass. `inline_bodies` overrides INLINE_BODIES.
+
+        Children of lazily loaded objects that were never accessed are
+        returned as they were loaded, not copied.
+
+        """
+        plain_types = _PLAIN_TYPES
+        fields = dict(self.__dict__)
+        for name in _HIDDEN:
+            fields.pop(name, None)
+        for name in [ k for k, v in fields.iteritems()
+                      if type(v) not in plain_types ]:
+            fields[name] = _to_plain(fields[name], inline_bodies)
+        if self._children and "_pending" in self.__dict__:
+            #children that were never accessed go out untouched
+            fields.update(self._pending)
+            for name, value in self._pending.iteritems():
+                if type(value) is _RawHeaders:
+                    fields[name] = value.to_plain()
+        return fields
+
+    def to_json(self, backend=None, inline_bodies=None):
+        """Return the object as json, written with the json backend
+        named `backend` or with the default one. `inline_bodies`
+        overrides INLINE_BODIES for the call."""
         #return json.dumps(self, indent=4, cls=HarEncoder)
         ## for now we're going to use line return as a deleniator
         ## later we'll write a json stream parser
-        return json.dumps(self, indent=None, cls=HarEncoder)
+        return _json_backend(backend)[1](self.to_dict(inline_bodies))
 
     def validate_input(self): #default behavior
-        # change this to a couple of class vars
-        field_types = {"name":[unicode, str],
-                       "value":[unicode, str]}
-        self._has_fields(*field_types.keys())
-        if "comment" in self.__dict__:
-            field_types["comment"] = [unicode, str]
-        self._check_field_types(field_types)
-
-    def _has_fields(self, *fields):
-        for field in fields:
-            if not field in self.__dict__:
-                raise MissingValueException(field, self.__class__.__name__)
+        _schema(self.__class__).check(self._field_dict())
 
-    def _check_field_types(self, field_defs):
-        for fname, ftype in field_defs.iteritems():
-            try:
-                if type(ftype) == list:
-                    assert type(self.__dict__[fname]) in ftype, (
-                        "{0} failed '{1}' must be one of types: {2}"
-                        .format(self.__class__.__name__, fname, ftype))
-                else:
-                    assert type(self.__dict__[fname]) is ftype, (
-                        "{0} failed '{1}' must be of type: {2}"
-                        .format(self.__class__.__name__, fname, ftype))
-            except Exception, e:
-                raise ValidationError(e.message)
+    def validate(self, deep=True):
+        """Return a list of everything wrong with the object, and
+        with `deep` set, with every object under it.
+
+        Unlike validate_input, which stops at the first problem, this
+        carries on and reports them all. Each error is a
+        ValidationError or MissingValueException whose `path` gives
+        its location, e.g. 'log.entries[3].request'. This is meant
+        to be run on objects loaded with `trusted` set::
+
+            In [0]: hc = HarContainer(open('./capture.har'), trusted=True)
+
+            In [1]: [ str(err) for err in hc.validate() ]
+            Out[1]:
+            ['log.entries[3].request: Field "url" missing from input '
+             'while trying to instantiate "Request"']
+
+        """
+        errors = []
+        self._collect_errors("", deep, errors)
+        return errors
+
+    def _collect_errors(self, path, deep, errors):
+        try:
+            self.validate_input()
+        except (MissingValueException, ValidationError), err:
+            err.path = path
+            errors.append(err)
+        if not deep or not self._children:
+            return
+        pending = self.__dict__.get("_pending", {})
+        for name in self._children:
+            kid_path = path and "{0}.{1}".format(path, name) or name
+            if name in pending:
+                #check children that were never accessed without
+                #constructing them for good
+                try:
+                    kids = self._build_child(name, pending[name],
+                                             trusted=True)
+                except Exception, err:
+                    error = ValidationError("Could not construct {0}: {1}"
+                                            .format(name, err))
+                    error.path = kid_path
+                    errors.append(error)
+                    continue
+            elif name in self.__dict__:
+                kids = self.__dict__[name]
+            else:
+                continue
+            if isinstance(kids, _MetaHar):
+                kids._collect_errors(kid_path, deep, errors)
+            elif isinstance(kids, list):
+                for i, kid in enumerate(kids):
+                    if isinstance(kid, _MetaHar):
+                        kid._collect_errors("{0}[{1}]".format(kid_path, i),
+                                            deep, errors)
+
+    def _field_items(self):
+        """Return (name, value) pairs for the HAR fields set on the
+        object."""
+        return ( (k, v) for k, v in self.__dict__.iteritems()
+                 if k not in _HIDDEN )
+
+    def _field_dict(self):
+        """Return a dict of the fields set on the object."""
+        if self.__dict__.get("_pending"):
+            fields = dict(self.__dict__)
+            fields.update(self._pending)
+            return fields
+        return self.__dict__
+
+    def _update_fields(self, fields):
+        self.__dict__.update(fields)
 
     def _check_empty(self, fields):
         if not type(fields) is list:
             fields = [fields]
+        values = self._field_dict()
         for field in fields:
-            if not self.__dict__[field]:
+            if not values[field]:
                 raise ValidationError(
                     "{0} failed '{1}' must not be empty"
                     .format(self.__class__.__name__, field))
@@ -433,20 +1497,130 @@ class _MetaHar(object):
 #------------------------------------------------------------------------------
 
 
-class _KeyValueHar(_MetaHar):
+class _CompactHar(_MetaHar):
+    """Base class for the small objects that a HAR holds many of per
+    entry, such as headers and cookies.
 
-    def validate_input(self): #default behavior
-        field_types = {"name":[unicode, str],
-                       "value":[unicode, str]}
-        self._has_fields(*field_types.keys())
-        if "comment" in self.__dict__:
-            field_types["comment"] = [unicode, str]
+    Instead of an instance dict these keep their fields in the slots
+    listed in `_field_slots`, which takes a fraction of the memory.
+    Any other field (custom `_` fields for example) is kept in a dict
+    in `_extra` that is only created when it is needed. Compact
+    objects never have children of their own.
+
+    """
+
+    __slots__ = ("_parent", "_extra")
+    _field_slots = ()
+
+    def __init__(self, *args, **kwargs):
+        object.__setattr__(self, "_extra", None)
+        _MetaHar.__init__(self, *args, **kwargs)
+
+    def __getattr__(self, name):
+        extra = object.__getattribute__(self, "_extra")
+        if extra and name in extra:
+            return extra[name]
+        raise AttributeError("'{0}' object has no attribute '{1}'"
+                             .format(self.__class__.__name__, name))
+
+    def __setattr__(self, name, value):
+        try:
+            object.__setattr__(self, name, value)
+        except AttributeError:
+            if self._extra is None:
+                object.__setattr__(self, "_extra", {})
+            self._extra[name] = value
+
+    def __delattr__(self, name):
+        try:
+            object.__delattr__(self, name)
+        except AttributeError:
+            if not self._extra or name not in self._extra:
+                raise
+            del self._extra[name]
+
+    def _clone(self, skip=()):
+        get = object.__getattribute__
+        clone = object.__new__(self.__class__)
+        for name in ("_parent",) + self._field_slots:
+            try:
+                object.__setattr__(clone, name, get(self, name))
+            except AttributeError:
+                pass
+        extra = get(self, "_extra")
+        object.__setattr__(clone, "_extra", dict(extra) if extra else None)
+        return clone
+
+    def _field_items(self):
+        for name in self._field_slots:
+            try:
+                yield name, object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        if self._extra:
+            for item in self._extra.iteritems():
+                yield item
+
+    def from_dict(self, json_dict, trusted=False):
+        # compact objects are filled in one go, so what is loaded is
+        # all there is to validate
+        assert type(json_dict) is dict, "from_dict must be passed a dictionary"
+        self._update_fields(json_dict)
+        if not trusted:
+            _schema(self.__class__).check(json_dict)
+        self._construct()
+
+    def to_dict(self, inline_bodies=None):
+        plain_types = _PLAIN_TYPES
+        get = object.__getattribute__
+        fields = {}
+        for name in self._field_slots:
+            try:
+                value = get(self, name)
+            except AttributeError:
+                continue
+            if type(value) in plain_types:
+                fields[name] = value
+            else:
+                fields[name] = _to_plain(value, inline_bodies)
+        if self._extra:
+            for name, value in self._extra.iteritems():
+                fields[name] = _to_plain(value, inline_bodies)
+        return fields
+
+    def _field_dict(self):
+        fields = dict(self._extra) if self._extra else {}
+        for name in self._field_slots:
+            try:
+                fields[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        return fields
+
+    def _update_fields(self, fields):
+        for name, value in fields.iteritems():
+            if name in self._field_slots:
+                object.__setattr__(self, name, value)
+            else:
+                setattr(self, name, value)
+
+
+#------------------------------------------------------------------------------
+
+
+class _KeyValueHar(_CompactHar):
+
+    __slots__ = ("name", "value", "_sequence", "comment")
+    _field_slots = __slots__
+    _required = {"name": _STRING,
+                 "value": _STRING}
+    _optional = {"comment": _STRING}
 
     def __repr__(self):
         return "<{0} {1}: {2}>".format(
             self.__class__.__name__,
-            'name' in self.__dict__ and self.name or "[undefined]",
-            'value' in self.__dict__ and self.value or "[undefined]")
+            getattr(self, 'name', None) or "[undefined]",
+            getattr(self, 'value', None) or "[undefined]")
 
     def __eq__(self, other):
         # not sure if this is logical, may need to take it out later
@@ -458,13 +1632,18 @@ class _KeyValueHar(_MetaHar):
 
 class HarContainer(_MetaHar):
 
+    _children = {"log": ("Log", False)}
+    _required = {"log": dict}
+
     def __repr__(self):
         return "<{0}: {1}>".format(
             self.__class__.__name__,
             self._get_printable_kids())
 
-    def _construct(self):
-        self.log = Log(self.log, self)
+    def _build_child(self, name, value, lazy=False, trusted=False):
+        log = _MetaHar._build_child(self, name, value, lazy, trusted)
+        log._parent = self
+        return log
 
     def set_defaults(self):
         """This method sets defaults for objects not instantiated via
@@ -473,36 +1652,540 @@ class HarContainer(_MetaHar):
         self.log = Log()
 
     def validate_input(self):
-        field_types = {"log": dict}
-        self._has_fields(*field_types.keys())
-        self._check_field_types(field_types)
+        _MetaHar.validate_input(self)
         self._check_empty("log")
 
 
 #------------------------------------------------------------------------------
 
 
+class _IndexedList(list):
+    """A list that keeps an index of its items up to date as it is
+    changed.
+
+    Appending and removing items updates the index in place, through
+    _index_items and _unindex. Any other change (inserting, assigning
+    to items or slices, sorting) drops the index so that it is rebuilt
+    when it is next used. Copies and pickles have no index.
+
+    """
+
+    __slots__ = ("_index",)
+
+    def __init__(self, items=()):
+        list.__init__(self, items)
+        self._index = None
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
+    def _invalidate(self):
+        self._index = None
+
+    def _index_items(self, items):
+        """Add `items`, about to be added to the list, to the index."""
+        pass
+
+    def _unindex(self, item):
+        """Take `item`, just taken out of the list, out of the index."""
+        pass
+
+    def append(self, item):
+        if self._index is not None:
+            self._index_items((item,))
+        list.append(self, item)
+
+    def extend(self, items):
+        items = list(items)
+        if self._index is not None:
+            self._index_items(items)
+        list.extend(self, items)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def remove(self, item):
+        # by position, as what list.remove finds may only be equal
+        self.pop(self.index(item))
+
+    def pop(self, *args):
+        item = list.pop(self, *args)
+        if self._index is not None:
+            self._unindex(item)
+        return item
+
+    def __delitem__(self, key):
+        if isinstance(key, slice):
+            self._invalidate()
+            list.__delitem__(self, key)
+        else:
+            self.pop(key)
+
+    def __setitem__(self, key, value):
+        self._invalidate()
+        list.__setitem__(self, key, value)
+
+    def __setslice__(self, i, j, values):
+        self._invalidate()
+        list.__setslice__(self, i, j, values)
+
+    def __delslice__(self, i, j):
+        self._invalidate()
+        list.__delslice__(self, i, j)
+
+    def __imul__(self, count):
+        self._invalidate()
+        return list.__imul__(self, count)
+
+    def insert(self, position, item):
+        self._invalidate()
+        list.insert(self, position, item)
+
+    def sort(self, *args, **kwargs):
+        self._invalidate()
+        list.sort(self, *args, **kwargs)
+
+    def reverse(self):
+        self._invalidate()
+        list.reverse(self)
+
+
+class _TrackedList(_IndexedList):
+    """A list of entries that keeps the _EntryIndex of its log up to
+    date as it is changed. As in a plain list, an entry may be in it
+    more than once.
+
+    """
+
+    __slots__ = ()
+
+    def _index_items(self, entries):
+        # dropping the index if this fails, so the two never disagree
+        try:
+            for entry in entries:
+                self._index.add(entry)
+        except Exception:
+            self._invalidate()
+            raise
+
+    def _unindex(self, entry):
+        if self._index.count(entry) > 1:
+            self._invalidate() #which of them went is not known
+        else:
+            self._index.discard(entry)
+
+
+class _HeaderList(_IndexedList):
+    """A list of headers that can also be used as a case-insensitive
+    multimap of their names to their values.
+
+    The headers stay in their `_sequence` order, so messages render
+    exactly as before, but get, get_all, set, add and remove find them
+    through an index of lower cased names instead of a scan. The index
+    is built when first used and kept up to date by those methods and
+    by appending and removing headers; any other change to the list
+    drops it so that it is rebuilt when next used. Rename a header by
+    removing it and adding it again, or the index will not know.
+
+    """
+
+    __slots__ = ()
+
+    def _indexed(self):
+        index = self._index
+        if index is None:
+            index = self._index = {}
+            self._index_items(self)
+        return index
+
+    def _index_items(self, headers):
+        index = self._index
+        for header in headers:
+            index.setdefault(header.name.lower(), []).append(header)
+
+    def _unindex(self, header):
+        found = self._index.get(header.name.lower())
+        if not found or not any(h is header for h in found):
+            self._invalidate() #renamed since it was indexed
+        elif len(found) == 1:
+            del self._index[header.name.lower()]
+        else:
+            found[:] = [ h for h in found if h is not header ]
+
+    def _keep(self, drop):
+        """Take the headers whose ids are in `drop` out of the list."""
+        list.__setslice__(self, 0, len(self),
+                          [ h for h in self if id(h) not in drop ])
+
+    def get(self, name, default=None):
+        """Return the value of the first header called `name`, in any
+        case, or `default`."""
+        found = self._indexed().get(name.lower())
+        return found[0].value if found else default
+
+    def get_all(self, name):
+        """Return the values of every header called `name`, in order."""
+        return [ h.value for h in self._indexed().get(name.lower(), ()) ]
+
+    def add(self, name, value):
+        """Add a header called `name` after the others, and return it."""
+        header = Header({"name": name, "value": value})
+        if self:
+            sequence = getattr(self[-1], "_sequence", None)
+            if sequence is not None:
+                header._sequence = sequence + 1
+        self.append(header)
+        return header
+
+    def set(self, name, value):
+        """Set the first header called `name`, in any case, to `value`
+        and remove any others of that name, or add one if there are
+        none. Return the header."""
+        found = self._indexed().get(name.lower())
+        if not found:
+            return self.add(name, value)
+        header = found[0]
+        header.value = value
+        if len(found) > 1:
+            self._keep(set(id(h) for h in found[1:]))
+            del found[1:]
+        return header
+
+    def remove(self, name):
+        """Remove every header called `name`, in any case, and return
+        how many there were. Given a Header, remove it as list.remove
+        would."""
+        if not isinstance(name, basestring):
+            _IndexedList.remove(self, name)
+            return 1
+        found = self._indexed().pop(name.lower(), None)
+        if not found:
+            return 0
+        self._keep(set(id(h) for h in found))
+        return len(found)
+
+    def __contains__(self, item):
+        if isinstance(item, basestring):
+            return item.lower() in self._indexed()
+        return list.__contains__(self, item)
+
+
+def _header_list(message):
+    """Return the headers of `message` as a _HeaderList, converting a
+    plain list set on it."""
+    headers = message.headers
+    if type(headers) is not _HeaderList:
+        headers = message.headers = _HeaderList(headers)
+    return headers
+
+
+def _entry_key(entry, *names):
+    """Return the field at the end of the attribute chain `names`
+    under `entry`, or None if any part of it is missing."""
+    value = entry
+    try:
+        for name in names:
+            value = getattr(value, name)
+    except AttributeError:
+        return None
+    return value
+
+
+def _url_part(entry, part):
+    url = _entry_key(entry, "request", "url")
+    return getattr(urlparse(url), part) if url else None
+
+
+def _mime_type(entry):
+    mime_type = _entry_key(entry, "response", "content", "mimeType")
+    if mime_type is None:
+        return None
+    return mime_type.split(";", 1)[0].strip().lower()
+
+
+class _EntryIndex(object):
+    """Secondary indexes over the entries of a log, used by Log.find.
+
+    Each entry is numbered in list order. The index for a criterion
+    maps each value of it to the set of numbers of the entries that
+    have it, and is only built the first time the criterion is used.
+    Paths are kept sorted instead so that they can be searched by
+    prefix.
+
+    """
+
+    # criterion -> function returning the value of it for an entry
+    criteria = {"host": lambda entry: _url_part(entry, "hostname"),
+                "path": lambda entry: _url_part(entry, "path"),
+                "method": lambda entry: _entry_key(entry, "request",
+                                                   "method"),
+                "status": lambda entry: _entry_key(entry, "response",
+                                                   "status"),
+                "mimeType": _mime_type,
+                "pageref": lambda entry: _entry_key(entry, "pageref")}
+
+    def __init__(self, entries):
+        self.numbers = {} #id(entry) -> [number of each time it is in]
+        self.entries = {} #number -> entry
+        self.next_number = 0
+        self.keys = {} #criterion -> {value: set of numbers}
+        self.paths = None #sorted [(path, number)]
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        number = self.next_number
+        keys = [ (values, self.criteria[name](entry))
+                 for name, values in self.keys.iteritems() ]
+        if self.paths is not None:
+            insort(self.paths, (self.criteria["path"](entry), number))
+        self.next_number += 1
+        self.numbers.setdefault(id(entry), []).append(number)
+        self.entries[number] = entry
+        for values, key in keys:
+            values.setdefault(key, set()).add(number)
+
+    def count(self, entry):
+        return len(self.numbers.get(id(entry), ()))
+
+    def discard(self, entry):
+        """Forget the first time `entry` is in the list."""
+        taken = self.numbers.get(id(entry))
+        if not taken:
+            return
+        number = taken.pop(0)
+        if not taken:
+            del self.numbers[id(entry)]
+        del self.entries[number]
+        for name, values in self.keys.iteritems():
+            numbers = values.get(self.criteria[name](entry))
+            if numbers and number in numbers:
+                numbers.discard(number)
+            else: #the entry was changed after it was indexed
+                for numbers in values.itervalues():
+                    numbers.discard(number)
+        if self.paths is not None:
+            item = (self.criteria["path"](entry), number)
+            position = bisect_left(self.paths, item)
+            if position < len(self.paths) and self.paths[position] == item:
+                del self.paths[position]
+            else:
+                self.paths = [ path for path in self.paths
+                               if path[1] != number ]
+
+    def _values(self, name):
+        if name not in self.keys:
+            key = self.criteria[name]
+            values = {}
+            for number, entry in self.entries.iteritems():
+                values.setdefault(key(entry), set()).add(number)
+            self.keys[name] = values
+        return self.keys[name]
+
+    def _sorted_paths(self):
+        if self.paths is None:
+            key = self.criteria["path"]
+            self.paths = sorted( (key(entry), number) for number, entry
+                                 in self.entries.iteritems() )
+        return self.paths
+
+    def _path_matches(self, prefix):
+        paths = self._sorted_paths()
+        numbers = set()
+        for position in xrange(bisect_left(paths, (prefix,)), len(paths)):
+            path, number = paths[position]
+            if path is None or not path.startswith(prefix):
+                break
+            numbers.add(number)
+        return numbers
+
+    def matches(self, name, wanted):
+        """Return the numbers of the entries whose `name` passes the
+        filter `wanted`."""
+        if name == "path":
+            if callable(wanted):
+                return set( number for path, number in self._sorted_paths()
+                            if wanted(path) )
+            if isinstance(wanted, (set, frozenset, list, tuple)):
+                return set().union(*[ self._path_matches(prefix)
+                                      for prefix in wanted ])
+            return self._path_matches(wanted)
+        values = self._values(name)
+        if callable(wanted):
+            keys = [ key for key in values if wanted(key) ]
+        elif isinstance(wanted, (set, frozenset, list, tuple)):
+            keys = list(wanted)
+        else:
+            keys = [wanted]
+        if name == "mimeType":
+            keys = [ key.lower() if key else key for key in keys ]
+        if len(keys) == 1: #not copied, so it must not be changed
+            return values.get(keys[0], frozenset())
+        return set().union(*[ values.get(key, ()) for key in keys ])
+
+    def find(self, criteria):
+        for name in criteria:
+            if name not in self.criteria:
+                raise TypeError("find() got an unexpected keyword "
+                                "argument {0!r}".format(name))
+        if not criteria:
+            found = self.entries
+        else:
+            matches = sorted( (self.matches(name, wanted)
+                               for name, wanted in criteria.iteritems()),
+                              key=len )
+            found = matches[0]
+            for numbers in matches[1:]:
+                found = found & numbers
+        return [ self.entries[number] for number in sorted(found) ]
+
+
+#------------------------------------------------------------------------------
+
+
+class StringTable(object):
+    """Shares one copy of each string among the objects that hold it.
+
+    Calling the table with a string returns the copy it already has,
+    if it has one, and otherwise keeps and returns the string. Strings
+    longer than `max_length`, which are rarely repeated, are returned
+    untouched. Each Log has one, shared by its entries' header, cookie
+    and query string names and values::
+
+        In [0]: hc.log.strings.stats()
+        Out[0]: {'strings': 2113, 'hits': 1250338, 'misses': 2113,
+                 'skipped': 20840, 'hit_rate': 0.998}
+
+    """
+
+    def __init__(self, max_length=64):
+        self.max_length = max_length
+        self.looked_up = 0
+        self.skipped = 0
+        self._strings = {}
+
+    def __call__(self, value):
+        if len(value) > self.max_length:
+            self.skipped += 1
+            return value
+        self.looked_up += 1
+        return self._strings.setdefault(value, value)
+
+    @property
+    def misses(self):
+        # every miss adds a string, and none are ever taken out
+        return len(self._strings)
+
+    @property
+    def hits(self):
+        return self.looked_up - self.misses
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __repr__(self):
+        return "<StringTable of {0} strings>".format(len(self))
+
+    def stats(self):
+        """Return a dict of how many strings the table holds and how
+        often a string looked up was already there."""
+        looked_up = self.looked_up
+        return {"strings": len(self), "hits": self.hits,
+                "misses": self.misses, "skipped": self.skipped,
+                "hit_rate": float(self.hits) / looked_up if looked_up else 0.0}
+
+
+# fields of entry dicts that hold the same few values over and over
+_REPEATED_FIELDS = {"request": ("method", "httpVersion"),
+                    "response": ("statusText", "httpVersion",
+                                 "redirectURL")}
+
+
+def _intern_pairs(items, strings):
+    """Intern the name and value of each dict in the list `items`."""
+    # this runs for every header of every entry loaded, so it uses the
+    # table's dict directly and counts once at the end
+    share = strings._strings.setdefault
+    longest = strings.max_length
+    looked_up = skipped = 0
+    for item in items:
+        if type(item) is not dict:
+            continue
+        for field in ("name", "value"):
+            value = item.get(field)
+            if type(value) not in _STRING:
+                continue
+            if len(value) > longest:
+                skipped += 1
+            else:
+                item[field] = share(value, value)
+                looked_up += 1
+    strings.looked_up += looked_up
+    strings.skipped += skipped
+
+
+def _intern_entry(entry, strings):
+    """Intern the repeated strings of the entry dict `entry` in place,
+    through StringTable `strings`."""
+    pageref = entry.get("pageref")
+    if type(pageref) in _STRING:
+        entry["pageref"] = strings(pageref)
+    for part, fields in _REPEATED_FIELDS.iteritems():
+        message = entry.get(part)
+        if type(message) is not dict:
+            continue
+        for field in fields:
+            value = message.get(field)
+            if type(value) in _STRING:
+                message[field] = strings(value)
+        for field in ("headers", "cookies", "queryString"):
+            items = message.get(field)
+            if type(items) is list:
+                _intern_pairs(items, strings)
+        kid = message.get("postData")
+        if type(kid) is dict and type(kid.get("params")) is list:
+            _intern_pairs(kid["params"], strings)
+        kid = message.get("content")
+        if type(kid) is dict and type(kid.get("mimeType")) in _STRING:
+            kid["mimeType"] = strings(kid["mimeType"])
+
+
 class Log(_MetaHar):
 
+    _children = {"creator": ("Creator", False),
+                 "browser": ("Browser", False),
+                 "pages": ("Page", True),
+                 "entries": ("Entry", True)}
+    _required = {"version": _STRING,
+                 "creator": _ANY,
+                 "entries": list}
+    _optional = {"pages": list,
+                 "comment": _STRING}
+
     def validate_input(self):
-        self._has_fields("version", "creator", "entries")
-        field_defs = {"version":[unicode, str],
-                      "entries":list}
+        _MetaHar.validate_input(self)
         if self.version is '':
             self.version = "1.1"
-        if "pages" in self.__dict__:
-            field_defs["pages"] = list
-        if "comment" in self.__dict__:
-            field_defs["comment"] = [unicode, str]
-        self._check_field_types(field_defs)
 
     def _construct(self):
-        self.creator = Creator(self.creator)
-        if "browser" in self.__dict__:
-            self.browser = Browser(self.browser)
-        if "pages" in self.__dict__:
-            self.pages = [ Page(page) for page in self.pages]
-        self.entries = [ Entry(entry) for entry in self.entries]
+        # entries still loaded as dicts share their repeated strings
+        # before they are constructed, lazily or not
+        entries = self.__dict__.get("entries")
+        if type(entries) is list:
+            strings = self.strings
+            for entry in entries:
+                if type(entry) is dict:
+                    _intern_entry(entry, strings)
+        _MetaHar._construct(self)
+
+    @property
+    def strings(self):
+        """The StringTable the log's entries share strings through."""
+        strings = self.__dict__.get("_strings")
+        if strings is None:
+            strings = self._strings = StringTable()
+        return strings
 
     def set_defaults(self):
         """This method sets defaults for objects not instantiated via
@@ -514,6 +2197,96 @@ class Log(_MetaHar):
         self.creator = Creator()
         self.entries = []
 
+    def find(self, **criteria):
+        """Return the entries that match every one of `criteria`, in
+        the order they are in the log::
+
+            In [0]: log.find(host='www.google.com', status=200)
+
+            In [1]: log.find(path='/api/', method=['POST', 'PUT'],
+                             status=lambda s: s >= 500)
+
+        The criteria are host, path (values matched as a prefix), method,
+        status, mimeType (matched without its parameters) and pageref.
+        Each is a value to match, a set, list or tuple of values to
+        match any of, or a function of the value that returns True for
+        the entries to keep.
+
+        Each criterion is indexed the first time it is used, so later
+        finds take time in proportion to what they return rather than
+        to the size of the log. Appending entries to or removing them
+        from `entries` keeps the indexes up to date; call reindex()
+        after changing the fields of entries already in the log.
+
+        """
+        entries = self.entries
+        if type(entries) is not _TrackedList:
+            entries = self.entries = _TrackedList(entries)
+        if entries._index is None:
+            entries._index = _EntryIndex(entries)
+        return entries._index.find(criteria)
+
+    def reindex(self):
+        """Drop the indexes used by find, so they are rebuilt from the
+        entries as they are now."""
+        entries = self.__dict__.get("entries")
+        if type(entries) is _TrackedList:
+            entries._invalidate()
+
+    def to_columns(self, use_numpy=None):
+        """Return a dict of the timings and sizes of every entry as
+        arrays, one per field, in the order of the entries::
+
+            In [0]: columns = log.to_columns()
+
+            In [1]: numpy.nanpercentile(columns['wait'], 95)
+
+        The columns are the entry's time, blocked, dns, connect, send,
+        wait, receive and ssl from its timings, requestHeadersSize,
+        requestBodySize, status, responseBodySize and contentSize.
+        They are numpy float64 arrays if numpy is installed (or
+        `use_numpy` is True) and array.array('d') otherwise. Values
+        that are missing, not numbers, or -1 (which HAR uses for a
+        timing or size that does not apply) are set to COLUMN_MISSING,
+        which is NaN.
+
+        """
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        elif use_numpy and numpy is None:
+            raise ImportError("Log.to_columns(use_numpy=True) needs numpy")
+        missing = COLUMN_MISSING
+        numbers = (int, long, float) #but not bool
+        parts = [ part for _, (part, _) in _COLUMNS ]
+        fields = [ field for _, (_, field) in _COLUMNS ]
+        columns = [ [] for _ in _COLUMNS ]
+        appends = [ column.append for column in columns ]
+        for entry in self.entries:
+            objects = {"entry": entry,
+                       "timings": getattr(entry, "timings", None),
+                       "request": getattr(entry, "request", None),
+                       "response": getattr(entry, "response", None)}
+            objects["content"] = getattr(objects["response"], "content",
+                                         None)
+            for append, part, field in zip(appends, parts, fields):
+                value = getattr(objects[part], field, None)
+                if type(value) in numbers and value != -1:
+                    append(value)
+                else:
+                    append(missing)
+        if use_numpy:
+            return dict( (name, numpy.array(column, dtype=numpy.float64))
+                         for (name, _), column in zip(_COLUMNS, columns) )
+        return dict( (name, array('d', column))
+                     for (name, _), column in zip(_COLUMNS, columns) )
+
+    @classmethod
+    def iter_entries(cls, path_or_file, **kwargs):
+        """Return a HarStream over the entries of the HAR in
+        `path_or_file` without loading the whole log. The stream's
+        `log` attribute holds everything but the entries."""
+        return HarStream(path_or_file, **kwargs)
+
     def __repr__(self):
         try:
             return "<HAR {0} Log created by {1} {2}: {3}>".format(
@@ -530,14 +2303,9 @@ class Log(_MetaHar):
 
 class Creator(_MetaHar):
 
-    def validate_input(self):
-        self._has_fields("name",
-                         "version")
-        field_defs = {"name": [unicode, str],
-                      "version": [unicode, str]}
-        if "comment" in self.__dict__:
-            field_defs["comment"] = [unicode, str]
-        self._check_field_types(field_defs)
+    _required = {"name": _STRING,
+                 "version": _STRING}
+    _optional = {"comment": _STRING}
 
     def set_defaults(self):
         """This method sets defaults for objects not instantiated via
@@ -569,25 +2337,20 @@ class Browser(Creator):
 
 class Page(_MetaHar):
 
-    def validate_input(self):
-        self._has_fields("startedDateTime",
-                         "id",
-                         "title",
-                         "pageTimings")
-        field_defs = {"startedDateTime":[unicode, str],
-                      "id":[unicode, str],
-                      "title":[unicode, str]}
-        if "comment" in self.__dict__:
-            field_types["comment"] = [unicode, str]
-        self._check_field_types(field_defs)
-        #make sure id is uniq
+    _children = {"pageTimings": ("PageTimings", False)}
+    _required = {"startedDateTime": _DATE,
+                 "id": _STRING,
+                 "title": _STRING,
+                 "pageTimings": _ANY}
+    _optional = {"comment": _STRING}
+    #make sure id is uniq
 
     def _construct(self):
         try:
-            self.startedDateTime = parser.parse(self.startedDateTime)
+            self.startedDateTime = _parse_date(self.startedDateTime)
         except Exception, err:
             raise ValidationError("Failed to parse date: {0}".format(err))
-        self.pageTimings = PageTimings(self.pageTimings)
+        _MetaHar._construct(self)
 
     def set_defaults(self):
         """This method sets defaults for objects not instantiated via
@@ -614,15 +2377,9 @@ class Page(_MetaHar):
 
 class PageTimings(_MetaHar):
 
-    def validate_input(self):
-        field_defs = {}
-        if "onContentLoad" in self.__dict__:
-            field_defs["onContentLoad"] = int
-        if "onLoad" in self.__dict__:
-            field_defs["onLoad"] = int
-        if "comment" in self.__dict__:
-            field_defs["comment"] = [unicode, str]
-        self._check_field_types(field_defs)
+    _optional = {"onContentLoad": int,
+                 "onLoad": int,
+                 "comment": _STRING}
 
     def __repr__(self):
         return "<Page timing : {0}>".format(
@@ -634,20 +2391,21 @@ class PageTimings(_MetaHar):
 
 class Entry(_MetaHar):
 
+    _children = {"request": ("Request", False),
+                 "response": ("Response", False),
+                 "cache": ("Cache", False),
+                 "timings": ("Timings", False)}
+    _required = {"startedDateTime": _STRING,
+                 "request": _ANY,
+                 "response": _ANY,
+                 "cache": _ANY,
+                 "timings": _ANY}
+    _optional = {"pageref": _STRING,
+                 "serverIPAddress": _STRING,
+                 "connection": _STRING}
+
     def validate_input(self):
-        field_defs = {"startedDateTime":[unicode, str]}
-        self._has_fields("startedDateTime",
-                         "request",
-                         "response",
-                         "cache",
-                         "timings")
-        if "pageref" in self:
-            field_defs["pageref"] = [unicode, str]
-        if "serverIPAddress" in self:
-            field_defs["serverIPAddress"] = [unicode, str]
-        if "connection" in self:
-            field_defs["connection"] = [unicode, str]
-        self._check_field_types(field_defs)
+        _MetaHar.validate_input(self)
         if "pageref" in self and "_parent" in self and self._parent:
             for entry in self._parent.entries: #write a test case for this
                 if entry.pageref == self.pageref:
@@ -665,12 +2423,6 @@ class Entry(_MetaHar):
                                           "IP4 or IP6".format(
                                               self.serverIPAddress))
 
-    def _construct(self):
-        self.request = Request(self.request)
-        self.response = Response(self.response)
-        self.cache = Cache(self.cache)
-        self.timings = Timings(self.timings)
-
     def __repr__(self):
         return "<Entry object {0}>".format(self._get_printable_kids())
 
@@ -691,34 +2443,19 @@ class Entry(_MetaHar):
 
 class Request(_MetaHar):
 
-    def validate_input(self):
-        field_defs = {"method":[unicode, str], #perhaps these should
-                                               #be under _has_fields
-                      "url":[unicode, str],
-                      "httpVersion":[unicode, str],
-                      "headersSize":int,
-                      "bodySize":int}
-        self._has_fields("method",
-                         "url",
-                         "httpVersion",
-                         "queryString",
-                         "headersSize",
-                         "bodySize")
-        if "comment" in self.__dict__:
-            field_defs["comment"] = [unicode, str]
-        self._check_field_types(field_defs)
-
-    def _construct(self):
-        if "postData" in self.__dict__:
-            self.postData = PostData(self.postData)
-        if "headers" in self.__dict__:
-            self.headers = [ Header(header) for header in self.headers]
-            if all('_sequence' in header for header in self.headers):
-                self.headers.sort(key=lambda i: i._sequence)
-        if "cookies" in self.__dict__:
-            self.cookies = [ Cookie(cookie) for cookie in self.cookies]
-            if all('_sequence' in cookie for cookie in self.cookies):
-                self.cookies.sort(key=lambda i: i._sequence)
+    _children = {"postData": ("PostData", False),
+                 "headers": ("Header", True),
+                 "cookies": ("Cookie", True)}
+    _sequenced = ("headers", "cookies")
+    _list_types = {"headers": _HeaderList}
+    _named = {"header": "headers", "cookie": "cookies"}
+    _required = {"method": _STRING,
+                 "url": _STRING,
+                 "httpVersion": _STRING,
+                 "queryString": _ANY,
+                 "headersSize": int,
+                 "bodySize": int}
+    _optional = {"comment": _STRING}
 
     def set_defaults(self):
         """This method sets defaults for objects not instantiated via
@@ -743,101 +2480,84 @@ class Request(_MetaHar):
                         "httpVersion": "HTTP/1.1"})
 
     def set_header(self, name, value):
-        """Sets a header to a specific value. NOTE: This operates by
-        rebuilding the header list so if two headers have the same
-        name they will both be removed and replaced with the new one
-        """
-        #this sucks and is a horrible way to do things.
-        #also doens't take in to account sequence.. fuck
-        #
-        #there's a more pythonic way to do this....
-        try:
-            headers = [ header for header in self.headers
-                        if not header.name == name ]
-            h = [ header for header in self.headers
-                        if header.name == name ][0]
-            h.value = value
-        except:
-            pass
-        else:
-            h = Header({"name":name, "value":value})
-        headers.append(h)
+        """Sets a header to a specific value. NOTE: if two headers
+        have the same name, in any case, the first keeps its place
+        with the new value and the other is removed. A header that
+        is not there is added at the end."""
+        return _header_list(self).set(name, value)
 
     def __repr__(self):
         return "<Request to '{0}': {1}>".format(
             self._get("url"),
             self._get_printable_kids())
 
-    def devour(self, req, proto='http', comment='', keep_b64_raw=False):
+    def devour(self, req, proto='http', comment='', keep_b64_raw=False,
+               strings=None):
+        """Load the request from the raw HTTP request `req`, a str or
+        a bytearray or memoryview fresh off a socket.
+
+        The message is parsed where it lies: only its head is copied
+        out of a buffer, and headers are kept as offsets in to it
+        until they are first accessed. Every header is kept, in order
+        and as it was written, so that puke() returns the request
+        exactly as it was read. Repeated strings are shared through
+        StringTable `strings`, such as a Log's, if it is given.
+
+        """
         # Raw request does not have proto info
-        assert len(req.strip()), "Empty request cannot be devoured"
+        head, body_start = _message_head(req)
+        assert len(head.strip()), "Empty request cannot be devoured"
         if keep_b64_raw:
-            self._b64_raw_req = req.encode('base64') #just to be sure we're
-                                                     #keeping a copy
-                                                     #of the raw
-                                                     #request by
-                                                     #default. This is
-                                                     #a person
-                                                     #extension to the
-                                                     #spec.
-                                                     #
-                                                     #This is not default
-        req = StringIO(req)
-        #!!! this doesn't always happen
-        method, path, httpVersion = req.next().strip().split()
+            #just to be sure we're keeping a copy of the raw request.
+            #This is a person extension to the spec, and is not default
+            self._b64_raw_req = _slice(req, 0, len(req)).encode('base64')
+        line, eol, headers = _split_head(head, strings)
         #some people ignore the spec, this needs to be handled.
+        method, path, httpVersion = line.split(None, 2)
+        if strings is not None:
+            method, httpVersion = strings(method), strings(httpVersion)
         self.method = method
         self.httpVersion = httpVersion
-        self.bodySize = 0
-        self.headers = []
-        postData = None
-        if method == "POST":
-            postData = {"params":[],
-                        "mimeType":"",
-                        "text":""}
-        seq = 0
-        for header in req: #make these the same for request and
-                           #response... this is stupid
-            header = header.strip()
-            if not ( header and ": " in header):
-                break
-            header = dict(zip(["name", "value"], header.split(': ')))
-            #length should be calculated for each request unless
-            #explicitly set.
-            #!!! remember to note this in docs so it's no suprise.
-            if header["name"] == "Content-Length":
-                self.bodySize = header["value"]
-                continue
-            if header["name"] == "Content-Type":
-                postData["mimeType"] = header["value"]
-                continue
-            if header["name"] == "Host":
-                self.url = '{0}://{1}{2}'.format(proto, header["value"], path)
-            header["_sequence"] = seq
-            self.headers.append(Header(header))
-            seq += 1
-        headerSize = req.tell()
-        seq = 0
-        if postData:
-            body = req.read(int(self.bodySize))
-            if postData["mimeType"] == "application/x-www-form-urlencoded":
-                seq = 0
-                for param in body.split('&'):
-                    if "=" in param:
-                        name, value = param.split('=', 1) #= is a valid
-                                                          #character in
-                                                          #values
-                    else:
-                        name = param
-                        value = ""
-                    param = {"name": name, "value": value}
-                    # build unit test for empty values
-                    param["_sequence"] = seq
-                    postData["params"].append(param)
-                    seq += 1
-            else:
-                postData["text"] = body
-            self.postData = PostData(postData)
+        if line != "{0} {1} {2}".format(method, path, httpVersion):
+            self._requestLine = line
+        if eol != "\r\n":
+            self._eol = eol
+        if comment:
+            self.comment = comment
+        self.__dict__.pop("headers", None)
+        self.__dict__.setdefault("_pending", {})["headers"] = headers
+        host = headers.get("Host")
+        if "://" in path or host is None:
+            self.url = path
+        else:
+            self.url = '{0}://{1}{2}'.format(proto, host, path)
+        query = path.partition("?")[2].partition("#")[0]
+        self.queryString = []
+        params = _split_params(query)
+        if strings is not None:
+            _intern_pairs(params, strings)
+        for param in params:
+            param.setdefault("value", "")
+            self.queryString.append(QueryString(param))
+        self.cookies = []
+        self.headersSize = body_start
+        body, self.bodySize = _message_body(req, body_start, headers)
+        if method == "POST" or body:
+            self.postData = self._devour_body(
+                body, headers.get("Content-Type") or "", strings)
+
+    def _devour_body(self, body, mime_type, strings=None):
+        postData = {"params": [],
+                    "mimeType": mime_type,
+                    "text": ""}
+        if (mime_type.split(";", 1)[0].strip().lower() !=
+            "application/x-www-form-urlencoded"):
+            postData["text"] = body
+            return PostData(postData)
+        postData["params"] = _split_params(body)
+        if strings is not None:
+            _intern_pairs(postData["params"], strings)
+        return PostData(postData)
 
     def render(self):
         """Return a string that should be exactly equal to the
@@ -855,29 +2575,43 @@ class Request(_MetaHar):
         for node in ["url", "httpVersion", "headers"]:
             assert node in self, \
                    "Cannot render request with unspecified {0}".format(node)
-        path = '/' + '/'.join(self.url.split("/")[3:]) #this kind of sucks....
-        #this really sucks... do this smarter
-        r = "{0} {1} {2}\r\n".format(self.method, path, self.httpVersion)
-        #!!! not always clear in code where to use self vs self.__dict__
-        #!!! need to fix things so always use one or the other, or is clear
-        if self.headers:
-            #these may need to be capitalized. should be fixed in spec.
-            r += "\r\n".join( h.name + ": "+ h.value
-                            for h in self.headers)
-            r += "\r\n"
+        eol = getattr(self, "_eol", "\r\n")
+        path = _request_target(self.url)
+        r = "{0} {1} {2}".format(self.method, path, self.httpVersion)
+        line = getattr(self, "_requestLine", None)
+        if line:
+            words = line.split(None, 2)
+            if (words[0] == self.method and words[-1] == self.httpVersion
+                and words[1] in (path, self.url)):
+                r = line
+        r += eol
+        raw = self.__dict__.get("_pending", {}).get("headers")
+        if type(raw) is _RawHeaders:
+            #never accessed, so still exactly as devoured
+            r += raw.text()
+            header = raw.get
+        else:
+            headers = _header_list(self)
+            r += "".join(_header_line(h, eol) for h in headers)
+            header = headers.get
         body = ''
         if 'postData' in self and self.postData:
-            if not "Content-Type" in self.headers:
-                r += "Content-Type: {0}\r\n".format(self.postData.mimeType)    
-            joined_params = "&".join( p.name + (p.value and ("="+ p.value))
-                                      for p in self.postData.params)
+            if (header("Content-Type") is None and
+                self.postData.mimeType):
+                r += "Content-Type: {0}{1}".format(self.postData.mimeType,
+                                                   eol)
+            joined_params = "&".join(
+                p.name + ("" if p.value is None else "=" + p.value)
+                for p in self.postData.params)
             body = self.postData.text or joined_params
-            if not "Content-Length" in self.headers:
-                r += "Content-Length: {0}\r\n".format(len(body))
-        r += "\r\n"
+            if _chunked(header("Transfer-Encoding")):
+                #sent again as one chunk
+                body = "{0:x}\r\n{1}\r\n0\r\n\r\n".format(
+                    len(body), body) if body else "0\r\n\r\n"
+            elif header("Content-Length") is None:
+                r += "Content-Length: {0}{1}".format(len(body), eol)
+        r += eol
         r += body
-        if body:
-            r += "\r\n"
         return r
 
 
@@ -886,28 +2620,22 @@ class Request(_MetaHar):
 
 class Response(_MetaHar):
 
-    def validate_input(self):
-        field_defs = {"status":int,
-                      "statusText":[unicode,str],
-                      "httpVersion":[unicode,str],
-                      "cookies":list,
-                      "headers":list,
-                      "redirectURL":[unicode,str],
-                      "headersSize":int,
-                      "bodySize":int}
-        self._has_fields("status",
-                         "statusText",
-                         "httpVersion",
-                         "cookies",
-                         "headers",
-                         "content",
-                         "redirectURL",
-                         "headersSize",
-                         "bodySize")
-        if "comment" in self.__dict__:    #there's a better way to do this...
-            field_defs["comment"] = [unicode, str]
-
-        self._check_field_types(field_defs)
+    _children = {"postData": ("PostData", False),
+                 "headers": ("Header", True),
+                 "cookies": ("Cookie", True),
+                 "content": ("Content", False)}
+    _list_types = {"headers": _HeaderList}
+    _named = {"header": "headers", "cookie": "cookies"}
+    _required = {"status": int,
+                 "statusText": _STRING,
+                 "httpVersion": _STRING,
+                 "cookies": list,
+                 "headers": list,
+                 "content": _ANY,
+                 "redirectURL": _STRING,
+                 "headersSize": int,
+                 "bodySize": int}
+    _optional = {"comment": _STRING}
 
     def __repr__(self):
         # I need to make the naming thing a function....
@@ -916,75 +2644,43 @@ class Response(_MetaHar):
             self._get("statusText"),
             self._get_printable_kids())
 
-    def _construct(self):
-        if "postData" in self:
-            self.postData = PostData(self.postData)
-        if "headers" in self:
-            self.headers = [ Header(header) for header in self.headers]
-        if "cookies" in self:
-            self.cookies = [ Cookie(cookie) for cookie in self.cookies]
-
-    def devour(self, res, proto='http', comment='', keep_b64_raw=False):
+    def devour(self, res, proto='http', comment='', keep_b64_raw=False,
+               strings=None):
+        """Load the response from the raw HTTP response `res`, a str or
+        a bytearray or memoryview, parsed as Request.devour does. A
+        chunked body is stored with the chunking removed."""
         # Raw request does not have proto info
-        assert len(res.strip()), "Empty response cannot be devoured"
+        head, body_start = _message_head(res)
+        assert len(head.strip()), "Empty response cannot be devoured"
         if keep_b64_raw:
-            self._b64_raw_req = res.encode('base64') #just to be sure we're
-                                                     #keeping a copy of the
-                                                     #raw request by
-                                                     #default. This is a
-                                                     #person extension to
-                                                     #the spec.
-        res = StringIO(res)
-        line = res.next().strip().split()
-        httpVersion = line[0]
-        status = line[1]
-        statusText  =  " ".join(line[2:])
-        self.status = status
-        self.statusText = statusText
-        self.httpVersion = httpVersion
-        self.bodySize = 0
-        self.headers = []
+            #just to be sure we're keeping a copy of the raw response.
+            #This is a person extension to the spec.
+            self._b64_raw_req = _slice(res, 0, len(res)).encode('base64')
+        line, eol, headers = _split_head(head, strings)
+        line = line.split(None, 2)
+        if strings is not None:
+            line = [ strings(part) for part in line ]
+        self.httpVersion = line[0]
+        self.status = int(line[1])
+        self.statusText = line[2] if len(line) > 2 else ""
+        if comment:
+            self.comment = comment
+        self.__dict__.pop("headers", None)
+        self.__dict__.setdefault("_pending", {})["headers"] = headers
         self.cookies = []
-        seq = 0
-        encoding = None
-        content = {"size":0,
-                   "mimeType":""}
-        for line in res:
-            line = line.strip()
-            if not ( line and ": " in line):
-                break
-            header = dict(zip(["name", "value"], line.strip().split(': ')))
-            if header["name"] == "Content-Length":
-                self.bodySize = header["value"]
-                continue
-            elif header["name"] == "Content-Type":
-                # will need to keep an eye out for content type and encoding
-                content["mimeType"] = header["value"]
-                continue
-            elif header["name"] == "Content-Encoding":
-                encoding = content["encoding"] = header["value"]
-            elif header["name"] == "Host":
-                self.url = '{0}://{1}{2}'.format(proto, header["value"], path)
-            elif header["name"] == "Location":
-                self.redirectURL = header["value"]
-            elif header["name"] == "Set-Cookie":
-                cookie = Cookie()
-                cookie.devour(line.strip())
-                self.cookies.append(cookie)
-            header["_sequence"] = seq
-            self.headers.append(Header(header))
-            seq += 1
-        self.headerSize = res.tell()
-        content["text"] = res.read(int(self.bodySize))
-        try:
-            content["text"] = content["text"].encode('utf8')
-        except UnicodeDecodeError:
-            content["text"] = content["text"].encode('base64')
-            if encoding:
-                content["encoding"] =  encoding + "; base64"
-            else:
-                content["encoding"] =  "base64"
-        self.content = Content(content)
+        for value in headers.values("Set-Cookie"):
+            cookie = Cookie()
+            cookie.devour("Set-Cookie: " + value)
+            if strings is not None:
+                cookie.name = strings(cookie.name)
+                cookie.value = strings(cookie.value)
+            self.cookies.append(cookie)
+        self.redirectURL = headers.get("Location") or ""
+        self.headersSize = body_start
+        body, self.bodySize = _message_body(res, body_start, headers)
+        self.content = Content(empty=True)
+        self.content.devour(body, headers.get("Content-Type") or "",
+                            headers.get("Content-Encoding"))
 
     def render(self):
         return self.puke()
@@ -996,28 +2692,25 @@ class Response(_MetaHar):
 #------------------------------------------------------------------------------
 
 
-class Cookie(_MetaHar):
+class Cookie(_CompactHar):
 
-    def validate_input(self): #default behavior
-        field_types = {"name":[unicode, str],
-                       "value":[unicode, str]}
-        self._has_fields(*field_types.keys())
-        for field in ["comment", "path", "domain"]:
-            if field in self.__dict__:
-                field_types[field] = [unicode, str]
-        for field in ["httpOnly", "secure"]:
-            if field in self.__dict__:
-                field_types[field] = bool
-        # Handle fields which can be null, or not set.
-        for field in ["expires"]:
-            if field in self.__dict__:
-                field_types[field] = [unicode, str, type(None)]
-        self._check_field_types(field_types)
+    __slots__ = ("name", "value", "path", "domain", "expires", "httpOnly",
+                 "secure", "comment", "_sequence")
+    _field_slots = __slots__
+    _required = {"name": _STRING,
+                 "value": _STRING}
+    _optional = {"comment": _STRING,
+                 "path": _STRING,
+                 "domain": _STRING,
+                 "httpOnly": bool,
+                 "secure": bool,
+                 # expires can be null, or not set.
+                 "expires": _DATE + (type(None),)}
 
     def _construct(self):
         if "expires" in self:
             try:
-                self.expires = parser.parse(self.expires)
+                self.expires = _parse_date(self.expires)
             except Exception, err:
                 raise ValidationError("Failed to parse date: {0}".format(err))
 
@@ -1039,7 +2732,7 @@ class Cookie(_MetaHar):
         for attr in values[1:]:
             if '=' in attr:
                 name, value = attr.split('=', 1)
-                self.__dict__[name.lower()] = value
+                setattr(self, name.lower(), value)
             else:
                 if attr == "Secure":
                     self.secure = True
@@ -1051,14 +2744,16 @@ class Cookie(_MetaHar):
 
 
 class Header(_KeyValueHar):
-    pass
+
+    __slots__ = ()
 
 
 #------------------------------------------------------------------------------
 
 
 class QueryString(_KeyValueHar):
-    pass
+
+    __slots__ = ()
 
 
 #------------------------------------------------------------------------------
@@ -1066,20 +2761,13 @@ class QueryString(_KeyValueHar):
 
 class PostData(_MetaHar):
 
-    def validate_input(self):
-        field_types = {"mimeType":[unicode, str],
-                       "params":list,
-                       "text":[unicode, str]}
-        self._has_fields(*field_types.keys())
-        if "comment" in self.__dict__:
-            field_types["comment"] = [unicode, str]
-        self._check_field_types(field_types)
-
-    def _construct(self):
-        if "params" in self.__dict__:
-            self.params = [ Param(param) for param in self.params]
-            if all('_sequence' in param for param in self.params):
-                self.params.sort(key=lambda i: i._sequence)
+    _children = {"params": ("Param", True)}
+    _sequenced = ("params",)
+    _named = {"param": "params"}
+    _required = {"mimeType": _STRING,
+                 "params": list,
+                 "text": _STRING}
+    _optional = {"comment": _STRING}
 
 
 #------------------------------------------------------------------------------
@@ -1087,13 +2775,14 @@ class PostData(_MetaHar):
 
 class Param(_KeyValueHar):
 
-    def validate_input(self): #default behavior
-        field_types = {"name":[unicode, str]}
-        self._has_fields(*field_types.keys())
-        for field in ["value", "fileName", "contentType", "comment"]:
-            if field in self.__dict__:
-                field_types[field] = [unicode, str]
-        self._check_field_types(field_types)
+    __slots__ = ("fileName", "contentType")
+    _field_slots = _KeyValueHar._field_slots + __slots__
+    _required = {"name": _STRING}
+    # value is null for a param sent without one, as in 'a&b=1'
+    _optional = {"value": _STRING + (type(None),),
+                 "fileName": _STRING,
+                 "contentType": _STRING,
+                 "comment": _STRING}
 
     def _construct(self):
         if not "value" in self:
@@ -1102,7 +2791,7 @@ class Param(_KeyValueHar):
     def __repr__(self):
         return "<{0} {1}: {2}>".format(
             self.__class__.__name__,
-            'name' in self.__dict__ and self.name or "[undefined]",
+            getattr(self, 'name', None) or "[undefined]",
             self._get_printable_kids())
 
 
@@ -1111,38 +2800,181 @@ class Param(_KeyValueHar):
 
 class Content(_MetaHar):
 
-    def validate_input(self):
-        self._has_fields("size",
-                         "mimeType")
-        field_types = {"size":int,
-                      "mimeType":[unicode, str]}
-        if "compression" in self.__dict__:
-            field_types["compression"] = int
-        for field in ["text", "encoding", "comment"]:
-            if field in self.__dict__:
-                field_types[field] = [unicode, str]
-        self._check_field_types(field_types)
+    _required = {"size": int,
+                 "mimeType": _STRING}
+    _optional = {"compression": int,
+                 "text": _STRING,
+                 "encoding": _STRING,
+                 "comment": _STRING}
+    # fields of a devoured body that are worked out when first wanted
+    _lazy = ("size", "compression", "text", "encoding")
 
     def __repr__(self):
         return "<Content {0}>".format(self.mimeType)
 
+    def devour(self, body, mime_type="", content_encoding=None):
+        """Load the content from the raw response body `body`, as it
+        was sent with Content-Encoding `content_encoding`.
+
+        The body is kept as it is, once. It is decompressed the first
+        time `body` or `size` is wanted, and is only turned in to text,
+        base64 encoded if it is binary, the first time `text` is.
+        Bodies that would decompress to more than CONTENT_MAX_SIZE
+        bytes, or cannot be decompressed, are kept compressed, their
+        text base64 encoded with an encoding such as 'gzip; base64'.
+
+        If BODY_STORE is set the body is decompressed straight away
+        and spilled in to it.
+
+        """
+        for name in self._lazy + ("_bodyRef",):
+            self.__dict__.pop(name, None)
+        self.mimeType = mime_type
+        self._raw = body
+        self._coding = content_encoding
+        if BODY_STORE is not None:
+            self.spill(BODY_STORE)
+
+    def spill(self, store=None):
+        """Move the body in to BodyStore `store`, or BODY_STORE, if it
+        is at least the store's threshold in size, keeping a reference
+        to it in `_bodyRef`. Return True if it was moved."""
+        store = store or BODY_STORE
+        fields = self.__dict__
+        if store is None or "_bodyRef" in fields:
+            return False
+        body = self.body
+        if body is None: #loaded, so the body is the text
+            encoding = fields.get("encoding")
+            text = fields.get("text")
+            if text is None or encoding not in (None, "base64"):
+                return False
+            body = (text.decode('base64') if encoding else
+                    text.encode('utf8') if type(text) is unicode else text)
+        if len(body) < store.threshold:
+            return False
+        self.size = len(body)
+        if "_raw" in fields or "_body" in fields:
+            encoding = getattr(self, "encoding", None)
+            if encoding:
+                self.encoding = encoding
+        for name in ("_raw", "_body", "_coding", "_binary", "text"):
+            fields.pop(name, None)
+        self._bodyRef = store.put(body)
+        self._store = store
+        return True
+
+    def _stored(self):
+        """Return the body kept in the body store."""
+        store = self.__dict__.get("_store") or BODY_STORE
+        if store is None:
+            raise ValueError("The body of this content is in a body "
+                             "store, but no BODY_STORE is set")
+        return store.get(self._bodyRef)
+
+    def __getattr__(self, name):
+        fields = self.__dict__
+        if "_bodyRef" in fields and name in ("_body", "text"):
+            body = self._stored()
+            if name == "text" and "encoding" in fields:
+                return body.encode('base64')
+            return body
+        if name == "_body" and "_raw" in fields:
+            self._inflate()
+            return fields["_body"]
+        if name in self._lazy and ("_raw" in fields or "_body" in fields):
+            body = self._body
+            if name == "size":
+                self.size = len(body)
+                return self.size
+            if name == "text" or name == "encoding":
+                if "_binary" not in fields:
+                    self._binary = bool(fields.get("_coding") or
+                                        not _is_utf8(body))
+                if name == "text":
+                    if not self._binary:
+                        self.text = body
+                        return body
+                    return body.encode('base64')
+                if self._binary:
+                    coding = fields.get("_coding")
+                    return coding + "; base64" if coding else "base64"
+        return _MetaHar.__getattr__(self, name)
+
+    @property
+    def body(self):
+        """The body as bytes, decompressed, or None if the content was
+        not devoured."""
+        try:
+            return self._body
+        except AttributeError:
+            return None
+
+    def _inflate(self):
+        """Undo the Content-Encoding of the devoured body."""
+        fields = self.__dict__
+        raw = body = fields.pop("_raw")
+        coding = fields.get("_coding")
+        codings = [ c.strip().lower() for c in (coding or "").split(",")
+                    if c.strip() and c.strip().lower() != "identity" ]
+        for name in reversed(codings):
+            body = _decompress(body, name, CONTENT_MAX_SIZE)
+            if body is None:
+                body = raw
+                break
+        else:
+            fields.pop("_coding", None)
+            if codings:
+                self.compression = len(body) - len(raw)
+        self._body = body
+
+    def _lazy_items(self):
+        for name in self._lazy:
+            if name not in self.__dict__:
+                try:
+                    yield name, getattr(self, name)
+                except AttributeError:
+                    pass
+
+    def to_dict(self, inline_bodies=None):
+        if "_bodyRef" in self.__dict__:
+            fields = _MetaHar.to_dict(self)
+            if inline_bodies is None:
+                inline_bodies = INLINE_BODIES
+            if inline_bodies:
+                fields["text"] = self.text
+                del fields["_bodyRef"]
+            return fields
+        if "_raw" not in self.__dict__ and "_body" not in self.__dict__:
+            return _MetaHar.to_dict(self)
+        self._body #decompressing it fills in compression
+        fields = _MetaHar.to_dict(self)
+        fields.update(self._lazy_items())
+        return fields
+
+    def _field_dict(self):
+        if "_raw" in self.__dict__ or "_body" in self.__dict__:
+            return self.to_dict()
+        return self.__dict__
+
+    def _get_printable_kids(self):
+        kids = _MetaHar._get_printable_kids(self)
+        if "_raw" in self.__dict__ or "_body" in self.__dict__:
+            if type(kids) is not tuple:
+                kids = ()
+            if "text" not in kids:
+                kids += ("text",)
+        return kids
+
 
 #------------------------------------------------------------------------------
 
 
 class Cache(_MetaHar):
 
-    def validate_input(self):
-        field_types = {}
-        if "comment" in self.__dict__:
-            field_types["comment"] = [unicode, str]
-        self._check_field_types(field_types)
-
-    def _construct(self):
-        for field in ["beforeRequest", "afterRequest"]:
-            if field in self.__dict__:
-                self.__dict__[field] = RequestCache(
-                    self.__dict__.get(field)) #what am I doing.....
+    _children = {"beforeRequest": ("RequestCache", False),
+                 "afterRequest": ("RequestCache", False)}
+    _optional = {"comment": _STRING}
 
     def __repr__(self):
         return "<Cache: {0}>".format(
@@ -1152,35 +2984,1047 @@ class Cache(_MetaHar):
 
 class RequestCache(_MetaHar):
 
-    def validate_input(self):
-        field_types = {"lastAccess":[unicode, str],
-                       "eTag":[unicode, str],
-                       "hitCount": int}
-        self._has_fields(*field_types.keys())
-        if "expires" in self.__dict__:
-            field_types["expires"] = [unicode, str]
-        if "comment" in self.__dict__:
-            field_types["comment"] = [unicode, str]
-        self._check_field_types(field_types)
-
-        #!!!needs  __repr__
+    _required = {"lastAccess": _STRING,
+                 "eTag": _STRING,
+                 "hitCount": int}
+    _optional = {"expires": _STRING,
+                 "comment": _STRING}
+
+    #!!!needs  __repr__
 
 #------------------------------------------------------------------------------
 
 class Timings(_MetaHar):
 
-    def validate_input(self):
-        field_defs = {"send":int,
-                      "wait":int,
-                      "receive":int}
-        self._has_fields(*field_defs.keys())
-        self._check_field_types(field_defs)
+    _required = {"send": int,
+                 "wait": int,
+                 "receive": int}
 
     def __repr__(self):
         return "<Timings: {0}>".format(
             self._get_printable_kids())
 
 
+def _compile_schemas(cls=None):
+    """Compile the schema of every HAR class up front."""
+    for sub in (cls or _MetaHar).__subclasses__():
+        _schema(sub)
+        _compile_schemas(sub)
+
+_compile_schemas()
+
+
+###############################################################################
+# Request Templates
+###############################################################################
+
+
+def _point_key(key):
+    """Return the name a template knows point `key` by, which for
+    headers is the lower cased name with `-` for `_`."""
+    if key.startswith("header__"):
+        return "header__" + key[8:].lower().replace("_", "-")
+    return key
+
+
+def _bytes(text):
+    return text.encode("utf-8") if type(text) is unicode else text
+
+
+class RequestTemplate(object):
+    """A Request rendered once in to the constant parts of its raw
+    form and the injection points between them, so that many variants
+    of it can be rendered without rendering the whole request each
+    time.
+
+    Points are named like the nested targets of replace: `path__0` is
+    the first segment of the path, `query__id` and `param__id` are the
+    values of a query or form param and `header__Cookie` is the value
+    of a header. Header names match in any case, and `_` matches `-`.
+    Every point is marked unless `points` names the ones wanted. A
+    point that occurs more than once, such as a repeated header, is
+    filled in everywhere it occurs.
+
+    render returns the raw request as bytes, with the points given
+    substituted and the rest as puke would render it. When a form
+    param is substituted the Content-Length, or the size of the chunk
+    of a chunked body, is worked out again::
+
+        In [0]: t = RequestTemplate(r)
+
+        In [1]: t.points
+        Out[1]: ['path__0', 'query__id', 'header__host', ...]
+
+        In [2]: for raw in t.render_all({'query__id': str(i)}
+                                        for i in xrange(100000)):
+           ...:     send(raw)
+
+    """
+
+    def __init__(self, request, points=None):
+        self.points = []
+        self._wanted = (None if points is None
+                        else set(_point_key(p) for p in points))
+        self._parts = []
+        self._open = False
+        self._slots = {}
+        self._body = None
+        self._body_points = set()
+        self._length = None
+        self._chunk = None
+        self._compile(request)
+        del self._wanted, self._open
+
+    def _constant(self, text):
+        if self._open:
+            self._parts[-1] += _bytes(text)
+        else:
+            self._parts.append(_bytes(text))
+            self._open = True
+
+    def _part(self, text):
+        """Add `text` as a part of its own and return its position."""
+        self._parts.append(_bytes(text))
+        self._open = False
+        return len(self._parts) - 1
+
+    def _point(self, key, value):
+        key = _point_key(key)
+        if self._wanted is not None and key not in self._wanted:
+            self._constant(value)
+            return
+        if key not in self._slots:
+            self._slots[key] = []
+            self.points.append(key)
+        self._slots[key].append(self._part(value))
+
+    def _pairs(self, kind, text):
+        for i, pair in enumerate(text.split("&")):
+            if i:
+                self._constant("&")
+            name, equals, value = pair.partition("=")
+            if equals:
+                self._constant(name + "=")
+                self._point(kind + "__" + name, value)
+            else:
+                self._constant(pair)
+
+    def _target(self, target):
+        path, question, query = target.partition("?")
+        start = path.find("/", path.find("://") + 3) if "://" in path else 0
+        if start < 0 or not path.startswith("/", start):
+            self._constant(path)
+        else:
+            self._constant(path[:start])
+            for i, segment in enumerate(path[start + 1:].split("/")):
+                self._constant("/")
+                self._point("path__{0}".format(i), segment)
+        if question:
+            self._constant("?")
+            self._pairs("query", query)
+
+    def _compile(self, request):
+        for node in ["url", "httpVersion", "headers"]:
+            assert node in request, \
+                   "Cannot render request with unspecified {0}".format(node)
+        eol = getattr(request, "_eol", "\r\n")
+        target = _request_target(request.url)
+        before, after = request.method + " ", " " + request.httpVersion
+        line = getattr(request, "_requestLine", None)
+        if line:
+            words = line.split(None, 2)
+            if (words[0] == request.method and
+                words[-1] == request.httpVersion and
+                words[1] in (target, request.url)):
+                target = words[1]
+                start = line.index(target, len(words[0]))
+                before, after = line[:start], line[start + len(target):]
+        self._constant(before)
+        self._target(target)
+        self._constant(after + eol)
+        headers = _header_list(request)
+        post = request.postData if "postData" in request else None
+        chunked = post and _chunked(headers.get("Transfer-Encoding"))
+        for header in headers:
+            self._constant("{0}{1}".format(header.name,
+                                           getattr(header, "_separator",
+                                                   ": ")))
+            if (post and not chunked and self._length is None and
+                header.name.lower() == "content-length"):
+                # kept a part of its own, to be worked out again
+                self._open = False
+                self._point("header__" + header.name, header.value)
+                self._length = len(self._parts) - 1
+                self._open = False
+            else:
+                self._point("header__" + header.name, header.value)
+            self._constant(getattr(header, "_eol", eol))
+        if not post:
+            self._constant(eol)
+            return
+        if headers.get("Content-Type") is None and post.mimeType:
+            self._constant("Content-Type: {0}{1}".format(post.mimeType, eol))
+        form = not post.text or (
+            post.mimeType.split(";", 1)[0].strip().lower() ==
+            "application/x-www-form-urlencoded")
+        body = post.text or "&".join(
+            p.name + ("" if p.value is None else "=" + p.value)
+            for p in post.params)
+        if not chunked and self._length is None:
+            self._constant("Content-Length: ")
+            self._length = self._part(str(len(_bytes(body))))
+            self._constant(eol)
+        self._constant(eol)
+        if chunked:
+            self._chunk = self._part("{0:x}\r\n".format(len(_bytes(body)))
+                                     if body else "")
+        self._open = False
+        start = len(self._parts)
+        if form and body:
+            before = set(self._slots)
+            self._pairs("param", body)
+            self._body_points = set(self._slots) - before
+        else:
+            self._constant(body)
+        self._body = (start, len(self._parts))
+        if chunked:
+            self._part("\r\n0\r\n\r\n" if body else "0\r\n\r\n")
+
+    def render(self, substitutions=None, **kwargs):
+        """Return the raw request with the points named by the keys
+        of `substitutions`, or by the keyword arguments, set to their
+        values."""
+        parts = self._parts[:]
+        slots = self._slots
+        body = False
+        length = self._length
+        for key, value in (substitutions or kwargs).iteritems():
+            positions = slots.get(key)
+            if positions is None:
+                key = _point_key(key)
+                positions = slots.get(key)
+                if positions is None:
+                    raise KeyError("No point {0!r} in the template"
+                                   .format(key))
+            if type(value) is unicode:
+                value = value.encode("utf-8")
+            for i in positions:
+                parts[i] = value
+                if i == length:
+                    length = None
+            if key in self._body_points:
+                body = True
+        if body:
+            start, stop = self._body
+            size = sum(len(part) for part in parts[start:stop])
+            if self._chunk is not None:
+                parts[self._chunk] = "{0:x}\r\n".format(size) if size else ""
+                parts[stop] = "\r\n0\r\n\r\n" if size else "0\r\n\r\n"
+            elif length is not None:
+                parts[length] = str(size)
+        return "".join(parts)
+
+    def render_all(self, substitutions):
+        """Return a generator of the raw requests rendered with each of
+        the dicts in `substitutions` in turn."""
+        render = self.render
+        for subs in substitutions:
+            yield render(subs)
+
+
+###############################################################################
+# Streaming
+###############################################################################
+
+
+def _seekable(fd):
+    """Return True if the file object `fd` can be rewound."""
+    try:
+        fd.seek(fd.tell())
+    except (IOError, AttributeError, ValueError):
+        return False
+    return True
+
+
+class _JsonScanner(object):
+    """Incremental tokenizer for a file containing json.
+
+    Only the structure needed to walk a HAR (objects, arrays and their
+    keys) is tokenized here. Values are handed to the json module
+    once they are completely buffered, so at most about one value
+    plus one chunk is held in memory at a time, and values that are
+    skipped are only scanned for where they end.
+
+    """
+
+    _decoder = json.JSONDecoder()
+    _ws_re = re.compile(r'[ \t\n\r]*')
+    #everything up to the next bracket outside a string, or the opening
+    #quote of a string cut off by the end of the buffer
+    _token_re = re.compile(r'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"'
+                           r'[^"\[\]{}]*)*(["\[\]{}])', re.S)
+    #everything up to the end of, or an escape in, a string
+    _string_re = re.compile(r'[^"\\]*(["\\])')
+    _scalar_re = re.compile(r'[^,:\[\]{}" \t\n\r]*')
+
+    def __init__(self, fd, chunk_size=CHUNK_SIZE):
+        self.fd = fd
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.offset = 0 #file offset of buf[0]
+        self.eof = False
+        if _seekable(fd):
+            self.offset = fd.tell()
+
+    def tell(self):
+        """Return the file offset of the next unread byte."""
+        return self.offset + self.pos
+
+    def seek(self, offset):
+        self.fd.seek(offset)
+        self.buf = ''
+        self.pos = 0
+        self.offset = offset
+        self.eof = False
+
+    def _fill(self, size=None):
+        """Read `size` more bytes (a chunk by default), dropping
+        everything before self.pos. Returns False at the end of the
+        file."""
+        if self.eof:
+            return False
+        chunk = self.fd.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.offset += self.pos
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character without
+        consuming it. Returns '' at the end of the file."""
+        while True:
+            self.pos = self._ws_re.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError("Expected one of {0!r} at offset {1} but "
+                             "found {2!r}".format(chars, self.tell(), char))
+        self.pos += 1
+        return char
+
+    def _decode(self):
+        """Decode the value at the current position, reading as much
+        of the file as it takes to complete it. Returns the value and
+        the file offset it started at."""
+        if not self.peek():
+            raise ValueError("Unexpected end of file at offset {0}".format(
+                self.tell()))
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                #the value is incomplete, grow the buffer geometrically
+                #so large values are not re-parsed too many times
+                if not self._fill(max(self.chunk_size,
+                                      len(self.buf) - self.pos)):
+                    raise
+                continue
+            if end == len(self.buf) and self._fill():
+                continue #a number may continue in the next chunk
+            start = self.tell()
+            self.pos = end
+            return value, start
+
+    def skip_value(self):
+        """Move past the next value without decoding it, holding no
+        more than a chunk of it in memory. Returns the (start, end)
+        file offsets of the value. Only the brackets and strings of
+        the value are checked, as far as it takes to find its end."""
+        char = self.peek()
+        if not char:
+            raise ValueError("Unexpected end of file at offset {0}".format(
+                self.tell()))
+        start = self.tell()
+        if char not in '"[{':
+            while True:
+                self.pos = self._scalar_re.match(self.buf, self.pos).end()
+                if self.pos < len(self.buf) or not self._fill():
+                    break
+            if self.tell() == start:
+                raise ValueError("Expected a value at offset {0} but found "
+                                 "{1!r}".format(start, char))
+            return start, self.tell()
+        depth = 0
+        in_string = char == '"'
+        self.pos += 1
+        if not in_string:
+            depth = 1
+        while True:
+            pattern = self._string_re if in_string else self._token_re
+            match = pattern.match(self.buf, self.pos)
+            if match is None:
+                #no more tokens buffered
+                self.pos = len(self.buf)
+            elif match.group(1) == '\\' and match.end() == len(self.buf):
+                #the escaped character is in the next chunk
+                self.pos = match.start(1)
+            elif match.group(1) == '\\':
+                self.pos = match.end() + 1
+                continue
+            else:
+                self.pos = match.end()
+                token = match.group(1)
+                if in_string:
+                    in_string = False
+                elif token == '"':
+                    in_string = True
+                elif token == '[' or token == '{':
+                    depth += 1
+                else:
+                    depth -= 1
+                if not depth and not in_string:
+                    return start, self.tell()
+                continue
+            if not self._fill():
+                raise ValueError("Unexpected end of file at offset "
+                                 "{0}".format(self.tell()))
+
+    def read_value(self):
+        """Decode and return the next value."""
+        return self._decode()[0]
+
+    def iter_keys(self):
+        """Yield the keys of the object starting at the current
+        position. The caller must consume each key's value before
+        asking for the next key."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def iter_items(self):
+        """Yield once for each element of the array starting at the
+        current position. The caller must consume each element before
+        asking for the next one."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.expect(',]') == ']':
+                return
+
+
+class HarStream(object):
+    """Iterate over the entries of a HAR without loading all of it.
+
+    The file is tokenized incrementally and each element of
+    `log.entries` is constructed as an Entry only when the iterator
+    reaches it, so memory use does not grow with the size of the
+    file::
+
+        In [0]: hs = HarStream('./huge.har')
+
+        In [1]: hs.log
+        Out[1]: <HAR 1.2 Log created by Firebug 1.7X.0b1: ...>
+
+        In [2]: [ e.request.url for e in hs if e.response.status == 404 ]
+
+    Everything in the log other than the entries (version, creator,
+    browser, pages, comment) is available on `log` as soon as the
+    stream is opened. If the file cannot be rewound (a pipe, say)
+    fields stored after the entries are only filled in once iteration
+    has finished, and the entries can only be iterated once.
+
+    With `lazy` set, the children of each entry are only constructed
+    when they are accessed, and with `trusted` set nothing is
+    validated as it is loaded (see _MetaHar).
+
+    """
+
+    def __init__(self, path_or_file, chunk_size=CHUNK_SIZE, lazy=False,
+                 trusted=False):
+        self.lazy = lazy
+        self.trusted = trusted
+        if isinstance(path_or_file, basestring):
+            self._fd = open(path_or_file, 'rb')
+            self._owns_fd = True
+        else:
+            self._fd = path_or_file
+            self._owns_fd = False
+        self._seekable = _seekable(self._fd)
+        self._scanner = _JsonScanner(self._fd, chunk_size)
+        self._entries_at = None
+        self._log_keys = None
+        self._header = self._read_header()
+        self.log = Log(self._header, trusted=trusted)
+
+    def _read_header(self):
+        scanner = self._scanner
+        for key in scanner.iter_keys():
+            if key == "log":
+                break
+            scanner.skip_value()
+        else:
+            raise MissingValueException("log", "HarContainer")
+        header = {}
+        log_keys = scanner.iter_keys()
+        for key in log_keys:
+            if key == "entries":
+                self._entries_at = scanner.tell()
+                if not self._seekable:
+                    self._log_keys = log_keys
+                    break
+                scanner.skip_value()
+            else:
+                header[key] = scanner.read_value()
+        if self._entries_at is None:
+            raise MissingValueException("entries", "Log")
+        header["entries"] = []
+        return header
+
+    def __iter__(self):
+        scanner = self._scanner
+        if self._seekable:
+            scanner.seek(self._entries_at)
+        elif scanner.tell() != self._entries_at:
+            raise IOError("The entries of an unseekable HAR can only be "
+                          "iterated once")
+        for _ in scanner.iter_items():
+            yield Entry(scanner.read_value(), parent=self.log,
+                        lazy=self.lazy, trusted=self.trusted)
+        if self._log_keys is not None:
+            trailer = dict( (key, scanner.read_value())
+                            for key in self._log_keys )
+            if trailer:
+                self._header.update(trailer)
+                self.log.from_dict(self._header, self.trusted)
+
+    def _count(self):
+        """Return the number of entries, skipping over them without
+        constructing them."""
+        scanner = self._scanner
+        scanner.seek(self._entries_at)
+        count = 0
+        for _ in scanner.iter_items():
+            scanner.skip_value()
+            count += 1
+        return count
+
+    def __repr__(self):
+        return "<HarStream of {0!r}>".format(self.log)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._owns_fd:
+            self._fd.close()
+
+
+def iter_entries(path_or_file, **kwargs):
+    """iter_entries(path_or_file) -> HarStream
+
+    Return an iterator over the entries of the HAR in `path_or_file`
+    (a file name or an open file) that constructs them one at a time.
+    The log the entries belong to is available as the `log` attribute
+    of the returned object. See HarStream for details.
+
+    """
+    return HarStream(path_or_file, **kwargs)
+
+
+class HarWriter(object):
+    """Write a HAR one entry at a time without holding it in memory.
+
+    Everything in `log` other than its entries (version, creator,
+    browser, pages, comment) is written as soon as the writer is
+    opened. Each entry passed to write() is then written and flushed
+    straight away, and close() ends the file::
+
+        In [0]: with HarWriter('./capture.har') as hw:
+           ...:     for entry in entries:
+           ...:         hw.write(entry)
+
+    `log` is a Log or a dict, and defaults to a new Log. Entries
+    already on it are written first. Each entry is written on a line
+    of its own, so if the process dies before close() is called the
+    entries that were written can be kept with recover_har.
+    `inline_bodies` is passed on to each to_dict (see BodyStore).
+
+    """
+
+    def __init__(self, path_or_file, log=None, backend=None,
+                 inline_bodies=None):
+        if isinstance(path_or_file, basestring):
+            self._fd = open(path_or_file, 'wb')
+            self._owns_fd = True
+        else:
+            self._fd = path_or_file
+            self._owns_fd = False
+        self._dumps = _json_backend(backend)[1]
+        self.inline_bodies = inline_bodies
+        self.count = 0 #entries written
+        self.closed = False
+        if log is None:
+            log = Log()
+        if isinstance(log, _MetaHar):
+            header = log.to_dict(inline_bodies)
+        else:
+            header = _to_plain(log, inline_bodies)
+        entries = header.pop("entries", ())
+        head = self._dumps(header)[:-1]
+        if header:
+            head += ", "
+        self._fd.write('{"log": ' + head + '"entries": [')
+        self._fd.flush()
+        for entry in entries:
+            self.write(entry)
+
+    def write(self, entry):
+        """Append `entry`, an Entry or a dict, to the file."""
+        if self.closed:
+            raise ValueError("I/O operation on closed HarWriter")
+        if isinstance(entry, _MetaHar):
+            entry = entry.to_dict(self.inline_bodies)
+        line = self._dumps(entry)
+        self._fd.write((",\n" if self.count else "\n") + line)
+        self._fd.flush()
+        self.count += 1
+
+    def __repr__(self):
+        return "<HarWriter with {0} entries written>".format(self.count)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """End the entries and the log, and close the file if it was
+        opened by the writer."""
+        if self.closed:
+            return
+        self.closed = True
+        self._fd.write("\n]}}\n")
+        self._fd.flush()
+        if self._owns_fd:
+            self._fd.close()
+
+
+def recover_har(path):
+    """recover_har(path) -> count
+
+    Close off a HAR left unfinished by a HarWriter that was never
+    closed, dropping an entry or ending that was only partly written.
+    Return the number of entries kept.
+
+    """
+    with open(path, 'r+b') as fd:
+        fd.seek(0, 2)
+        size = fd.tell()
+        # read back to the start of the last line, which holds the
+        # last entry or a partly written ending
+        pos = size
+        tail = ""
+        while pos > 0 and "\n" not in tail:
+            step = min(CHUNK_SIZE, pos)
+            pos -= step
+            fd.seek(pos)
+            tail = fd.read(step) + tail
+        if tail.endswith("\n]}}\n"): #closed properly
+            end = None
+        elif "\n" in tail:
+            start = pos + tail.rindex("\n")
+            last = tail[tail.rindex("\n") + 1:].rstrip(",")
+            try:
+                if not last or last.startswith("]"):
+                    raise ValueError(last)
+                json.loads(last)
+                end = start + 1 + len(last)
+            except ValueError: #cut off part way through
+                end = start
+                fd.seek(end - 1)
+                if fd.read(1) == ",":
+                    end -= 1
+        elif tail.endswith('"entries": ['): #no entries written
+            end = size
+        else:
+            raise ValueError("{0} was not written by HarWriter".format(path))
+        if end is not None:
+            fd.seek(end)
+            fd.truncate()
+            fd.write("\n]}}\n")
+    with HarStream(path, trusted=True) as hs:
+        return hs._count()
+
+
+# typecode of the arrays byte offsets are kept in
+_OFFSET_TYPE = 'L' if array('L').itemsize >= 8 else 'd'
+
+
+class MappedHar(object):
+    """Random access to the entries of a HAR file without loading it.
+
+    The file is memory mapped and scanned once to find where each
+    element of `log.entries` starts and ends. Entries are then
+    constructed only when they are asked for, by decoding just their
+    bytes::
+
+        In [0]: mh = MappedHar('./huge.har')
+
+        In [1]: len(mh)
+        Out[1]: 120554
+
+        In [2]: mh[48213].request.url
+        Out[2]: u'http://example.com/48213'
+
+    The offsets are saved next to the HAR in `spans_path` (the HAR's
+    name plus '.spans' by default) and reused as long as the HAR has
+    not changed, so later opens skip the scan. The last `cache_size`
+    entries that were constructed are kept, and `lazy` and `trusted`
+    are passed on to each Entry (see _MetaHar).
+
+    Everything in the log other than the entries is available on
+    `log` as soon as the file is opened.
+
+    """
+
+    _MAGIC = "HARSPANS 1"
+
+    def __init__(self, path, cache_size=128, lazy=False, trusted=False,
+                 spans_path=None, backend=None):
+        self.path = path
+        self.cache_size = cache_size
+        self.lazy = lazy
+        self.trusted = trusted
+        self.spans_path = spans_path or path + ".spans"
+        self._loads = _json_backend(backend)[0]
+        self._cache = OrderedDict()
+        self._fd = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._fd.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except Exception:
+            self._fd.close()
+            raise
+        stat = os.fstat(self._fd.fileno())
+        self._stamp = (stat.st_size, int(stat.st_mtime * 1000000))
+        self._entries_end = None
+        self.spans = self._load_spans()
+        scanned = self.spans is None
+        if scanned:
+            self.spans = array(_OFFSET_TYPE)
+        header = self._read_header(scanned)
+        self.log = Log(header, trusted=trusted)
+        if scanned:
+            self._save_spans()
+
+    def _read_header(self, scan):
+        """Read everything in the log but the entries, recording the
+        span of each entry as they are passed if `scan` is set."""
+        scanner = _JsonScanner(self._map)
+        for key in scanner.iter_keys():
+            if key == "log":
+                break
+            scanner.skip_value()
+        else:
+            raise MissingValueException("log", "HarContainer")
+        header = {}
+        for key in scanner.iter_keys():
+            if key != "entries":
+                header[key] = scanner.read_value()
+            elif scan:
+                spans = self.spans
+                for _ in scanner.iter_items():
+                    spans.extend(scanner.skip_value())
+                self._entries_end = scanner.tell()
+            else:
+                scanner.seek(self._entries_end)
+        if self._entries_end is None:
+            raise MissingValueException("entries", "Log")
+        header["entries"] = []
+        return header
+
+    def _load_spans(self):
+        """Return the saved spans if they were saved for the file as it
+        is now, or None."""
+        try:
+            with open(self.spans_path, 'rb') as fd:
+                fields = fd.readline().split()
+                if (" ".join(fields[:2]) != self._MAGIC or
+                    fields[2] != _OFFSET_TYPE or
+                    (int(fields[3]), int(fields[4])) != self._stamp):
+                    return None
+                self._entries_end = int(fields[5])
+                spans = array(_OFFSET_TYPE)
+                spans.fromfile(fd, int(fields[6]) * 2)
+                return spans
+        except (IOError, EOFError, ValueError, IndexError):
+            self._entries_end = None
+            return None
+
+    def _save_spans(self):
+        try:
+            with open(self.spans_path, 'wb') as fd:
+                fd.write("{0} {1} {2} {3} {4} {5}\n".format(
+                    self._MAGIC, _OFFSET_TYPE, self._stamp[0],
+                    self._stamp[1], self._entries_end, len(self)))
+                self.spans.tofile(fd)
+        except (IOError, OSError): #a read only directory, say
+            pass
+
+    def __len__(self):
+        return len(self.spans) // 2
+
+    def span(self, index):
+        """Return the (start, end) byte offsets of entry `index`."""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("entry index out of range")
+        return int(self.spans[2 * index]), int(self.spans[2 * index + 1])
+
+    def raw(self, index):
+        """Return the json of entry `index` as it is in the file."""
+        start, end = self.span(index)
+        return self._map[start:end]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ self[i] for i in xrange(*index.indices(len(self))) ]
+        if index < 0:
+            index += len(self)
+        cache = self._cache
+        try:
+            entry = cache.pop(index)
+        except KeyError:
+            entry = Entry(self._loads(self.raw(index)), lazy=self.lazy,
+                          trusted=self.trusted)
+            if len(cache) >= self.cache_size > 0:
+                cache.popitem(last=False)
+        if self.cache_size > 0:
+            cache[index] = entry
+        return entry
+
+    def __iter__(self):
+        """Construct every entry in order. Entries are not cached."""
+        loads = self._loads
+        for index in xrange(len(self)):
+            yield Entry(loads(self.raw(index)), lazy=self.lazy,
+                        trusted=self.trusted)
+
+    def __repr__(self):
+        return "<MappedHar of {0} entries in {1!r}>".format(len(self),
+                                                            self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._cache.clear()
+        self._map.close()
+        self._fd.close()
+
+
+class HttpStream(object):
+    """Devour raw HTTP messages from a stream of bytes, such as a socat
+    capture or a proxy's socket, fed to it in chunks of any size::
+
+        In [0]: stream = HttpStream()
+
+        In [1]: for chunk in iter(lambda: sock.recv(65536), ''):
+                    for message in stream.feed(chunk):
+                        print message
+
+    feed() returns the Request and Response objects of the messages
+    the chunk completed, in order. Where each message ends is worked
+    out from its Content-Length or chunked transfer-encoding, or for a
+    response with neither, the end of the stream, so messages
+    pipelined on a keep-alive connection are split up as they arrive.
+    Messages are devoured as `kind`, Request or Response, or if it is
+    None, as each message's start line says. A response to a HEAD
+    request read from the same stream is known to have no body.
+
+    Only the message being read is buffered; each one is dropped from
+    the buffer as soon as it has been devoured. Given a StringTable
+    `strings`, such as a Log's, the messages share their repeated
+    strings through it. None is used by default, as a table kept for
+    the life of a long stream would keep every short value it saw.
+
+    """
+
+    def __init__(self, kind=None, proto='http', keep_b64_raw=False,
+                 strings=None):
+        self.kind = kind
+        self.proto = proto
+        self.keep_b64_raw = keep_b64_raw
+        self.strings = strings
+        self.count = 0
+        self._buffer = bytearray()
+        self._start = 0
+        # methods of the requests read, for the responses still to come
+        self._methods = deque()
+        self._reset()
+
+    def _reset(self):
+        # what is known of the message at self._start, in offsets from
+        # its start
+        self._kind = None
+        self._searched = 0
+        self._length = None
+        self._chunks = None
+        self._until_close = False
+
+    def __repr__(self):
+        return "<HttpStream of {0} messages, {1} bytes buffered>".format(
+            self.count, self.buffered)
+
+    @property
+    def buffered(self):
+        """The number of bytes read of the message not yet complete."""
+        return len(self._buffer) - self._start
+
+    def feed(self, data):
+        """Add the next chunk of the stream, and return the messages it
+        completed."""
+        self._buffer += data
+        messages = []
+        try:
+            while True:
+                end = self._message_end()
+                if end < 0:
+                    return messages
+                messages.append(self._devour(end))
+        finally:
+            if self._start:
+                try:
+                    del self._buffer[:self._start]
+                except BufferError:
+                    # a message that failed to devour is still viewing
+                    # the buffer from its traceback, so leave it be
+                    self._buffer = self._buffer[self._start:]
+                self._start = 0
+
+    def expect(self, method):
+        """Note that a request with `method` was sent, for a stream of
+        only the responses to what was sent."""
+        self._methods.append(method)
+
+    def close(self):
+        """End the stream, and return the response it completed if
+        that response had no length. Raises ValueError if the stream
+        ends partway through a message."""
+        messages = []
+        if self._until_close:
+            messages.append(self._devour(len(self._buffer)))
+        if self.buffered:
+            raise ValueError("Stream ends partway through a message "
+                             "({0} bytes)".format(self.buffered))
+        del self._buffer[:]
+        self._start = 0
+        return messages
+
+    def _message_end(self):
+        """Return the offset in the buffer that the message at
+        self._start ends at, or -1 if it has not all been read."""
+        buf = self._buffer
+        if self._kind is None:
+            # blank lines between messages are allowed, and ignored
+            start, size = self._start, len(buf)
+            while start < size and buf[start] in (10, 13):
+                start += 1
+            self._start = start
+            end = _head_end(buf, start + max(self._searched - 3, 0))
+            if end < 0:
+                self._searched = size - start
+                return -1
+            self._read_head(start, end)
+        start = self._start
+        if self._chunks is not None:
+            pos, done = _scan_chunks(buf, start + self._chunks)
+            if not done:
+                self._chunks = pos - start
+                return -1
+            self._length = pos - start
+        if self._length is None or start + self._length > len(buf):
+            return -1
+        return start + self._length
+
+    def _read_head(self, start, end):
+        """Work out what the message whose head is buffer[start:end]
+        is, and how it ends."""
+        line, eol, headers = _split_head(
+            str(buffer(self._buffer, start, end - start)))
+        kind = self.kind
+        if kind is None:
+            kind = Response if line.startswith("HTTP/") else Request
+        size = end - start
+        if kind is Request:
+            if self.kind is None:
+                self._methods.append(line.split(None, 1)[0])
+            no_body = False
+        else:
+            status = int(line.split(None, 2)[1])
+            if status // 100 == 1 and status != 101:
+                # interim, the request's own response is still to come
+                no_body = True
+            else:
+                method = self._methods.popleft() if self._methods else None
+                no_body = (status // 100 == 1 or status in (204, 304) or
+                           method == "HEAD")
+        self._kind = kind
+        if no_body:
+            self._length = size
+        elif _chunked(headers.get("Transfer-Encoding")):
+            self._chunks = size
+        elif _content_length(headers) is not None:
+            self._length = size + _content_length(headers)
+        elif kind is Response:
+            self._until_close = True
+        else:
+            self._length = size
+
+    def _devour(self, end):
+        """Devour the message from self._start to `end` and move on to
+        the next one."""
+        message = self._kind(empty=True)
+        view = memoryview(self._buffer)[self._start:end]
+        self._start = end
+        self._reset()
+        try:
+            message.devour(view, self.proto, keep_b64_raw=self.keep_b64_raw,
+                           strings=self.strings)
+        finally:
+            # the buffer cannot be resized while it is being viewed
+            del view
+        self.count += 1
+        return message
+
+
 ###############################################################################
 # Interface Functions and Classes
 ###############################################################################
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+import unittest
+import SocketServer
+
+from sys import path
+from tempfile import mkdtemp
+
+path.append('./')
+path.append('../')
+import har
+from utils.engine import Engine, STARVED_WAIT
+
+################################################################################
+# Fixtures
+################################################################################
+
+class _Handler(SocketServer.BaseRequestHandler):
+    """Answer the requests on a connection, as the path asks:
+
+    /len/N     N bytes with a Content-Length
+    /chunked   a chunked body in two chunks
+    /close     a body ended by closing the connection
+    /continue  a 100 Continue before the response
+    /sleep/N   N seconds before the response
+    /drop      close the connection without answering
+    /once      answer, then close the connection without saying so
+
+    Anything else is answered with the request line as the body.
+
+    """
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        stream = har.HttpStream(har.Request)
+        sock = self.request
+        if server.tls:
+            sock = server.context.wrap_socket(sock, server_side=True)
+        while True:
+            try:
+                data = sock.recv(65536)
+            except socket.error:
+                return
+            if not data:
+                return
+            for request in stream.feed(data):
+                with server.lock:
+                    server.requests.append(request)
+                if not self.answer(sock, request):
+                    sock.close()
+                    return
+
+    def answer(self, sock, request):
+        target = har._request_target(request.url)
+        head = "HTTP/1.1 200 OK\r\n"
+        if target.startswith("/len/"):
+            body = "x" * int(target[5:])
+        elif target == "/chunked":
+            sock.sendall(head + "Transfer-Encoding: chunked\r\n\r\n"
+                         "3\r\nabc\r\n2\r\nde\r\n0\r\n\r\n")
+            return True
+        elif target == "/close":
+            sock.sendall(head + "\r\nuntil close")
+            return False
+        elif target == "/continue":
+            sock.sendall("HTTP/1.1 100 Continue\r\n\r\n")
+            body = "continued"
+        elif target.startswith("/sleep/"):
+            time.sleep(float(target[7:]))
+            body = "slept"
+        elif target == "/drop":
+            return False
+        elif target == "/once":
+            sock.sendall(head + "Content-Length: 4\r\n\r\nonce")
+            return False
+        else:
+            body = "{0} {1}".format(request.method, target)
+        sock.sendall("{0}Content-Length: {1}\r\n\r\n{2}".format(
+            head, len(body), "" if request.method == "HEAD" else body))
+        return True
+
+
+class _Server(SocketServer.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, tls=False, context=None):
+        SocketServer.ThreadingTCPServer.__init__(self, ("127.0.0.1", 0),
+                                                 _Handler)
+        self.tls = tls
+        self.context = context
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = []
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+def make_request(url, method="GET", headers=()):
+    host = url.split("/")[2]
+    return har.Request({"method": method, "url": url,
+                        "httpVersion": "HTTP/1.1", "cookies": [],
+                        "queryString": [],
+                        "headers": [ {"name": name, "value": value}
+                                     for name, value
+                                     in (("Host", host),) + tuple(headers) ],
+                        "headersSize": -1, "bodySize": -1})
+
+
+################################################################################
+# Tests
+################################################################################
+
+class TestEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _Server()
+        self.base = "http://127.0.0.1:{0}".format(self.server.port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def run_engine(self, requests, **kwargs):
+        kwargs.setdefault("timeout", 5)
+        return list(Engine(**kwargs).run(requests))
+
+    def test_keep_alive(self):
+        requests = [ make_request(self.base + "/len/%d" % i)
+                     for i in range(20) ]
+        entries = self.run_engine(requests, per_host=2)
+        self.assertEqual(20, len(entries))
+        self.assertEqual(range(20), sorted(e._sequence for e in entries))
+        for entry in entries:
+            self.assertEqual(200, entry.response.status)
+            self.assertEqual(entry._sequence, entry.response.content.size)
+            self.assertEqual("127.0.0.1", entry.serverIPAddress)
+            self.assertTrue(entry.timings.wait >= 0)
+            self.assertEqual(-1, entry.timings.ssl)
+        self.assertTrue(self.server.connections <= 2)
+        self.assertEqual(20, len(self.server.requests))
+        # entries can be written out and loaded back
+        loaded = har.Entry(entries[0].to_json())
+        self.assertEqual(entries[0].to_dict(), loaded.to_dict())
+
+    def test_concurrency(self):
+        requests = [ make_request(self.base + "/sleep/0.2")
+                     for i in range(6) ]
+        start = time.time()
+        entries = self.run_engine(requests, concurrency=6, per_host=6)
+        self.assertTrue(time.time() - start < 1.0)
+        self.assertEqual(["slept"] * 6,
+                         [ e.response.content.text for e in entries ])
+        start = time.time()
+        self.run_engine(requests, concurrency=6, per_host=1)
+        self.assertTrue(time.time() - start >= 1.2)
+
+    def test_framing(self):
+        requests = [make_request(self.base + "/chunked"),
+                    make_request(self.base + "/close"),
+                    make_request(self.base + "/continue"),
+                    make_request(self.base + "/len/5", method="HEAD"),
+                    make_request(self.base + "/len/3")]
+        entries = sorted(self.run_engine(requests, per_host=1),
+                         key=lambda e: e._sequence)
+        self.assertEqual(["abcde", "until close", "continued", None, "xxx"],
+                         [ getattr(e.response.content, "text", None) or None
+                           for e in entries ])
+        self.assertEqual([200] * 5, [ e.response.status for e in entries ])
+        self.assertEqual("5", entries[3].response.headers.get(
+            "Content-Length"))
+
+    def test_sequence(self):
+        requests = [ make_request(self.base + "/") for i in range(3) ]
+        for i, request in enumerate(requests):
+            request._sequence = 10 + i
+        entries = self.run_engine(requests)
+        self.assertEqual([10, 11, 12], sorted(e._sequence for e in entries))
+
+    def test_errors(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        closed = sock.getsockname()[1]
+        sock.close()
+        requests = [make_request("http://127.0.0.1:%d/" % closed),
+                    make_request(self.base + "/drop"),
+                    make_request(self.base + "/sleep/2")]
+        entries = sorted(self.run_engine(requests, timeout=0.5),
+                         key=lambda e: e._sequence)
+        self.assertEqual([0, 0, 0], [ e.response.status for e in entries ])
+        self.assertTrue(all(e.response._error for e in entries))
+        self.assertTrue("Timed out" in entries[2].response._error)
+
+    def test_connection_close(self):
+        requests = [make_request(self.base + "/"),
+                    make_request(self.base + "/", headers=[
+                        ("Connection", "close")]),
+                    make_request(self.base + "/")]
+        entries = self.run_engine(requests, concurrency=1, per_host=1)
+        self.assertEqual([200] * 3, [ e.response.status for e in entries ])
+        self.assertEqual(2, self.server.connections)
+
+    def test_starved(self):
+        # with nothing in flight, a None waits before asking again
+        asked = []
+        def requests():
+            while len(asked) < 5:
+                asked.append(time.time())
+                yield None
+            yield make_request(self.base + "/len/1")
+        entries = self.run_engine(requests())
+        self.assertEqual([200], [ e.response.status for e in entries ])
+        self.assertTrue(asked[-1] - asked[0] >= 4 * STARVED_WAIT)
+
+    def test_stale_connection(self):
+        # the server closes the kept connection before it is used
+        # again, and the request is sent again on a new one
+        def requests():
+            yield make_request(self.base + "/once")
+            time.sleep(0.2)
+            yield make_request(self.base + "/len/2")
+        entries = self.run_engine(requests(), concurrency=1, per_host=1)
+        self.assertEqual(["once", "xx"],
+                         [ e.response.content.text for e in entries ])
+        self.assertEqual(2, self.server.connections)
+        self.assertEqual("2", entries[1].connection)
+
+
+class TestEngineTls(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import ssl
+        cls.tmp = mkdtemp()
+        cls.cert = os.path.join(cls.tmp, "cert.pem")
+        try:
+            subprocess.check_call(
+                ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+                 "-days", "1", "-subj", "/CN=localhost", "-keyout", cls.cert,
+                 "-out", cls.cert], stdout=open(os.devnull, "w"),
+                stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError):
+            cls.context = None
+            return
+        cls.context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        cls.context.load_cert_chain(cls.cert)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)
+
+    def setUp(self):
+        if self.context is None:
+            self.skipTest("openssl is needed to make a certificate")
+        self.server = _Server(tls=True, context=self.context)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_tls(self):
+        base = "https://127.0.0.1:{0}".format(self.server.port)
+        requests = [ make_request(base + "/len/%d" % (i * 5000))
+                     for i in range(4) ]
+        entries = list(Engine(per_host=1, timeout=5).run(requests))
+        self.assertEqual([0, 5000, 10000, 15000],
+                         sorted(e.response.content.size for e in entries))
+        self.assertTrue(all(e.timings.ssl >= 0 for e in entries[:1]))
+        self.assertEqual(1, self.server.connections)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,65 @@
 #!/usr/bin/env python
 
+import os
+import gzip
+import json
+import math
+import pickle
 import unittest
 import re
+import shutil
+import zlib
 
+from array import array
 from datetime import datetime
 from dateutil import tz, parser
 from sys import path
+from StringIO import StringIO
+from tempfile import mkdtemp, mkstemp
 
 path.append('./')
 path.append('../')
 import har
 
+################################################################################
+# Fixtures
+################################################################################
+
+ENTRY_JSON = ('{"startedDateTime": "2012-06-25T22:50:54.188477-07:00", '
+              '"pageref": "page_0", "time": 50, '
+              '"request": {"method": "GET", "url": "http://example.com/%d", '
+              '"httpVersion": "HTTP/1.1", "cookies": [], "queryString": [], '
+              '"headers": [{"name": "Host", "value": "example.com"}, '
+              '{"name": "Accept", "value": "*/*"}], '
+              '"headersSize": 150, "bodySize": -1}, '
+              '"response": {"status": 200, "statusText": "OK", '
+              '"httpVersion": "HTTP/1.1", "cookies": [], '
+              '"headers": [{"name": "Content-Type", "value": "text/html"}], '
+              '"content": {"size": 5, "mimeType": "text/html", '
+              '"text": "[\\"}"}, '
+              '"redirectURL": "", "headersSize": 160, "bodySize": 5}, '
+              '"cache": {}, '
+              '"timings": {"send": 1, "wait": 40, "receive": 9}}')
+
+PAGES_JSON = ('[{"id": "page_0", "title": "Test Page", '
+              '"startedDateTime": "2012-06-25T22:50:54.188477-07:00", '
+              '"pageTimings": {"onLoad": 245}}]')
+
+CREATOR_JSON = '{"version": "$Id$", "name": "Harpy"}'
+
+
+def make_har_json(count=3, pages_last=False):
+    """Return the json for a HAR with `count` entries."""
+    entries = '[' + ', '.join(ENTRY_JSON % i for i in range(count)) + ']'
+    if pages_last:
+        return ('{"log": {"version": "1.2", "creator": %s, '
+                '"entries": %s, "pages": %s}}' % (CREATOR_JSON, entries,
+                                                   PAGES_JSON))
+    return ('{"log": {"version": "1.2", "creator": %s, '
+            '"pages": %s, "entries": %s}}' % (CREATOR_JSON, PAGES_JSON,
+                                              entries))
+
+
 ################################################################################
 # Meta Test Cases
 ################################################################################
@@ -417,6 +466,1487 @@ class TestTest(HarObjectTest):
         # self.assertEqual(expected, test())
         assert False # TODO: implement your test here
 
+class _Unseekable(object):
+    """A file-like object that can only be read forwards, like a pipe."""
+
+    def __init__(self, data):
+        self._fd = StringIO(data)
+
+    def read(self, size=-1):
+        return self._fd.read(size)
+
+    def tell(self):
+        raise IOError("Illegal seek")
+
+    seek = tell
+
+
+class TestHarStream(unittest.TestCase):
+
+    def test_entries_match_full_load(self):
+        data = make_har_json(5)
+        expected = [ e.to_json() for e in har.HarContainer(data).log.entries ]
+        for chunk_size in [7, 64, har.CHUNK_SIZE]:
+            stream = har.iter_entries(StringIO(data), chunk_size=chunk_size)
+            self.assertEqual(expected, [ e.to_json() for e in stream ])
+
+    def test_entries_are_constructed(self):
+        entry = iter(har.iter_entries(StringIO(make_har_json(1)))).next()
+        self.assertTrue(isinstance(entry, har.Entry))
+        self.assertTrue(isinstance(entry.request, har.Request))
+        self.assertEqual(u'http://example.com/0', entry.request.url)
+
+    def test_header_up_front(self):
+        stream = har.Log.iter_entries(StringIO(make_har_json(2)))
+        self.assertEqual(u'1.2', stream.log.version)
+        self.assertEqual(u'Harpy', stream.log.creator.name)
+        self.assertEqual(u'Test Page', stream.log.pages[0].title)
+        self.assertEqual([], stream.log.entries)
+
+    def test_pages_after_entries(self):
+        stream = har.iter_entries(StringIO(make_har_json(3, pages_last=True)),
+                                  chunk_size=16)
+        self.assertEqual(u'page_0', stream.log.pages[0].id)
+        self.assertEqual(3, len(list(stream)))
+        self.assertEqual(3, len(list(stream)))
+
+    def test_unseekable(self):
+        stream = har.iter_entries(
+            _Unseekable(make_har_json(3, pages_last=True)), chunk_size=16)
+        self.assertFalse("pages" in stream.log)
+        self.assertEqual(3, len(list(stream)))
+        self.assertEqual(u'page_0', stream.log.pages[0].id)
+        self.assertRaises(IOError, list, stream)
+
+    def test_from_path(self):
+        fd, name = mkstemp(suffix='.har')
+        try:
+            os.write(fd, make_har_json(4))
+            os.close(fd)
+            with har.iter_entries(name) as stream:
+                self.assertEqual(4, len(list(stream)))
+        finally:
+            os.remove(name)
+
+    def test_empty_entries(self):
+        data = ('{"log": {"version": "1.2", "creator": %s, "entries": []}}'
+                % CREATOR_JSON)
+        self.assertEqual([], list(har.iter_entries(StringIO(data))))
+
+    def test_missing_entries(self):
+        data = '{"log": {"version": "1.2", "creator": %s}}' % CREATOR_JSON
+        self.assertRaises(har.MissingValueException,
+                          har.iter_entries, StringIO(data))
+
+    def test_entries_skipped_undecoded(self):
+        data = make_har_json(3, pages_last=True)
+        decode = har._JsonScanner._decode
+        decoded = []
+        def spy(scanner):
+            value = decode(scanner)
+            decoded.append(value[0])
+            return value
+        har._JsonScanner._decode = spy
+        try:
+            for chunk_size in [5, 64]:
+                del decoded[:]
+                stream = har.iter_entries(StringIO(data),
+                                          chunk_size=chunk_size)
+                self.assertEqual(u'page_0', stream.log.pages[0].id)
+                self.assertFalse([ v for v in decoded if isinstance(v, list)
+                                   and v and "request" in v[0] ])
+        finally:
+            har._JsonScanner._decode = decode
+
+    def test_skip_value(self):
+        data = ('[1.5e3, "a\\"]\\\\", {"b": [true, {}], "c\\"": "}"},'
+                ' null, []]')
+        for chunk_size in range(1, 8):
+            scanner = har._JsonScanner(StringIO(data), chunk_size)
+            spans = []
+            for _ in scanner.iter_items():
+                spans.append(scanner.skip_value())
+            self.assertEqual(json.loads(data),
+                             [ json.loads(data[a:b]) for a, b in spans ])
+        scanner = har._JsonScanner(StringIO('{"a": [1, "]'))
+        self.assertRaises(ValueError, scanner.skip_value)
+
+    def test_entries_have_parent(self):
+        stream = har.iter_entries(StringIO(make_har_json(2)))
+        for entry in stream:
+            self.assertTrue(entry._parent is stream.log)
+
+    def test_truncated(self):
+        data = make_har_json(2)[:-40]
+        self.assertRaises(ValueError, har.iter_entries, StringIO(data))
+        self.assertRaises(ValueError, list, har.iter_entries(_Unseekable(data)))
+
+class TestLazyLoading(unittest.TestCase):
+
+    def setUp(self):
+        self.data = make_har_json(3)
+        self.hc = har.HarContainer(self.data, lazy=True)
+
+    def test_children_deferred(self):
+        entry = self.hc.log.entries[0]
+        self.assertFalse("request" in entry.__dict__)
+        self.assertTrue("request" in entry)
+        self.assertTrue(isinstance(entry.request, har.Request))
+        self.assertTrue("request" in entry.__dict__)
+        self.assertFalse("headers" in entry.request.__dict__)
+        self.assertEqual(u'Host', entry.request.headers[0].name)
+
+    def test_lazy_is_inherited(self):
+        request = self.hc.log.entries[1].request
+        self.assertEqual(u'http://example.com/1', request.url)
+        self.assertTrue("_pending" in request.__dict__)
+
+    def test_to_json_untouched(self):
+        eager = har.HarContainer(self.data)
+        self.assertEqual(json.loads(eager.to_json()),
+                         json.loads(self.hc.to_json()))
+        self.hc.log.entries[2].response.headers
+        self.hc.log.entries[2].timings
+        self.assertEqual(json.loads(eager.to_json()),
+                         json.loads(self.hc.to_json()))
+
+    def test_validation_deferred(self):
+        bad = json.loads(self.data)
+        bad["log"]["entries"][1]["request"]["headersSize"] = "x"
+        hc = har.HarContainer(bad, lazy=True)
+        hc.log.entries[0].request
+        self.assertRaises(har.ValidationError,
+                          getattr, hc.log.entries[1], "request")
+
+    def test_missing_attribute(self):
+        entry = self.hc.log.entries[0]
+        self.assertRaises(AttributeError, getattr, entry, "serverIPAddress")
+        self.assertEqual(6, len(entry.get_children()))
+        self.assertFalse("_pending" in entry.__dict__)
+
+    def test_stream(self):
+        entry = iter(har.iter_entries(StringIO(self.data), lazy=True)).next()
+        self.assertFalse("response" in entry.__dict__)
+        self.assertEqual(200, entry.response.status)
+
+class TestCompactStorage(unittest.TestCase):
+
+    def test_no_instance_dict(self):
+        for obj in [har.Header({"name": "Accept", "value": "*/*"}),
+                    har.QueryString({"name": "q", "value": "1"}),
+                    har.Param({"name": "q", "value": "1"}),
+                    har.Cookie({"name": "sid", "value": "1"})]:
+            self.assertFalse(hasattr(obj, "__dict__"))
+
+    def test_attribute_access(self):
+        header = har.Header({"name": "Accept", "value": "*/*",
+                             "_sequence": 2})
+        self.assertEqual("Accept", header.name)
+        self.assertEqual(2, header._sequence)
+        self.assertEqual("*/*", header)
+        self.assertTrue("name" in header)
+        self.assertFalse("comment" in header)
+        self.assertRaises(AttributeError, getattr, header, "comment")
+        header.value = "text/html"
+        self.assertEqual("<Header Accept: text/html>", repr(header))
+
+    def test_extra_fields(self):
+        header = har.Header({"name": "Accept", "value": "*/*",
+                             "_custom": "x"})
+        self.assertEqual("x", header._custom)
+        header.other = 1
+        self.assertEqual({"name": "Accept", "value": "*/*",
+                          "_custom": "x", "other": 1},
+                         json.loads(header.to_json()))
+        del header.other
+        self.assertRaises(AttributeError, getattr, header, "other")
+        self.assertRaises(AttributeError, delattr, header, "other")
+
+    def test_validation(self):
+        self.assertRaises(har.MissingValueException,
+                          har.Header, '{"name": "Accept"}')
+        self.assertRaises(har.ValidationError,
+                          har.Cookie, '{"name": "sid", "value": 1}')
+
+    def test_cookie_devour(self):
+        cookie = har.Cookie(empty=True)
+        cookie.devour("Set-Cookie: sid=1; Path=/; Max-Age=60; HttpOnly")
+        self.assertEqual({"name": "sid", "value": "1", "path": "/",
+                          "max-age": "60", "httpOnly": True},
+                         json.loads(cookie.to_json()))
+
+    def test_round_trip(self):
+        for data in ['{"name": "a", "value": "b"}',
+                     '{"value": "b", "name": "a", "_sequence": 3}',
+                     '{"_sequence": 3, "comment": "c", "value": "b", '
+                     '"name": "a"}']:
+            self.assertEqual(json.dumps(json.loads(data)),
+                             har.Header(data).to_json())
+        data = ('{"name": "a", "value": "b", "path": "/", "expires": null, '
+                '"httpOnly": true, "secure": false, "domain": "x"}')
+        self.assertEqual(json.dumps(json.loads(data)),
+                         har.Cookie(data).to_json())
+
+    def test_pickle(self):
+        request = har.Request()
+        self.assertEqual(request.to_json(),
+                         pickle.loads(pickle.dumps(request, 2)).to_json())
+
+class TestSchema(unittest.TestCase):
+
+    def test_compiled_at_import(self):
+        for cls in [har.HarContainer, har.Log, har.Entry, har.Request,
+                    har.Response, har.Cookie, har.Content, har.Timings,
+                    har.Header, har.Param]:
+            self.assertTrue("_compiled_schema" in cls.__dict__)
+
+    def test_inherited_declarations(self):
+        self.assertEqual(har.Creator._required, har.Browser._required)
+        self.assertRaises(har.ValidationError,
+                          har.Browser, '{"version": 3, "name": "x"}')
+
+    def test_missing_field(self):
+        try:
+            har.Timings('{"send": 1, "wait": 2}')
+        except har.MissingValueException, err:
+            self.assertEqual("receive", err.value)
+            self.assertEqual("Timings", err.in_class)
+        else:
+            self.fail("MissingValueException not raised")
+
+    def test_wrong_type(self):
+        try:
+            har.Timings('{"send": 1, "wait": "2", "receive": 3}')
+        except har.ValidationError, err:
+            self.assertEqual("Timings failed 'wait' must be of type: "
+                             "<type 'int'>", str(err))
+        else:
+            self.fail("ValidationError not raised")
+
+    def test_optional_fields(self):
+        har.Page('{"id": "1", "startedDateTime": "2012-06-25T22:50:54Z", '
+                 '"pageTimings": {}, "title": "T", "comment": "c"}')
+        self.assertRaises(har.ValidationError, har.PageTimings,
+                          '{"onLoad": "245"}')
+        har.Cookie('{"name": "a", "value": "b", "expires": null}')
+        self.assertRaises(har.ValidationError, har.Cookie,
+                          '{"name": "a", "value": "b", "secure": 1}')
+
+    def test_key_value_types(self):
+        self.assertRaises(har.ValidationError,
+                          har.Header, '{"name": "Accept", "value": 1}')
+
+class TestTrustedLoading(unittest.TestCase):
+
+    def setUp(self):
+        self.bad = json.loads(make_har_json(3))
+        entries = self.bad["log"]["entries"]
+        del entries[0]["request"]["url"]
+        entries[2]["response"]["headers"][0]["value"] = 7
+        entries[2]["timings"]["wait"] = "40"
+
+    def test_trusted_skips_validation(self):
+        self.assertRaises(har.MissingValueException, har.HarContainer,
+                          self.bad)
+        hc = har.HarContainer(self.bad, trusted=True)
+        self.assertEqual(3, len(hc.log.entries))
+        self.assertTrue(isinstance(hc.log.entries[2].timings, har.Timings))
+
+    def test_validate_reports_all_errors(self):
+        hc = har.HarContainer(self.bad, trusted=True)
+        errors = hc.validate()
+        self.assertEqual(["log.entries[0].request",
+                          "log.entries[2].response.headers[0]",
+                          "log.entries[2].timings"],
+                         sorted(err.path for err in errors))
+        self.assertTrue(str(errors[0]).startswith(errors[0].path + ": "))
+
+    def test_validate_shallow(self):
+        hc = har.HarContainer(self.bad, trusted=True)
+        self.assertEqual([], hc.validate(deep=False))
+        self.assertEqual([], hc.log.entries[0].validate(deep=False))
+        self.assertEqual(1, len(hc.log.entries[0].request.validate(False)))
+        self.assertEqual("", hc.log.entries[0].request.validate()[0].path)
+
+    def test_validate_good(self):
+        data = make_har_json(2)
+        self.assertEqual([], har.HarContainer(data).validate())
+        self.assertEqual([], har.HarContainer(data, trusted=True).validate())
+
+    def test_validate_lazy(self):
+        hc = har.HarContainer(self.bad, trusted=True, lazy=True)
+        self.assertEqual(3, len(hc.validate()))
+        self.assertFalse("log" in hc.__dict__)
+
+    def test_trusted_stream(self):
+        data = StringIO(json.dumps(self.bad))
+        entries = list(har.iter_entries(data, trusted=True))
+        self.assertEqual(3, len(entries))
+        self.assertEqual(1, len(entries[0].validate()))
+
+class TestToDict(unittest.TestCase):
+
+    def setUp(self):
+        self.data = make_har_json(3)
+        self.hc = har.HarContainer(self.data)
+
+    def assertPlain(self, value):
+        if isinstance(value, dict):
+            for item in value.itervalues():
+                self.assertPlain(item)
+        elif isinstance(value, list):
+            for item in value:
+                self.assertPlain(item)
+        else:
+            self.assertTrue(isinstance(value, (unicode, str, int, long,
+                                               float, bool, type(None))),
+                            repr(value))
+
+    def test_plain(self):
+        fields = self.hc.to_dict()
+        self.assertPlain(fields)
+        self.assertEqual(json.loads(self.data), fields)
+
+    def test_no_hidden_fields(self):
+        fields = self.hc.to_dict()
+        self.assertFalse("_parent" in fields["log"])
+        fields = har.HarContainer(self.data, trusted=True).to_dict()
+        self.assertFalse("_trusted" in fields)
+        self.assertFalse("_trusted" in fields["log"])
+
+    def test_to_json(self):
+        self.assertEqual(json.dumps(self.hc.to_dict()), self.hc.to_json())
+        self.assertEqual(json.loads(json.dumps(self.hc, cls=har.HarEncoder)),
+                         json.loads(self.hc.to_json()))
+
+    def test_lazy_untouched(self):
+        hc = har.HarContainer(self.data, lazy=True)
+        self.assertEqual(json.loads(self.data), hc.to_dict())
+        self.assertFalse("log" in hc.__dict__)
+
+    def test_extra_fields(self):
+        header = har.Header({"name": "a", "value": "b"})
+        header._when = datetime(2012, 6, 25, tzinfo=tz.tzutc())
+        self.assertEqual({"name": "a", "value": "b",
+                          "_when": "2012-06-25T00:00:00+00:00"},
+                         header.to_dict())
+
+class TestJsonBackends(unittest.TestCase):
+
+    def setUp(self):
+        fields = json.loads(make_har_json(3))
+        entry = fields["log"]["entries"][1]
+        entry["comment"] = u"caf\u00e9 \U0001f600 </script>"
+        entry["time"] = 50.123456789
+        entry["response"]["bodySize"] = 2 ** 40
+        self.data = json.dumps(fields)
+        self.calls = []
+
+    def tearDown(self):
+        har.JSON_BACKEND = None
+        if "counting" in har._json_backends:
+            del har._json_backends["counting"]
+            har._json_preference.remove("counting")
+
+    def register_counting(self, preferred=False):
+        def loads(data):
+            self.calls.append("loads")
+            return json.loads(data)
+        def dumps(obj):
+            self.calls.append("dumps")
+            return json.dumps(obj)
+        har.register_json_backend("counting", loads, dumps,
+                                  preferred=preferred)
+
+    def load(self, data, backend):
+        hc = har.HarContainer(empty=True)
+        hc.from_json(data, backend=backend)
+        return hc
+
+    def test_round_trip_matrix(self):
+        self.register_counting()
+        written = har.HarContainer(self.data).to_json()
+        for data in (self.data, written):
+            expected = self.load(data, "json").to_json(backend="json")
+            for reader in har.json_backends():
+                for writer in har.json_backends():
+                    self.assertEqual(expected,
+                                     self.load(data, reader).to_json(writer),
+                                     (reader, writer))
+
+    def test_per_call(self):
+        self.register_counting()
+        hc = self.load(self.data, "counting")
+        hc.to_json()
+        self.assertEqual(["loads"], self.calls)
+        hc.to_json(backend="counting")
+        self.assertEqual(["loads", "dumps"], self.calls)
+
+    def test_global(self):
+        self.register_counting()
+        har.JSON_BACKEND = "counting"
+        hc = har.HarContainer(self.data)
+        hc.to_json()
+        self.assertEqual(["loads", "dumps"], self.calls)
+
+    def test_preferred(self):
+        self.register_counting(preferred=True)
+        self.assertEqual("counting", har.json_backends()[-1])
+        har.HarContainer(self.data)
+        self.assertEqual(["loads"], self.calls)
+
+    def test_unknown(self):
+        hc = har.HarContainer(self.data)
+        self.assertRaises(ValueError, hc.to_json, backend="nope")
+        har.JSON_BACKEND = "nope"
+        self.assertRaises(ValueError, har.HarContainer, self.data)
+
+class TestHarWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.hc = har.HarContainer(make_har_json(3))
+        fd, self.name = mkstemp(suffix='.har')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.name)
+
+    def write(self, count=3, close=True):
+        hw = har.HarWriter(self.name, log={"version": "1.2",
+                                           "creator": self.hc.log.creator,
+                                           "pages": self.hc.log.pages})
+        for entry in self.hc.log.entries[:count]:
+            hw.write(entry)
+        if close:
+            hw.close()
+        else:
+            hw._fd.close()
+        return hw
+
+    def test_round_trip(self):
+        self.write()
+        self.assertEqual(self.hc.to_dict(),
+                         har.HarContainer(open(self.name)).to_dict())
+
+    def test_header_first(self):
+        out = StringIO()
+        hw = har.HarWriter(out, log=self.hc.log)
+        header = out.getvalue()
+        self.assertTrue(header.startswith('{"log": {'))
+        self.assertTrue('"Test Page"' in header)
+        self.assertEqual(3, hw.count)
+        hw.close()
+        self.assertFalse(out.closed)
+        self.assertEqual(3, len(list(har.iter_entries(StringIO(
+            out.getvalue())))))
+
+    def test_default_log(self):
+        out = StringIO()
+        with har.HarWriter(out) as hw:
+            hw.write(self.hc.log.entries[0].to_dict())
+        hc = har.HarContainer(out.getvalue())
+        self.assertEqual(u'Harpy', hc.log.creator.name)
+        self.assertEqual(1, len(hc.log.entries))
+
+    def test_closed(self):
+        hw = self.write()
+        self.assertRaises(ValueError, hw.write, self.hc.log.entries[0])
+        hw.close()
+        self.assertEqual(3, har.recover_har(self.name))
+
+    def test_recover_unclosed(self):
+        self.write(close=False)
+        self.assertEqual(3, har.recover_har(self.name))
+        self.assertEqual(self.hc.to_dict(),
+                         har.HarContainer(open(self.name)).to_dict())
+
+    def test_recover_partial_entry(self):
+        self.write(close=False)
+        data = open(self.name).read()
+        for cut in (1, 40, len(ENTRY_JSON) - 10):
+            open(self.name, 'w').write(data[:-cut])
+            self.assertEqual(2, har.recover_har(self.name))
+            self.assertEqual(2, len(har.HarContainer(
+                open(self.name)).log.entries))
+
+    def test_recover_partial_ending(self):
+        self.write()
+        data = open(self.name).read()
+        for cut in (2, 3, 4):
+            open(self.name, 'w').write(data[:-cut])
+            self.assertEqual(3, har.recover_har(self.name))
+            self.assertEqual(data, open(self.name).read())
+
+    def test_recover_no_entries(self):
+        self.write(0, close=False)
+        self.assertEqual(0, har.recover_har(self.name))
+        open(self.name, 'w').write('{"log": {"vers')
+        self.assertRaises(ValueError, har.recover_har, self.name)
+
+class TestMappedHar(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.name = mkstemp(suffix='.har')
+        os.write(fd, make_har_json(5, pages_last=True))
+        os.close(fd)
+        self.spans = self.name + ".spans"
+
+    def tearDown(self):
+        for name in (self.name, self.spans):
+            if os.path.exists(name):
+                os.remove(name)
+
+    def test_random_access(self):
+        expected = har.HarContainer(open(self.name)).log.entries
+        with har.MappedHar(self.name) as mh:
+            self.assertEqual(5, len(mh))
+            for index in (3, 0, 4, -2):
+                self.assertEqual(expected[index].to_dict(),
+                                 mh[index].to_dict())
+            self.assertEqual([ e.to_dict() for e in expected[1:4] ],
+                             [ e.to_dict() for e in mh[1:4] ])
+            self.assertEqual(len(expected), len(list(mh)))
+            self.assertRaises(IndexError, mh.__getitem__, 5)
+
+    def test_log_header(self):
+        with har.MappedHar(self.name) as mh:
+            self.assertEqual(u'page_0', mh.log.pages[0].id)
+            self.assertEqual(u'Harpy', mh.log.creator.name)
+            self.assertEqual([], mh.log.entries)
+
+    def test_raw(self):
+        with har.MappedHar(self.name) as mh:
+            start, end = mh.span(2)
+            self.assertEqual(open(self.name).read()[start:end], mh.raw(2))
+            self.assertEqual(json.loads(ENTRY_JSON % 2), json.loads(mh.raw(2)))
+
+    def test_spans_saved(self):
+        har.MappedHar(self.name).close()
+        self.assertTrue(os.path.exists(self.spans))
+        saved = open(self.spans).read()
+        with har.MappedHar(self.name) as mh:
+            self.assertEqual(u'http://example.com/4', mh[4].request.url)
+        self.assertEqual(saved, open(self.spans).read())
+
+    def test_stale_spans(self):
+        har.MappedHar(self.name).close()
+        open(self.name, 'w').write(make_har_json(2))
+        with har.MappedHar(self.name) as mh:
+            self.assertEqual(2, len(mh))
+            self.assertEqual(u'http://example.com/1', mh[1].request.url)
+
+    def test_cache(self):
+        with har.MappedHar(self.name, cache_size=2) as mh:
+            first = mh[0]
+            self.assertTrue(first is mh[0])
+            mh[1]
+            mh[2]
+            self.assertFalse(first is mh[0])
+            self.assertEqual(2, len(mh._cache))
+        with har.MappedHar(self.name, cache_size=0) as mh:
+            self.assertFalse(mh[0] is mh[0])
+
+    def test_empty_entries(self):
+        open(self.name, 'w').write(
+            '{"log": {"version": "1.2", "creator": %s, "entries": []}}'
+            % CREATOR_JSON)
+        with har.MappedHar(self.name) as mh:
+            self.assertEqual(0, len(mh))
+            self.assertEqual([], list(mh))
+
+class TestLogFind(unittest.TestCase):
+
+    def setUp(self):
+        self.hc = har.HarContainer(make_har_json(6))
+        self.log = self.hc.log
+        entries = self.log.entries
+        entries[1].request.url = u'http://Www.Google.com/search?q=a'
+        entries[2].request.url = u'http://www.google.com/images/1.png'
+        entries[2].response.content.mimeType = u'image/png'
+        entries[3].request.method = u'POST'
+        entries[3].response.status = 500
+        entries[4].response.content.mimeType = u'text/html; charset=UTF-8'
+        entries[5].pageref = u'page_1'
+
+    def urls(self, entries):
+        return [ int(e.request.url.rsplit('/', 1)[-1])
+                 if 'example' in e.request.url else e.request.url
+                 for e in entries ]
+
+    def test_find(self):
+        find = self.log.find
+        self.assertEqual(2, len(find(host='www.google.com')))
+        self.assertEqual([3], self.urls(find(method='POST')))
+        self.assertEqual([3], self.urls(find(status=lambda s: s >= 500)))
+        self.assertEqual([0, 3, 4], self.urls(find(mimeType='text/html',
+                                                   method=['GET', 'POST'],
+                                                   host='example.com',
+                                                   pageref='page_0')))
+        self.assertEqual([u'http://www.google.com/images/1.png'],
+                         self.urls(find(path='/images/')))
+        self.assertEqual([0, 3], self.urls(find(path=('/0', '/3'))))
+        self.assertEqual(6, len(find(path=lambda p: p.startswith('/'))))
+        self.assertEqual([u'http://www.google.com/images/1.png'],
+                         self.urls(find(path=lambda p: p.endswith('.png'))))
+        self.assertEqual([5], self.urls(find(pageref=set(['page_1']))))
+        self.assertEqual([], find(status=404))
+        self.assertEqual(6, len(find()))
+        self.assertRaises(TypeError, find, colour='red')
+
+    def test_append_and_remove(self):
+        self.log.find(status=200)
+        self.log.find(path='/')
+        entry = har.Entry(ENTRY_JSON % 9)
+        self.log.entries.append(entry)
+        self.assertEqual(9, self.urls(self.log.find(path='/9'))[0])
+        self.assertTrue(entry is self.log.find(status=200)[-1])
+        self.log.entries.remove(entry)
+        self.assertEqual([], self.log.find(path='/9'))
+        self.log.entries.pop(0)
+        del self.log.entries[0]
+        self.assertEqual([4, 5], self.urls(self.log.find(path='/',
+                                                         status=200,
+                                                         host='example.com')))
+        self.log.entries.extend([entry])
+        self.assertEqual([4, 5, 9], self.urls(self.log.find(
+            path='/', status=200, host='example.com')))
+
+    def test_duplicates(self):
+        self.log.find(path='/')
+        entries = self.log.entries
+        entry = entries[3]
+        entries.append(entry)
+        self.assertEqual(7, len(entries))
+        self.assertEqual([3, 3], self.urls(self.log.find(method='POST')))
+        entries.remove(entry)
+        self.assertEqual([3], self.urls(self.log.find(method='POST')))
+        self.assertTrue(entries[-1] is entry)
+        entries.append(entry)
+        entries.pop(3)
+        self.assertEqual([3, 3], self.urls(self.log.find(method='POST',
+                                                         path='/3')))
+        entries.pop()
+        self.assertEqual([3], self.urls(self.log.find(method='POST')))
+        self.assertEqual([0, 5, 3],
+                         self.urls(self.log.find(host='example.com')))
+        self.assertEqual(list(entries), self.log.find())
+
+    def test_failed_append(self):
+        self.log.find(host='example.com')
+        entry = har.Entry(ENTRY_JSON % 9)
+        entry.request.url = 9
+        self.assertRaises(AttributeError, self.log.entries.append, entry)
+        self.assertEqual(6, len(self.log.entries))
+        self.assertEqual(6, len(self.log.find()))
+        self.assertEqual(4, len(self.log.find(host='example.com')))
+
+    def test_reordered(self):
+        self.log.find(method='GET')
+        self.log.entries.insert(0, self.log.entries.pop())
+        self.assertEqual(5, self.urls(self.log.find(method='GET'))[0])
+        self.log.entries.reverse()
+        self.assertEqual(4, self.urls(self.log.find(method='GET'))[0])
+        self.log.entries[:] = self.log.entries[:2]
+        self.assertEqual([4], self.urls(self.log.find(method='GET')))
+
+    def test_reindex(self):
+        self.log.find(status=200)
+        self.log.entries[0].response.status = 404
+        self.assertEqual(0, len(self.log.find(status=404)))
+        self.log.reindex()
+        self.assertEqual([0], self.urls(self.log.find(status=404)))
+
+    def test_serialization(self):
+        expected = self.hc.to_dict()
+        self.log.find(status=200)
+        self.assertEqual(expected, self.hc.to_dict())
+        self.assertEqual([], self.hc.validate())
+        copy = pickle.loads(pickle.dumps(self.hc, 2))
+        self.assertEqual(expected, copy.to_dict())
+        self.assertTrue(type(copy.log.entries) is har._TrackedList)
+        self.assertEqual(None, copy.log.entries._index)
+        self.assertEqual(2, len(copy.log.find(host='www.google.com')))
+
+class TestToColumns(unittest.TestCase):
+
+    def setUp(self):
+        fields = json.loads(make_har_json(3))
+        entries = fields["log"]["entries"]
+        entries[1]["timings"]["wait"] = 12.5
+        del entries[1]["timings"]["send"]
+        entries[2]["response"]["status"] = 404
+        entries[2]["response"]["content"]["size"] = "5"
+        self.log = har.HarContainer(fields, trusted=True).log
+
+    def test_columns(self):
+        columns = self.log.to_columns(use_numpy=False)
+        self.assertEqual(set(["time", "blocked", "dns", "connect", "send",
+                              "wait", "receive", "ssl",
+                              "requestHeadersSize", "requestBodySize",
+                              "status", "responseBodySize", "contentSize"]),
+                         set(columns))
+        self.assertTrue(isinstance(columns["wait"], array))
+        self.assertEqual('d', columns["wait"].typecode)
+        self.assertEqual([40, 12.5, 40], list(columns["wait"]))
+        self.assertEqual([200, 200, 404], list(columns["status"]))
+        self.assertEqual([150] * 3, list(columns["requestHeadersSize"]))
+        self.assertTrue(all(math.isnan(size)
+                            for size in columns["requestBodySize"]))
+        self.assertEqual([50] * 3, list(columns["time"]))
+        self.assertTrue(math.isnan(columns["dns"][0]))
+
+    def test_missing(self):
+        columns = self.log.to_columns(use_numpy=False)
+        self.assertTrue(math.isnan(columns["send"][1]))
+        self.assertTrue(math.isnan(har.COLUMN_MISSING))
+        self.assertEqual([5, 5], list(columns["contentSize"])[:2])
+        self.assertTrue(math.isnan(columns["contentSize"][2]))
+
+    def test_empty(self):
+        columns = har.Log().to_columns(use_numpy=False)
+        self.assertEqual([], list(columns["status"]))
+
+    def test_numpy(self):
+        if har.numpy is None:
+            self.assertRaises(ImportError, self.log.to_columns,
+                              use_numpy=True)
+            self.skipTest("numpy is not installed")
+        columns = self.log.to_columns()
+        self.assertEqual(har.numpy.float64, columns["wait"].dtype)
+        self.assertEqual(1, har.numpy.isnan(columns["send"]).sum())
+
+class TestDates(unittest.TestCase):
+
+    def tearDown(self):
+        har.TIMEZONE = tz.tzlocal()
+
+    def test_matches_dateutil(self):
+        for value in ["2012-06-25T22:50:54.188477-07:00",
+                      "2012-06-25T22:50:54Z",
+                      "2012-06-25T22:50:54.1234567-0700",
+                      "2012-06-25T22:50:54.12+05:30",
+                      "2012-06-25 22:50",
+                      "2012-06-25T22:50:54+00:00",
+                      "Mon, 25 Jun 2012 22:50:54 GMT"]:
+            fast, slow = har._parse_date(value), parser.parse(value)
+            self.assertEqual(fast, slow, value)
+            self.assertEqual(fast.utcoffset(), slow.utcoffset(), value)
+            self.assertEqual(har._format_date(slow), har._format_date(fast))
+
+    def test_round_trip(self):
+        value = "2012-06-25T22:50:54.188477-07:00"
+        self.assertEqual(value, har._format_date(har._parse_date(value)))
+        page = json.loads(PAGES_JSON)[0]
+        self.assertEqual(page, har.Page(page).to_dict())
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, har._parse_date, "2012-13-45T10:00:00Z")
+        page = json.loads(PAGES_JSON)[0]
+        page["startedDateTime"] = "yesterday-ish"
+        self.assertRaises(har.ValidationError, har.Page, page)
+
+    def test_timezone(self):
+        naive = har._parse_date("2012-06-25T22:50:54")
+        self.assertEqual(None, naive.tzinfo)
+        har.TIMEZONE = tz.tzoffset(None, 3600)
+        self.assertEqual("2012-06-25T22:50:54+01:00", har._format_date(naive))
+        har.TIMEZONE = tz.tzoffset(None, -7200)
+        self.assertEqual("2012-06-25T22:50:54-02:00", har._format_date(naive))
+
+    def test_cache(self):
+        value = "2012-06-25T22:50:54.188477-07:00"
+        self.assertTrue(har._parse_date(value) is har._parse_date(value))
+        for second in range(har._DATE_CACHE_SIZE + 10):
+            har._format_date(har._parse_date(
+                "2012-06-25T22:%02d:%02dZ" % divmod(second % 3600, 60)))
+        self.assertTrue(len(har._parsed_dates) <= har._DATE_CACHE_SIZE)
+        self.assertTrue(len(har._formatted_dates) <= har._DATE_CACHE_SIZE)
+
+class TestRawParsing(unittest.TestCase):
+
+    RAW = ("POST /login?next=%2F HTTP/1.1\r\n"
+           "host: example.com\r\n"
+           "X-Tight:no space\r\n"
+           "X-Wide:\t  spaced\r\n"
+           "Continued-Line-Without-Colon\r\n"
+           "Content-Type: application/x-www-form-urlencoded\r\n"
+           "Content-Length: 14\r\n"
+           "\r\n"
+           "user=a&flag&x=")
+
+    def devour(self, raw):
+        request = har.Request(empty=True)
+        request.devour(raw)
+        return request
+
+    def test_round_trip(self):
+        for raw in [self.RAW, self.RAW.replace("\r\n", "\n"),
+                    "GET  http://example.com/  HTTP/1.0\r\n\r\n"]:
+            request = self.devour(raw)
+            self.assertEqual(raw, request.puke())
+            request.headers #constructed headers render the same
+            self.assertEqual(raw, request.puke())
+            self.assertEqual(raw, har.Request(request.to_json()).puke())
+
+    def test_buffers(self):
+        for raw in [bytearray(self.RAW), memoryview(self.RAW)]:
+            request = self.devour(raw)
+            self.assertEqual(self.RAW, request.puke())
+            self.assertEqual(str, type(request.postData.params[0].value))
+        har._HEAD_WINDOW, window = 16, har._HEAD_WINDOW
+        try:
+            self.assertEqual(self.RAW,
+                             self.devour(memoryview(self.RAW)).puke())
+        finally:
+            har._HEAD_WINDOW = window
+
+    def test_fields(self):
+        request = self.devour(self.RAW)
+        self.assertEqual("POST", request.method)
+        self.assertEqual("http://example.com/login?next=%2F", request.url)
+        self.assertEqual(14, request.bodySize)
+        self.assertEqual(len(self.RAW) - 14, request.headersSize)
+        self.assertEqual([("user", "a"), ("flag", None), ("x", "")],
+                         [ (p.name, p.value)
+                           for p in request.postData.params ])
+        self.assertEqual("application/x-www-form-urlencoded",
+                         request.postData.mimeType)
+
+    def test_lazy_headers(self):
+        request = self.devour(self.RAW)
+        self.assertTrue("headers" in request.__dict__["_pending"])
+        self.assertTrue("headers" in request)
+        headers = request.headers
+        self.assertFalse("_pending" in request.__dict__)
+        self.assertEqual(6, len(headers))
+        self.assertTrue(all(isinstance(h, har.Header) for h in headers))
+        self.assertEqual(("X-Tight", "no space", ":"),
+                         (headers[1].name, headers[1].value,
+                          headers[1]._separator))
+        self.assertEqual(("Continued-Line-Without-Colon", ""),
+                         (headers[3].name, headers[3].value))
+        self.assertRaises(AttributeError, getattr, headers[0], "_separator")
+
+    def test_puke_adds_missing_headers(self):
+        request = self.devour("POST / HTTP/1.1\r\nHost: example.com\r\n\r\n")
+        request.postData.text = "hello"
+        request.postData.mimeType = "text/plain"
+        self.assertEqual("POST / HTTP/1.1\r\nHost: example.com\r\n"
+                         "Content-Type: text/plain\r\n"
+                         "Content-Length: 5\r\n\r\nhello", request.puke())
+
+
+class TestHttpStream(unittest.TestCase):
+
+    STREAM = ("GET /a HTTP/1.1\r\nHost: x.com\r\n\r\n"
+              "\r\n" #a stray blank line between messages
+              "POST /b HTTP/1.1\r\nHost: x.com\r\n"
+              "Transfer-Encoding: chunked\r\n\r\n"
+              "5\r\nhello\r\n6;name=value\r\n world\r\n0\r\n"
+              "X-Trailer: 1\r\n\r\n"
+              "HEAD /c HTTP/1.1\r\nHost: x.com\r\n\r\n"
+              "HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\nabc"
+              "HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+              "3\r\nxyz\r\n0\r\n\r\n"
+              "HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\n"
+              "HTTP/1.1 404 Not Found\r\nSet-Cookie: a=b; Path=/\r\n\r\n"
+              "read until close")
+
+    def devour(self, size):
+        stream = har.HttpStream()
+        messages = []
+        for i in xrange(0, len(self.STREAM), size):
+            messages.extend(stream.feed(self.STREAM[i:i + size]))
+            # never more than the longest message, of 112 bytes, and
+            # the chunk
+            self.assertTrue(stream.buffered <= 112 + size, stream.buffered)
+        return messages + stream.close()
+
+    def test_split(self):
+        for size in [1, 3, 64, len(self.STREAM)]:
+            messages = self.devour(size)
+            self.assertEqual(
+                [(har.Request, "http://x.com/a"),
+                 (har.Request, "http://x.com/b"),
+                 (har.Request, "http://x.com/c"),
+                 (har.Response, 200), (har.Response, 200),
+                 (har.Response, 200), (har.Response, 404)],
+                [ (type(m), getattr(m, "url", None) or m.status)
+                  for m in messages ])
+
+    def test_bodies(self):
+        messages = self.devour(5)
+        self.assertEqual("hello world", messages[1].postData.text)
+        self.assertEqual(51, messages[1].bodySize)
+        self.assertEqual("abc", messages[3].content.text)
+        self.assertEqual("xyz", messages[4].content.text)
+        # the response to HEAD has no body, whatever its length says
+        self.assertEqual(0, messages[5].bodySize)
+        self.assertEqual("read until close", messages[6].content.text)
+        self.assertEqual(["a"], [ c.name for c in messages[6].cookies ])
+
+    def test_kind(self):
+        stream = har.HttpStream(har.Response)
+        self.assertEqual([], stream.feed("HTTP/1.1 204 No Content\r\n"))
+        messages = stream.feed("\r\nHTTP/1.0 304 Not Modified\r\n\r\n")
+        self.assertEqual([204, 304], [ m.status for m in messages ])
+        self.assertEqual(2, stream.count)
+        self.assertEqual(0, stream.buffered)
+
+    def test_interim(self):
+        stream = har.HttpStream(har.Response)
+        for method in ["POST", "HEAD", "GET"]:
+            stream.expect(method)
+        messages = stream.feed(
+            "HTTP/1.1 100 Continue\r\n\r\n"
+            "HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok"
+            "HTTP/1.1 100 Continue\r\n\r\n"
+            "HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\n"
+            "HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\nabc")
+        self.assertEqual([100, 200, 100, 200, 200],
+                         [ m.status for m in messages ])
+        self.assertEqual(["ok", "abc"], [ messages[1].content.text,
+                                          messages[4].content.text ])
+        self.assertEqual(0, messages[3].bodySize)
+        self.assertEqual(0, stream.buffered)
+
+    def test_devour_fails(self):
+        devour = har.Request.devour
+        def failing(self, data, *args, **kwargs):
+            data = data[:4]
+            raise ValueError("bad message")
+        har.Request.devour = failing
+        stream = har.HttpStream()
+        try:
+            self.assertRaises(ValueError, stream.feed,
+                              "GET /a HTTP/1.1\r\n\r\nGET /b HTTP/1.1\r\n")
+        finally:
+            har.Request.devour = devour
+        self.assertEqual(["http://x.com/b"],
+                         [ m.url for m in stream.feed("Host: x.com\r\n\r\n") ])
+
+    def test_truncated(self):
+        stream = har.HttpStream()
+        stream.feed("POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc")
+        self.assertRaises(ValueError, stream.close)
+        stream = har.HttpStream()
+        self.assertRaises(ValueError, stream.feed,
+                          "POST / HTTP/1.1\r\nTransfer-Encoding: chunked"
+                          "\r\n\r\nnot hex\r\n")
+
+    def test_chunked_puke(self):
+        request = har.Request(empty=True)
+        request.devour("POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n"
+                       "\r\n2\r\nab\r\n1\r\nc\r\n0\r\n\r\n")
+        self.assertEqual("abc", request.postData.text)
+        self.assertEqual("POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n"
+                         "\r\n3\r\nabc\r\n0\r\n\r\n", request.puke())
+
+
+class TestContentDecoding(unittest.TestCase):
+
+    TEXT = "hello " * 1000
+
+    def gzipped(self, data):
+        out = StringIO()
+        with gzip.GzipFile(fileobj=out, mode='wb') as fd:
+            fd.write(data)
+        return out.getvalue()
+
+    def devour(self, body, *headers):
+        response = har.Response(empty=True)
+        response.devour("HTTP/1.1 200 OK\r\n" +
+                        "".join(h + "\r\n" for h in headers) +
+                        "Content-Length: {0}\r\n\r\n".format(len(body)) +
+                        body)
+        return response.content
+
+    def test_lazy(self):
+        body = self.gzipped(self.TEXT)
+        content = self.devour(body, "Content-Encoding: gzip")
+        self.assertEqual(body, content.__dict__["_raw"])
+        self.assertFalse("_body" in content.__dict__)
+        self.assertEqual(len(self.TEXT), content.size)
+        self.assertFalse("_raw" in content.__dict__)
+        self.assertFalse("text" in content.__dict__)
+        self.assertEqual(self.TEXT, content.text)
+        self.assertEqual(len(self.TEXT) - len(body), content.compression)
+        self.assertRaises(AttributeError, getattr, content, "encoding")
+
+    def test_to_dict(self):
+        content = self.devour(self.gzipped(self.TEXT),
+                              "Content-Type: text/plain",
+                              "Content-Encoding: gzip")
+        fields = content.to_dict()
+        self.assertEqual(["compression", "mimeType", "size", "text"],
+                         sorted(fields))
+        self.assertEqual(self.TEXT, fields["text"])
+        self.assertEqual([], content.validate())
+        self.assertEqual(fields, har.Content(fields).to_dict())
+
+    def test_deflate(self):
+        for body in [zlib.compress(self.TEXT),
+                     zlib.compress(self.TEXT)[2:-4]]: #sent without zlib's
+                                                      #header, as some do
+            content = self.devour(body, "Content-Encoding: deflate")
+            self.assertEqual(self.TEXT, content.body)
+
+    def test_binary(self):
+        content = self.devour("\xff\xfe\x00\x01")
+        self.assertEqual("base64", content.encoding)
+        self.assertEqual("\xff\xfe\x00\x01", content.text.decode('base64'))
+        self.assertEqual("\xff\xfe\x00\x01", content.body)
+        self.assertEqual(4, content.size)
+        self.assertFalse("compression" in content.to_dict())
+
+    def test_kept_compressed(self):
+        body = self.gzipped(self.TEXT)
+        limit, har.CONTENT_MAX_SIZE = har.CONTENT_MAX_SIZE, 100
+        try:
+            content = self.devour(body, "Content-Encoding: gzip")
+            self.assertEqual(body, content.body)
+        finally:
+            har.CONTENT_MAX_SIZE = limit
+        self.assertEqual("gzip; base64", content.encoding)
+        self.assertEqual(body, content.text.decode('base64'))
+        content = self.devour("not gzip", "Content-Encoding: gzip")
+        self.assertEqual("not gzip", content.body)
+        self.assertEqual("gzip; base64", content.encoding)
+
+    def test_loaded(self):
+        content = har.Content({"size": 3, "mimeType": "text/plain",
+                               "text": "abc"})
+        self.assertEqual(None, content.body)
+        self.assertRaises(AttributeError, getattr, content, "encoding")
+
+
+class TestBodyStore(unittest.TestCase):
+
+    BODY = "<script>" + "x" * 5000 + "</script>"
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.store = har.BodyStore(os.path.join(self.dir, "bodies"))
+
+    def tearDown(self):
+        har.BODY_STORE = None
+        shutil.rmtree(self.dir)
+
+    def devour(self, body, *headers):
+        response = har.Response(empty=True)
+        response.devour("HTTP/1.1 200 OK\r\n" +
+                        "".join(h + "\r\n" for h in headers) +
+                        "Content-Length: {0}\r\n\r\n".format(len(body)) +
+                        body)
+        return response
+
+    def test_put(self):
+        key = self.store.put(self.BODY)
+        self.assertEqual(key, self.store.put(self.BODY))
+        self.assertTrue(key in self.store)
+        self.assertEqual(self.BODY, self.store.get(key))
+        self.assertEqual(1, len(os.listdir(self.store.path)))
+        self.assertRaises(KeyError, self.store.get, "0" * 64)
+        # a new store over the same directory finds what is there
+        self.assertTrue(key in har.BodyStore(self.store.path))
+
+    def test_devour(self):
+        har.BODY_STORE = self.store
+        responses = [ self.devour(self.BODY) for _ in range(3) ]
+        small = self.devour("tiny")
+        refs = set(r.content._bodyRef for r in responses)
+        self.assertEqual(1, len(refs))
+        self.assertFalse("_raw" in responses[0].content.__dict__)
+        self.assertEqual(self.BODY, responses[0].content.text)
+        self.assertEqual(len(self.BODY), responses[0].content.size)
+        self.assertEqual("tiny", small.content.text)
+        self.assertFalse("_bodyRef" in small.content.__dict__)
+
+    def test_compressed_and_binary(self):
+        har.BODY_STORE = self.store
+        out = StringIO()
+        with gzip.GzipFile(fileobj=out, mode='wb') as fd:
+            fd.write(self.BODY)
+        content = self.devour(out.getvalue(),
+                              "Content-Encoding: gzip").content
+        self.assertEqual(self.BODY, self.store.get(content._bodyRef))
+        self.assertTrue(content.compression > 0)
+        binary = "\xff" * 5000
+        content = self.devour(binary).content
+        self.assertEqual("base64", content.encoding)
+        self.assertEqual(binary, content.text.decode('base64'))
+        self.assertEqual(binary, content.body)
+
+    def test_to_json(self):
+        har.BODY_STORE = self.store
+        response = self.devour(self.BODY, "Content-Type: text/html")
+        content = json.loads(response.to_json(inline_bodies=False))["content"]
+        self.assertFalse("text" in content)
+        self.assertEqual(response.content._bodyRef, content["_bodyRef"])
+        inline = json.loads(response.to_json())["content"]
+        self.assertEqual(self.BODY, inline["text"])
+        self.assertFalse("_bodyRef" in inline)
+        self.assertTrue(har.INLINE_BODIES)
+        self.assertEqual(content, json.loads(json.dumps(
+            response, cls=har.HarEncoder, inline_bodies=False))["content"])
+        entry = har.Entry(ENTRY_JSON % 0)
+        entry.response = response
+        out = StringIO()
+        with har.HarWriter(out, inline_bodies=False) as hw:
+            hw.write(entry)
+        written = json.loads(out.getvalue())["log"]["entries"][0]
+        self.assertEqual(content, written["response"]["content"])
+        # references are followed through BODY_STORE once loaded back
+        self.assertEqual(self.BODY, har.Content(content).text)
+        har.BODY_STORE = None
+        self.assertRaises(ValueError, getattr, har.Content(content), "text")
+
+    def test_spill(self):
+        content = har.Content({"size": len(self.BODY), "mimeType": "",
+                               "text": self.BODY})
+        self.assertFalse(content.spill())
+        self.assertTrue(content.spill(self.store))
+        self.assertFalse("text" in content.__dict__)
+        self.assertEqual(self.BODY, content.text)
+        self.assertFalse(har.Content({"size": 4, "mimeType": "",
+                                      "text": "tiny"}).spill(self.store))
+
+
+class TestStringTable(unittest.TestCase):
+
+    def test_table(self):
+        strings = har.StringTable(max_length=8)
+        first = "".join(["Acc", "ept"])
+        second = "".join(["Ac", "cept"])
+        self.assertTrue(strings(first) is first)
+        self.assertTrue(strings(second) is first)
+        long_value = "x" * 9
+        self.assertTrue(strings(long_value) is long_value)
+        self.assertEqual({"strings": 1, "hits": 1, "misses": 1,
+                          "skipped": 1, "hit_rate": 0.5}, strings.stats())
+        self.assertEqual(1, len(strings))
+
+    def test_log(self):
+        for lazy in [False, True]:
+            hc = har.HarContainer(make_har_json(), lazy=lazy)
+            entries = hc.log.entries
+            one, two = entries[0].request, entries[2].request
+            self.assertTrue(one.headers[1].name is two.headers[1].name)
+            self.assertTrue(one.headers[1].value is two.headers[1].value)
+            self.assertTrue(one.httpVersion is entries[1].response.httpVersion)
+            self.assertTrue(entries[0].pageref is entries[1].pageref)
+            # per entry: 3 header names and values, 2 versions, method,
+            # statusText, redirectURL, pageref and mimeType
+            self.assertEqual(3 * 13, hc.log.strings.looked_up)
+            self.assertTrue(hc.log.strings.stats()["hit_rate"] > 0.7)
+
+    def test_devour(self):
+        strings = har.StringTable()
+        raw = ("GET /?q=1 HTTP/1.1\r\nHost: example.com\r\n"
+               "Accept: */*\r\n\r\n")
+        one, two = har.Request(empty=True), har.Request(empty=True)
+        one.devour(raw, strings=strings)
+        two.devour(raw, strings=strings)
+        self.assertTrue(one.headers[1].value is two.headers[1].value)
+        self.assertTrue(one.method is two.method)
+        self.assertTrue(one.queryString[0].name is two.queryString[0].name)
+
+    def test_stream(self):
+        log = har.Log()
+        stream = har.HttpStream(har.Response, strings=log.strings)
+        messages = stream.feed("HTTP/1.1 200 OK\r\nContent-Length: 0\r\n"
+                               "Set-Cookie: a=b\r\n\r\n" * 2)
+        self.assertTrue(messages[0].headers[0].name is
+                        messages[1].headers[0].name)
+        self.assertTrue(messages[0].cookies[0].value is
+                        messages[1].cookies[0].value)
+        self.assertTrue(log.strings.hits > 0)
+        # a stream keeps no strings of its own unless given a table
+        self.assertEqual(None, har.HttpStream().strings)
+
+
+class TestHeaderList(unittest.TestCase):
+
+    RAW = ("GET / HTTP/1.1\r\nHost: example.com\r\nAccept:*/*\r\n"
+           "X-Dup: 1\r\nx-dup: 2\r\n\r\n")
+
+    def headers(self):
+        request = har.Request(empty=True)
+        request.devour(self.RAW)
+        return request, request.headers
+
+    def test_loaded(self):
+        entry = har.Entry(json.loads(ENTRY_JSON % 0))
+        self.assertTrue(isinstance(entry.request.headers, har._HeaderList))
+        self.assertTrue(isinstance(entry.response.headers, har._HeaderList))
+        self.assertEqual("*/*", entry.request.headers.get("ACCEPT"))
+        self.assertTrue("host" in entry.request.headers)
+        self.assertEqual(json.loads(ENTRY_JSON % 0), entry.to_dict())
+
+    def test_get(self):
+        request, headers = self.headers()
+        self.assertTrue(isinstance(headers, har._HeaderList))
+        self.assertEqual("example.com", headers.get("host"))
+        self.assertEqual(["1", "2"], headers.get_all("X-DUP"))
+        self.assertEqual(None, headers.get("Cookie"))
+        self.assertEqual("-", headers.get("Cookie", "-"))
+        self.assertFalse("Cookie" in headers)
+        self.assertTrue("accept" in headers)
+        self.assertTrue(headers[0] in headers)
+
+    def test_set(self):
+        request, headers = self.headers()
+        request.set_header("X-DUP", "3")
+        self.assertEqual(["Host", "Accept", "X-Dup"],
+                         [ h.name for h in headers ])
+        self.assertEqual(["3"], headers.get_all("x-dup"))
+        header = headers.set("Cookie", "a=b")
+        self.assertEqual(3, header._sequence)
+        self.assertEqual("GET / HTTP/1.1\r\nHost: example.com\r\n"
+                         "Accept:*/*\r\nX-Dup: 3\r\nCookie: a=b\r\n\r\n",
+                         request.puke())
+
+    def test_add_remove(self):
+        request, headers = self.headers()
+        headers.add("x-dup", "3")
+        self.assertEqual(["1", "2", "3"], headers.get_all("X-Dup"))
+        self.assertEqual(3, headers.remove("X-DUP"))
+        self.assertEqual(0, headers.remove("X-Dup"))
+        self.assertEqual(["Host", "Accept"], [ h.name for h in headers ])
+        headers.remove(headers[0])
+        self.assertEqual(None, headers.get("Host"))
+        headers.pop()
+        self.assertEqual([], headers.get_all("Accept"))
+
+    def test_list_changes(self):
+        request, headers = self.headers()
+        headers.get("Host")
+        headers.insert(0, har.Header({"name": "Early", "value": "1"}))
+        headers.append(har.Header({"name": "Late", "value": "2"}))
+        del headers[1]
+        self.assertEqual("1", headers.get("early"))
+        self.assertEqual("2", headers.get("late"))
+        self.assertEqual(None, headers.get("host"))
+        request.headers = [har.Header({"name": "Plain", "value": "list"})]
+        request.set_header("plain", "again")
+        self.assertEqual("again", request.headers.get("Plain"))
+
+    def test_pickle(self):
+        request, headers = self.headers()
+        copy = pickle.loads(pickle.dumps(request, 2))
+        self.assertTrue(isinstance(copy.headers, har._HeaderList))
+        self.assertEqual(["1", "2"], copy.headers.get_all("x-dup"))
+
+
+class TestReplace(unittest.TestCase):
+
+    def entry(self, lazy=False):
+        return har.Entry(json.loads(ENTRY_JSON % 0), lazy=lazy)
+
+    def test_field(self):
+        request = self.entry().request
+        before = request.to_dict()
+        copies = [ request.replace(url="http://foo.com/%d/user" % i)
+                   for i in xrange(3) ]
+        self.assertEqual(["http://foo.com/%d/user" % i for i in xrange(3)],
+                         [ r.url for r in copies ])
+        self.assertEqual(before, request.to_dict())
+        self.assertFalse(copies[0].headers is request.headers)
+        self.assertEqual(request.to_dict()["headers"],
+                         copies[0].to_dict()["headers"])
+
+    def test_every_class(self):
+        entry = self.entry()
+        for obj in [entry, entry.request, entry.response,
+                    entry.response.content, entry.timings,
+                    entry.request.headers[0], har.Log(), har.HarContainer()]:
+            copy = obj.replace(comment="changed")
+            self.assertTrue(type(copy) is type(obj))
+            self.assertEqual("changed", copy.comment)
+            self.assertFalse("comment" in obj.to_dict())
+            plain = copy.to_dict()
+            del plain["comment"]
+            self.assertEqual(obj.to_dict(), plain)
+
+    def test_nested(self):
+        entry = self.entry()
+        copy = entry.replace(request__url="http://example.com/x",
+                             request__method="POST", timings__wait=1)
+        self.assertEqual("http://example.com/x", copy.request.url)
+        self.assertEqual("POST", copy.request.method)
+        self.assertEqual(1, copy.timings.wait)
+        self.assertEqual(json.loads(ENTRY_JSON % 0), entry.to_dict())
+        self.assertFalse(copy.response is entry.response)
+        self.assertEqual(entry.response.to_dict(), copy.response.to_dict())
+
+    def test_header(self):
+        request = self.entry().request
+        copy = request.replace(header__accept="text/html",
+                               header__Cookie="a=b",
+                               header__Host=None)
+        self.assertEqual(["Accept", "Cookie"],
+                         [ h.name for h in copy.headers ])
+        self.assertEqual("text/html", copy.headers.get("Accept"))
+        self.assertEqual("a=b", copy.headers.get("cookie"))
+        self.assertTrue(isinstance(copy.headers, har._HeaderList))
+        self.assertEqual("*/*", request.headers.get("Accept"))
+        self.assertEqual(["Host", "Accept"],
+                         [ h.name for h in request.headers ])
+        copy = request.replace(**{"header__User_Agent": "harpy"})
+        self.assertEqual("User-Agent", copy.headers[-1].name)
+        self.assertFalse(copy.headers[0] is request.headers[0])
+
+    def test_cookie_and_param(self):
+        request = self.entry().request
+        copy = request.replace(cookie__session_id="1", postData=har.PostData(
+            {"mimeType": "text/plain", "text": "", "params": [
+                {"name": "a", "value": "1"}, {"name": "b", "value": "2"}]}))
+        self.assertEqual([], request.cookies)
+        self.assertEqual([("session_id", "1")],
+                         [ (c.name, c.value) for c in copy.cookies ])
+        again = copy.replace(postData__param__a="3", postData__param__b=None)
+        self.assertEqual([("a", "3")], [ (p.name, p.value)
+                                         for p in again.postData.params ])
+        self.assertEqual(["1", "2"],
+                         [ p.value for p in copy.postData.params ])
+
+    def test_lazy(self):
+        entry = self.entry(lazy=True)
+        copy = entry.replace(request__header__Accept="text/html")
+        self.assertEqual("text/html", copy.request.headers.get("Accept"))
+        self.assertEqual(json.loads(ENTRY_JSON % 0), entry.to_dict())
+        self.assertTrue("request" in entry._pending)
+        self.assertEqual("*/*", entry.request.headers.get("Accept"))
+
+    def test_devoured(self):
+        request = har.Request(empty=True)
+        request.devour("GET / HTTP/1.1\r\nHost: example.com\r\n"
+                       "X-Token: 1\r\n\r\n")
+        copy = request.replace(header__X_Token="2")
+        self.assertEqual("GET / HTTP/1.1\r\nHost: example.com\r\n"
+                         "X-Token: 2\r\n\r\n", copy.puke())
+        self.assertEqual("GET / HTTP/1.1\r\nHost: example.com\r\n"
+                         "X-Token: 1\r\n\r\n", request.puke())
+
+    def test_copy_changed(self):
+        entry = self.entry()
+        before = entry.to_dict()
+        copy = entry.replace(request__url="http://example.com/x")
+        copy.request.set_header("Host", "other.com")
+        copy.request.headers.append(har.Header({"name": "X", "value": "1"}))
+        copy.request.headers[1].value = "text/html"
+        copy.response.content.text = "changed"
+        copy.timings.wait = 1
+        self.assertEqual(before, entry.to_dict())
+        self.assertEqual("other.com", copy.request.headers.get("Host"))
+        self.assertEqual(3, len(copy.request.headers))
+
+    def test_original_changed(self):
+        entry = self.entry()
+        copy = entry.replace(comment="copy")
+        expected = copy.to_dict()
+        entry.request.set_header("Accept", "text/html")
+        entry.response.status = 500
+        entry.request.headers.append(har.Header({"name": "X", "value": "1"}))
+        self.assertEqual(expected, copy.to_dict())
+        self.assertEqual(500, entry.response.status)
+
+    def test_reference_kept(self):
+        entry = self.entry()
+        request = entry.request
+        headers = request.headers
+        copy = entry.replace(comment="copy")
+        request.url = "http://mutated/"
+        headers.append(har.Header({"name": "X", "value": "1"}))
+        self.assertTrue(entry.request is request)
+        self.assertTrue(entry.request.headers is headers)
+        self.assertEqual("http://mutated/", entry.request.url)
+        self.assertEqual("X", entry.request.headers[-1].name)
+        self.assertEqual(json.loads(ENTRY_JSON % 0)["request"],
+                         copy.request.to_dict())
+
+    def test_parent(self):
+        hc = har.HarContainer(make_har_json(2))
+        copy = hc.replace(comment="copy")
+        self.assertTrue(copy.log._parent is copy)
+        self.assertTrue(hc.log._parent is hc)
+        self.assertFalse(copy.log is hc.log)
+        copy.log.entries.pop()
+        self.assertEqual(2, len(hc.log.entries))
+        self.assertEqual([], copy.validate())
+
+    def test_not_a_child(self):
+        request = self.entry().request
+        self.assertRaises(AttributeError, request.replace, url__x=1)
+        self.assertRaises(AttributeError, request.replace, nothing__x=1)
+
+
+class TestRequestTemplate(unittest.TestCase):
+
+    RAW = ("POST /a/b?x=1&y=2 HTTP/1.1\r\nHost: example.com\r\n"
+           "Cookie:s=1\r\n"
+           "Content-Type: application/x-www-form-urlencoded\r\n"
+           "Content-Length: 7\r\n\r\nu=1&p=2")
+    CHUNKED = ("POST / HTTP/1.1\r\nHost: a\r\n"
+               "Transfer-Encoding: chunked\r\n"
+               "Content-Type: application/x-www-form-urlencoded\r\n\r\n"
+               "3\r\na=1\r\n0\r\n\r\n")
+
+    def request(self, raw):
+        request = har.Request(empty=True)
+        request.devour(raw)
+        return request
+
+    def test_points(self):
+        template = har.RequestTemplate(self.request(self.RAW))
+        self.assertEqual(["path__0", "path__1", "query__x", "query__y",
+                          "header__host", "header__cookie",
+                          "header__content-type", "header__content-length",
+                          "param__u", "param__p"], template.points)
+        template = har.RequestTemplate(self.request(self.RAW),
+                                       points=["param__p", "header__Host"])
+        self.assertEqual(["header__host", "param__p"], template.points)
+
+    def test_unchanged(self):
+        for raw in [self.RAW, self.CHUNKED, self.RAW.replace("\r\n", "\n")]:
+            request = self.request(raw)
+            rendered = har.RequestTemplate(request).render()
+            self.assertEqual(request.puke(), rendered)
+            self.assertTrue(type(rendered) is str)
+        entry = har.Entry(json.loads(ENTRY_JSON % 3))
+        rendered = har.RequestTemplate(entry.request).render()
+        self.assertEqual(entry.request.puke(), rendered)
+        self.assertTrue(type(rendered) is str)
+
+    def test_render(self):
+        template = har.RequestTemplate(self.request(self.RAW))
+        self.assertEqual(
+            "POST /a/c?x=1&y=9 HTTP/1.1\r\nHost: example.com\r\n"
+            "Cookie:s=2\r\n"
+            "Content-Type: application/x-www-form-urlencoded\r\n"
+            "Content-Length: 11\r\n\r\nu=admin&p=2",
+            template.render({"path__1": "c", "query__y": "9",
+                             "header__Cookie": "s=2", "param__u": "admin"}))
+        self.assertTrue(template.render(header__content_length="99",
+                                        param__u=u"\xe9").endswith(
+            "Content-Length: 99\r\n\r\nu=\xc3\xa9&p=2"))
+        self.assertRaises(KeyError, template.render, header__Accept="*/*")
+        self.assertEqual(self.RAW, template.render())
+
+    def test_chunked(self):
+        template = har.RequestTemplate(self.request(self.CHUNKED))
+        self.assertTrue(template.render(param__a="hello").endswith(
+            "\r\n\r\n7\r\na=hello\r\n0\r\n\r\n"))
+
+    def test_render_all(self):
+        template = har.RequestTemplate(self.request(self.RAW),
+                                       points=["query__x"])
+        rendered = list(template.render_all({"query__x": str(i)}
+                                            for i in xrange(3)))
+        self.assertEqual([self.RAW.replace("x=1", "x=%d" % i)
+                          for i in xrange(3)], rendered)
+
+
 class TestUsage(unittest.TestCase):
     def test_usage(self):
         expected = "usage: %s (docs|test)\n\n" % "test"
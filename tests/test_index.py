@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import os
+import json
+import shutil
+import unittest
+
+from sys import path
+from tempfile import mkdtemp
+
+path.append('./')
+path.append('../')
+import har
+from utils.index import HarIndex, HarCorpus, IndexRow
+
+################################################################################
+# Fixtures
+################################################################################
+
+def make_entry(i, host="example.com", status=200, method="GET",
+               mime_type="text/html; charset=UTF-8"):
+    return {"startedDateTime": "2012-06-25T22:50:54.188477-07:00",
+            "time": 50,
+            "request": {"method": method,
+                        "url": "http://%s:8080/%d" % (host, i),
+                        "httpVersion": "HTTP/1.1", "cookies": [],
+                        "queryString": [], "headers": [],
+                        "headersSize": 150, "bodySize": -1},
+            "response": {"status": status, "statusText": "OK",
+                         "httpVersion": "HTTP/1.1", "cookies": [],
+                         "headers": [],
+                         "content": {"size": i, "mimeType": mime_type},
+                         "redirectURL": "", "headersSize": 160,
+                         "bodySize": i},
+            "cache": {},
+            "timings": {"send": 1, "wait": 40, "receive": 9}}
+
+
+def make_har(entries):
+    return json.dumps({"log": {"version": "1.2",
+                               "creator": {"version": "$Id$",
+                                           "name": "Harpy"},
+                               "entries": entries}})
+
+
+################################################################################
+# Test Cases
+################################################################################
+
+class TestHarIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.name = os.path.join(self.dir, "a.har")
+        open(self.name, 'w').write(make_har([
+            make_entry(0),
+            make_entry(1, host="Www.Google.com", status=404),
+            make_entry(2, method="POST", mime_type="application/json"),
+            make_entry(3, host="www.google.com")]))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_rows(self):
+        index = HarIndex(self.name)
+        self.assertEqual(4, len(index))
+        row = index.rows[1]
+        self.assertTrue(isinstance(row, IndexRow))
+        self.assertEqual(u"www.google.com", row.host)
+        self.assertEqual(404, row.status)
+        self.assertEqual(u"text/html", row.mimeType)
+        self.assertEqual(1, row.responseBodySize)
+        data = open(self.name).read()
+        self.assertEqual(make_entry(1, host="Www.Google.com", status=404),
+                         json.loads(data[row.start:row.end]))
+
+    def test_find(self):
+        index = HarIndex(self.name)
+        self.assertEqual([1, 3], [ r.index for r in
+                                   index.find(host="www.google.com") ])
+        self.assertEqual([3], [ r.index for r in
+                                index.find(host="www.google.com",
+                                           status=200) ])
+        self.assertEqual([1, 3], [ r.index for r in
+                                   index.find(host="WWW.Google.com") ])
+        self.assertEqual([1, 3], [ r.index for r in
+                                   index.find(host=["Www.Google.Com"]) ])
+        self.assertEqual([0, 1], [ r.index for r in
+                                   index.find(status=set([200, 404]),
+                                              method="GET",
+                                              mimeType="TEXT/HTML",
+                                              contentSize=lambda s: s < 3) ])
+        self.assertEqual([2], [ r.index for r in
+                                index.find(mimeType=["application/json"]) ])
+        self.assertEqual([], index.find(status=500))
+        self.assertEqual([], index.find(host=None))
+        self.assertEqual([1, 3], [ r.index for r in
+                                   index.find(host=[None, "www.google.com"]) ])
+
+    def test_entries(self):
+        entries = list(HarIndex(self.name).entries(method="POST"))
+        self.assertEqual(1, len(entries))
+        self.assertTrue(isinstance(entries[0], har.Entry))
+        self.assertEqual(u"http://example.com:8080/2",
+                         entries[0].request.url)
+
+    def test_saved(self):
+        HarIndex(self.name)
+        self.assertTrue(os.path.exists(self.name + ".idx"))
+        self.assertEqual(["a.har", "a.har.idx"], sorted(os.listdir(self.dir)))
+        saved = open(self.name + ".idx").read()
+        self.assertEqual(4, len(HarIndex(self.name)))
+        self.assertEqual(saved, open(self.name + ".idx").read())
+
+    def test_stale(self):
+        HarIndex(self.name)
+        open(self.name, 'w').write(make_har([make_entry(7)]))
+        index = HarIndex(self.name)
+        self.assertEqual([7], [ r.contentSize for r in index.rows ])
+        self.assertEqual(1, len(list(index.entries())))
+
+
+class TestHarCorpus(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.names = []
+        for n in range(3):
+            name = os.path.join(self.dir, "%d.har" % n)
+            open(name, 'w').write(make_har([
+                make_entry(i, status=200 + n) for i in range(n + 1) ]))
+            self.names.append(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_find(self):
+        corpus = HarCorpus(self.names)
+        self.assertEqual(6, len(corpus))
+        self.assertEqual([(self.names[2], 0), (self.names[2], 2)],
+                         [ (path, row.index) for path, row in
+                           corpus.find(status=202,
+                                       contentSize=lambda s: s != 1) ])
+
+    def test_entries(self):
+        corpus = HarCorpus(self.names)
+        found = list(corpus.entries(status=set([200, 201])))
+        self.assertEqual([self.names[0], self.names[1], self.names[1]],
+                         [ path for path, entry in found ])
+        self.assertEqual(201, found[-1][1].response.status)
+
+
+if __name__ == '__main__':
+    unittest.main()
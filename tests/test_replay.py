@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+import unittest
+
+from sys import path
+
+path.append('./')
+path.append('../')
+from utils.replay import replay, _shard
+from test_engine import _Server, make_request
+
+################################################################################
+# Tests
+################################################################################
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = [_Server(), _Server()]
+        self.bases = [ "http://127.0.0.1:{0}".format(server.port)
+                       for server in self.servers ]
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def requests(self, count):
+        return [ make_request(self.bases[i % 2] + "/len/%d" % i)
+                 for i in range(count) ]
+
+    def test_order(self):
+        entries = list(replay(self.requests(60), workers=3, batch=4,
+                              window=16, per_host=1, timeout=5))
+        self.assertEqual(range(60), [ e._sequence for e in entries ])
+        self.assertEqual(range(60), [ e.response.content.size
+                                      for e in entries ])
+        self.assertEqual([200] * 60, [ e.response.status for e in entries ])
+        # each host is replayed by one worker, over one connection
+        self.assertEqual([1, 1], [ s.connections for s in self.servers ])
+        self.assertEqual([30, 30], [ len(s.requests) for s in self.servers ])
+
+    def test_sequence_kept(self):
+        requests = self.requests(5)
+        for i, request in enumerate(requests):
+            request._sequence = 100 - 10 * i
+        entries = list(replay(requests, workers=2, per_host=2, timeout=5))
+        self.assertEqual([ r._sequence for r in requests ],
+                         [ e._sequence for e in entries ])
+        self.assertEqual([ r.url for r in requests ],
+                         [ e.request.url for e in entries ])
+
+    def test_shard(self):
+        # requests an Engine would pool together go to the same worker
+        for same in [("http://a/", "http://A:80/x", "HTTP://a"),
+                     ("https://a/", "https://a:443/")]:
+            self.assertEqual(1, len(set(_shard(make_request(url), 7)
+                                        for url in same)))
+
+    def test_stop_early(self):
+        entries = replay(self.requests(40), workers=2, window=8)
+        self.assertEqual(0, next(entries)._sequence)
+        entries.close()
+
+    def test_worker_failure(self):
+        entries = replay(self.requests(2), workers=1, no_such_option=1)
+        self.assertRaises(RuntimeError, list, entries)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+import time
+import unittest
+
+from sys import path
+
+path.append('./')
+path.append('../')
+from utils.engine import Engine
+from utils.scheduler import Scheduler
+from test_engine import _Server, make_request
+
+################################################################################
+# Fixtures
+################################################################################
+
+class _Request(object):
+
+    def __init__(self, name, priority=None):
+        self.name = name
+        if priority is not None:
+            self._priority = priority
+
+
+def key(host):
+    return (host, 80, False)
+
+
+def drain(scheduler, now=0, has_room=lambda key: True):
+    items = []
+    while True:
+        item = scheduler.pop(now, has_room)
+        if item is None:
+            return items
+        items.append(item)
+
+
+################################################################################
+# Tests
+################################################################################
+
+class TestScheduler(unittest.TestCase):
+
+    def test_round_robin(self):
+        scheduler = Scheduler()
+        for host, count in [("a", 4), ("b", 2), ("c", 1)]:
+            for i in range(count):
+                name = "%s%d" % (host, i)
+                scheduler.push(key(host), _Request(name), name)
+        self.assertEqual(7, len(scheduler))
+        self.assertEqual(["a0", "b0", "c0", "a1", "b1", "a2", "a3"],
+                         drain(scheduler))
+        self.assertEqual(0, len(scheduler))
+
+    def test_priority(self):
+        scheduler = Scheduler()
+        scheduler.push(key("a"), _Request("new"), "new")
+        scheduler.push(key("a"), _Request("retest", -1), "retest")
+        scheduler.push(key("b"), _Request("later", 5), "later")
+        scheduler.push(key("a"), _Request("retry"), "retry", first=True)
+        self.assertEqual(["retest", "retry", "new", "later"],
+                         drain(scheduler))
+        scheduler = Scheduler(priority=lambda request: -len(request.name))
+        for name in ["a", "aaa", "aa"]:
+            scheduler.push(key("a"), _Request(name), name)
+        self.assertEqual(["aaa", "aa", "a"], drain(scheduler))
+
+    def test_no_room(self):
+        # a host that cannot send now is passed over, even for a lower
+        # priority, and keeps its turn
+        scheduler = Scheduler()
+        scheduler.push(key("a"), _Request("a0"), "a0")
+        scheduler.push(key("b"), _Request("b0", 1), "b0")
+        scheduler.push(key("b"), _Request("b1", 1), "b1")
+        busy = lambda k: k != key("a")
+        self.assertEqual(["b0", "b1"], drain(scheduler, has_room=busy))
+        self.assertEqual(["a0"], drain(scheduler))
+
+    def test_rate(self):
+        scheduler = Scheduler(rate=2, burst=2, rates={"slow": (1, 1)})
+        for i in range(4):
+            scheduler.push(key("a"), _Request("a"), "a%d" % i)
+            scheduler.push(key("slow"), _Request("s"), "s%d" % i)
+        self.assertEqual(["a0", "s0", "a1"], drain(scheduler, now=100))
+        self.assertEqual(0.5, scheduler.wait(100))
+        self.assertEqual(["a2"], drain(scheduler, now=100.5))
+        self.assertEqual(["s1", "a3"], drain(scheduler, now=101))
+        self.assertEqual(1.0, scheduler.wait(101))
+        self.assertEqual([], drain(scheduler, now=101.5))
+        self.assertEqual(["s2"], drain(scheduler, now=102))
+        scheduler.clear()
+        self.assertEqual(0, len(scheduler))
+        self.assertEqual(None, scheduler.wait(102))
+
+
+class TestEngineScheduling(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _Server()
+        self.base = "http://127.0.0.1:{0}".format(self.server.port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_rate(self):
+        requests = [ make_request(self.base + "/len/%d" % i)
+                     for i in range(5) ]
+        engine = Engine(timeout=5, scheduler=Scheduler(rate=20, burst=1))
+        start = time.time()
+        entries = list(engine.run(requests))
+        self.assertTrue(time.time() - start >= 0.18)
+        self.assertEqual([200] * 5, [ e.response.status for e in entries ])
+
+    def test_priority(self):
+        requests = [ make_request(self.base + "/len/%d" % i)
+                     for i in range(6) ]
+        for request in requests[3:]:
+            request._priority = -1
+        engine = Engine(concurrency=1, backlog=6, timeout=5)
+        entries = list(engine.run(requests))
+        self.assertEqual([3, 4, 5, 0, 1, 2],
+                         [ e._sequence for e in entries ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+import json
+import random
+import unittest
+
+from sys import path
+from StringIO import StringIO
+
+path.append('./')
+path.append('../')
+import har
+from utils import stats
+
+################################################################################
+# Fixtures
+################################################################################
+
+def make_entry(url, wait, status=200, pageref="page_0", dns=-1):
+    return {"startedDateTime": "2012-06-25T22:50:54.188477-07:00",
+            "pageref": pageref,
+            "time": wait + 10,
+            "request": {"method": "GET", "url": url,
+                        "httpVersion": "HTTP/1.1", "cookies": [],
+                        "queryString": [], "headers": [],
+                        "headersSize": 150, "bodySize": -1},
+            "response": {"status": status, "statusText": "",
+                         "httpVersion": "HTTP/1.1", "cookies": [],
+                         "headers": [],
+                         "content": {"size": 0, "mimeType": "text/html"},
+                         "redirectURL": "", "headersSize": 160,
+                         "bodySize": 0},
+            "cache": {},
+            "timings": {"dns": dns, "send": 5, "wait": wait, "receive": 5}}
+
+
+def make_log():
+    entries = []
+    for i in range(1, 11):
+        entries.append(make_entry("http://a.com/user/%d/profile" % i, i * 10,
+                                  dns=i))
+    for i in range(1, 5):
+        entries.append(make_entry("http://B.com:81/x?q=%d" % i, i,
+                                  status=500, pageref="page_1"))
+    return har.Log({"version": "1.2",
+                    "creator": {"name": "Harpy", "version": "$Id$"},
+                    "pages": [{"id": "page_0", "title": "",
+                               "startedDateTime":
+                               "2012-06-25T22:50:54.188477-07:00",
+                               "pageTimings": {"onLoad": 100,
+                                               "onContentLoad": 50}},
+                              {"id": "page_1", "title": "",
+                               "startedDateTime":
+                               "2012-06-25T22:50:54.188477-07:00",
+                               "pageTimings": {"onLoad": 300}}],
+                    "entries": entries})
+
+
+################################################################################
+# Test Cases
+################################################################################
+
+class TestTimingStats(unittest.TestCase):
+
+    def setUp(self):
+        self.log = make_log()
+        self.modes = [False] + ([True] if stats.numpy is not None else [])
+
+    def test_by_host(self):
+        for use_numpy in self.modes:
+            result = stats.timing_stats(self.log, use_numpy=use_numpy)
+            self.assertEqual(set(["a.com", "b.com"]), set(result))
+            wait = result["a.com"]["wait"]
+            self.assertEqual(10, wait["count"])
+            self.assertAlmostEqual(55.0, wait["p50"])
+            self.assertAlmostEqual(91.0, wait["p90"])
+            self.assertAlmostEqual(99.1, wait["p99"])
+            self.assertEqual(100, wait["max"])
+            self.assertEqual(4, result["b.com"]["time"]["count"])
+            self.assertEqual(14, result["b.com"]["time"]["max"])
+
+    def test_not_applicable(self):
+        for use_numpy in self.modes:
+            result = stats.timing_stats(self.log, use_numpy=use_numpy)
+            self.assertEqual(10, result["a.com"]["dns"]["count"])
+            self.assertEqual(0, result["b.com"]["dns"]["count"])
+            self.assertEqual(None, result["b.com"]["dns"]["p50"])
+            self.assertEqual(0, result["a.com"]["ssl"]["count"])
+
+    def test_groupings(self):
+        result = stats.timing_stats(self.log, by="status", use_numpy=False)
+        self.assertEqual(set(["2xx", "5xx"]), set(result))
+        result = stats.timing_stats(self.log, by="pageref", use_numpy=False)
+        self.assertEqual(4, result["page_1"]["wait"]["count"])
+        result = stats.timing_stats(self.log, by="pattern", use_numpy=False)
+        self.assertEqual(set(["a.com/user/{n}/profile", "b.com:81/x"]),
+                         set(result))
+        result = stats.timing_stats(self.log, by=None, use_numpy=False)
+        self.assertEqual(14, result[None]["wait"]["count"])
+        result = stats.timing_stats(
+            self.log, by=lambda e: e.request.url[-1], phases=("wait",),
+            quantiles=(0.5,), use_numpy=False)
+        self.assertEqual(["count", "max", "p50"], sorted(result["4"]["wait"]))
+        self.assertRaises(ValueError, stats.timing_stats, self.log,
+                          by="colour")
+
+    def test_page_stats(self):
+        for use_numpy in self.modes:
+            result = stats.page_stats(self.log, use_numpy=use_numpy)
+            self.assertEqual(2, result["onLoad"]["count"])
+            self.assertEqual(300, result["onLoad"]["max"])
+            self.assertAlmostEqual(200.0, result["onLoad"]["p50"])
+            self.assertEqual(1, result["onContentLoad"]["count"])
+        self.assertEqual(0, stats.page_stats(har.Log())["onLoad"]["count"])
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    def test_accuracy(self):
+        generator = random.Random(7)
+        values = [ generator.lognormvariate(3, 1.5) for _ in range(5000) ]
+        values += [0] * 100
+        sketch = stats.QuantileSketch(relative_accuracy=0.01)
+        for value in values:
+            sketch.add(value)
+        values.sort()
+        for quantile in (0.01, 0.5, 0.9, 0.99):
+            exact = values[int(quantile * (len(values) - 1))]
+            self.assertTrue(abs(sketch.quantile(quantile) - exact)
+                            <= exact * 0.01 + 1e-9,
+                            (quantile, sketch.quantile(quantile), exact))
+        self.assertEqual(0.0, sketch.quantile(0))
+        self.assertEqual(values[-1], sketch.max)
+        self.assertEqual(values[-1], sketch.quantile(1))
+
+    def test_bounded(self):
+        sketch = stats.QuantileSketch(max_buckets=32)
+        for exponent in range(-5, 60):
+            sketch.add(2.0 ** exponent)
+        self.assertTrue(len(sketch.buckets) <= 32)
+        self.assertEqual(65, sketch.count)
+        top = sketch.quantile(1)
+        self.assertEqual(2.0 ** 59, top)
+
+    def test_merge(self):
+        one, two, both = [ stats.QuantileSketch() for _ in range(3) ]
+        for value in range(1, 1000):
+            (one if value % 2 else two).add(value)
+            both.add(value)
+        one.merge(two)
+        self.assertEqual(both.count, one.count)
+        self.assertEqual(both.quantile(0.9), one.quantile(0.9))
+        self.assertRaises(ValueError, one.merge, stats.QuantileSketch(0.05))
+
+    def test_empty(self):
+        sketch = stats.QuantileSketch()
+        self.assertEqual(None, sketch.quantile(0.5))
+        self.assertRaises(ValueError, sketch.add, -1)
+
+
+class TestStreamingStats(unittest.TestCase):
+
+    def test_matches_batch(self):
+        log = make_log()
+        data = json.dumps({"log": log.to_dict()})
+        streaming = stats.StreamingStats(by="host")
+        streaming.update(har.iter_entries(StringIO(data)))
+        batch = stats.timing_stats(log, use_numpy=False)
+        result = streaming.result()
+        self.assertEqual(set(batch), set(result))
+        for host in batch:
+            for phase in stats.PHASES:
+                exact, approximate = batch[host][phase], result[host][phase]
+                self.assertEqual(exact["count"], approximate["count"])
+                self.assertEqual(exact["max"], approximate["max"])
+        self.assertTrue(abs(result["a.com"]["wait"]["p50"] - 50) <= 0.5)
+
+    def test_merge(self):
+        log = make_log()
+        one, two = stats.StreamingStats(), stats.StreamingStats()
+        one.update(log.entries[:7])
+        two.update(log.entries[7:])
+        one.merge(two)
+        self.assertEqual(10, one.result()["a.com"]["wait"]["count"])
+        self.assertEqual(4, one.result()["b.com"]["wait"]["count"])
+
+
+if __name__ == '__main__':
+    unittest.main()
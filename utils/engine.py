@@ -0,0 +1,559 @@
+#!/usr/bin/env python
+"""A request engine that needs nothing but the standard library.
+
+Engine sends Requests over keep-alive connections, pooled per (host,
+port, tls), from one thread using non-blocking sockets, and yields an
+Entry for each as its response arrives::
+
+    In [0]: engine = Engine(concurrency=100, per_host=6)
+
+    In [1]: for entry in engine.run(e.request for e in hc.log.entries):
+                print entry.response.status, entry.request.url
+
+Requests are taken from the iterable only as there is room for them,
+so it can be a generator of any length: at most `backlog` of them wait
+to be sent at a time. At most `concurrency` of them are in flight at
+once, and at most `per_host` connections are open to each (host, port,
+tls). Which waiting request is sent next is up to the `scheduler`, a
+Scheduler, which can pace each host and put some requests first (see
+utils.scheduler). A connection is used again for the next request to
+the same place unless either side asked for it to be closed.
+Responses are framed by their Content-Length or chunked
+transfer-encoding with HttpStream, and are devoured as they are read.
+
+Entries come out in the order their responses complete, each with the
+`_sequence` of its request, or the position of the request in the
+iterable if it has none. A request that fails (refused, reset, timed
+out) still gets an Entry, whose response has status 0 and an `_error`
+saying what went wrong, as browsers export them.
+
+Host names are resolved once per run, blocking, unless a request's
+`_serverIPAddress` says where to connect. Certificates are not checked
+unless an `ssl_context` that checks them is given. Pass a StringTable
+as `strings`, such as a Log's, for the responses to share their
+repeated strings through it.
+
+"""
+
+import errno
+import math
+import select
+import socket
+import ssl
+import time
+from collections import deque, OrderedDict
+from datetime import datetime
+from urlparse import urlparse
+
+try:
+    from ..har import (Cache, Entry, HttpStream, Response, Timings,
+                       _header_list, _localize_datetime)
+    from .scheduler import Scheduler
+except (ImportError, ValueError):
+    from har import (Cache, Entry, HttpStream, Response, Timings,
+                     _header_list, _localize_datetime)
+    from utils.scheduler import Scheduler
+
+__all__ = ["Engine"]
+
+RECV_SIZE = 65536
+# seconds to wait on the sockets before asking for requests again
+# after the iterable had none ready
+STARVED_WAIT = 0.01
+
+# what a connection is waiting to do
+CONNECTING, HANDSHAKE, SENDING, READING = range(4)
+
+_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN)
+
+
+def _ms(start, end):
+    """Return the milliseconds from `start` to `end`, or -1 if either
+    did not happen."""
+    if start is None or end is None:
+        return -1
+    return int(round((end - start) * 1000))
+
+
+def _pool_key(url):
+    """Return the (host, port, tls) of the pool for the parsed `url`,
+    with the scheme's port if it has none."""
+    tls = url.scheme == "https"
+    return (url.hostname, url.port or (443 if tls else 80), tls)
+
+
+def _keep_alive(message):
+    """Return True if the connection `message` was sent on may be used
+    again afterwards."""
+    tokens = [ token.strip().lower()
+               for value in _header_list(message).get_all("Connection")
+               for token in value.split(",") ]
+    if "close" in tokens:
+        return False
+    return message.httpVersion.upper() != "HTTP/1.0" or "keep-alive" in tokens
+
+
+class _Poller(object):
+    """select.poll, or select.select where there is no poll."""
+
+    def __init__(self):
+        self._poll = select.poll() if hasattr(select, "poll") else None
+        self._fds = {}
+
+    def set(self, fd, write):
+        """Wait for `fd` to be writable if `write` is set, or readable."""
+        known = fd in self._fds
+        self._fds[fd] = write
+        if self._poll is not None:
+            events = select.POLLOUT if write else select.POLLIN
+            if known:
+                self._poll.modify(fd, events)
+            else:
+                self._poll.register(fd, events)
+
+    def remove(self, fd):
+        if self._fds.pop(fd, None) is not None and self._poll is not None:
+            self._poll.unregister(fd)
+
+    def poll(self, timeout):
+        """Return the fds that are ready, waiting at most `timeout`
+        seconds."""
+        if self._poll is not None:
+            return [ fd for fd, event in
+                     self._poll.poll(int(math.ceil(timeout * 1000))) ]
+        if not self._fds:
+            time.sleep(timeout)
+            return []
+        read = [ fd for fd, write in self._fds.iteritems() if not write ]
+        write = [ fd for fd, write in self._fds.iteritems() if write ]
+        ready = select.select(read, write, read + write, timeout)
+        return list(set(ready[0] + ready[1] + ready[2]))
+
+
+class _Exchange(object):
+    """A request and what has happened to it so far."""
+
+    __slots__ = ("request", "key", "sequence", "raw", "tried", "dns",
+                 "queued", "started", "connected", "secured", "sending",
+                 "sent", "answered", "done", "address", "connection")
+
+    def __init__(self, request, key, sequence, raw):
+        self.request = request
+        self.key = key
+        self.sequence = sequence
+        self.raw = raw
+        self.tried = False
+        self.dns = self.connected = self.secured = None
+        self.sending = self.sent = self.answered = self.done = None
+        self.address = self.connection = None
+        self.queued = self.started = time.time()
+
+
+class _Connection(object):
+    """A socket to one (host, port, tls), and the exchange on it."""
+
+    __slots__ = ("key", "number", "sock", "address", "state", "exchange",
+                 "stream", "out", "used", "deadline")
+
+    def __init__(self, key, number, sock, address):
+        self.key = key
+        self.number = number
+        self.sock = sock
+        self.address = address
+        self.state = CONNECTING
+        self.exchange = None
+        self.stream = None
+        self.out = ""
+        self.used = 0
+        self.deadline = None
+
+
+class _Pool(object):
+    """The connections to one (host, port, tls)."""
+
+    __slots__ = ("key", "open", "idle")
+
+    def __init__(self, key):
+        self.key = key
+        self.open = 0
+        self.idle = deque()
+
+
+class Engine(object):
+    """Send Requests over pooled keep-alive connections and yield the
+    Entries of their responses. See the module documentation."""
+
+    def __init__(self, concurrency=64, per_host=6, timeout=30.0,
+                 ssl_context=None, strings=None, scheduler=None,
+                 backlog=None):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.backlog = concurrency if backlog is None else backlog
+        self.scheduler = Scheduler() if scheduler is None else scheduler
+        self.timeout = timeout
+        if ssl_context is None:
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+        self.ssl_context = ssl_context
+        self.strings = strings
+        self.connections = 0
+        self._reset()
+
+    def _reset(self):
+        self._poller = _Poller()
+        self._pools = {}
+        self._by_fd = {}
+        self._idle = OrderedDict()
+        self._addresses = {}
+        self._done = deque()
+        self._in_flight = 0
+        self.scheduler.clear()
+
+    def __repr__(self):
+        return "<Engine of {0} requests, {1} in flight>".format(
+            self.concurrency, self._in_flight)
+
+    @property
+    def in_flight(self):
+        """The number of requests taken whose entries have not yet been
+        yielded."""
+        return self._in_flight + len(self._done)
+
+    def run(self, requests):
+        """Return a generator of the Entries of `requests`, in the order
+        their responses complete.
+
+        `requests` may yield None to say that no more are ready yet,
+        and is asked again after at most STARVED_WAIT seconds.
+
+        """
+        self._reset()
+        requests = iter(requests)
+        count = 0
+        more = True
+        try:
+            while True:
+                starved = False
+                while more and len(self.scheduler) < self.backlog:
+                    try:
+                        request = next(requests)
+                    except StopIteration:
+                        more = False
+                        break
+                    if request is None:
+                        starved = True
+                        break
+                    self._submit(request, count)
+                    count += 1
+                self._dispatch()
+                while self._done:
+                    yield self._done.popleft()
+                if not self._in_flight:
+                    if not more:
+                        return
+                    if starved:
+                        time.sleep(STARVED_WAIT)
+                    continue
+                wait = self.scheduler.wait(time.time())
+                if starved:
+                    wait = min(wait, STARVED_WAIT) if wait else STARVED_WAIT
+                self._step(wait)
+        finally:
+            for conn in self._by_fd.values():
+                self._close(conn)
+
+    def _submit(self, request, count):
+        url = urlparse(request.url)
+        key = _pool_key(url)
+        raw = request.puke()
+        if type(raw) is unicode:
+            raw = raw.encode("utf-8")
+        exchange = _Exchange(request, key,
+                             getattr(request, "_sequence", count), raw)
+        self._in_flight += 1
+        if not url.hostname:
+            self._fail(exchange, "No host to send the request to")
+            return
+        self.scheduler.push(key, request, exchange)
+
+    def _has_room(self, key):
+        """Return True if a request to pool `key` could be sent now."""
+        pool = self._pools.get(key)
+        return pool is None or bool(pool.idle) or pool.open < self.per_host
+
+    def _dispatch(self):
+        """Start the exchanges the scheduler picks for as long as fewer
+        than `concurrency` are on connections."""
+        scheduler = self.scheduler
+        now = time.time()
+        while (scheduler and
+               self._in_flight - len(scheduler) < self.concurrency):
+            exchange = scheduler.pop(now, self._has_room)
+            if exchange is None:
+                return
+            pool = self._pools.get(exchange.key)
+            if pool is None:
+                pool = self._pools[exchange.key] = _Pool(exchange.key)
+            if pool.idle:
+                conn = pool.idle.popleft()
+                del self._idle[conn.sock.fileno()]
+                self._start(conn, exchange)
+                continue
+            conn = self._connect(pool, exchange)
+            if conn is not None:
+                exchange.started = time.time()
+                conn.exchange = exchange
+
+    def _address(self, exchange):
+        request = exchange.request
+        host, port, tls = exchange.key
+        if "_serverIPAddress" in request:
+            return (request._serverIPAddress, port)
+        found = self._addresses.get((host, port))
+        if found is None:
+            start = time.time()
+            info = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+            exchange.dns = _ms(start, time.time())
+            found = self._addresses[(host, port)] = info[0][4]
+        return found
+
+    def _connect(self, pool, exchange):
+        """Open a new connection for `exchange`, or fail it."""
+        try:
+            address = self._address(exchange)
+            family = socket.AF_INET6 if ":" in address[0] else socket.AF_INET
+            sock = socket.socket(family, socket.SOCK_STREAM)
+        except (socket.error, socket.gaierror), err:
+            self._fail(exchange, "Could not resolve {0}: {1}".format(
+                exchange.key[0], err))
+            return None
+        if len(self._by_fd) + 1 > self.concurrency and self._idle:
+            # make room by closing the connection idle the longest
+            self._close(self._idle.popitem(last=False)[1])
+        sock.setblocking(0)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connections += 1
+        conn = _Connection(pool.key, self.connections, sock, address[0])
+        pool.open += 1
+        self._by_fd[sock.fileno()] = conn
+        conn.deadline = time.time() + self.timeout
+        result = sock.connect_ex(address)
+        if result and result not in _IN_PROGRESS:
+            self._close(conn)
+            exchange.done = time.time()
+            self._fail(exchange, "Could not connect to {0}: {1}".format(
+                address[0], errno.errorcode.get(result, result)))
+            return None
+        self._poller.set(sock.fileno(), True)
+        return conn
+
+    def _start(self, conn, exchange):
+        """Send `exchange` on the open connection `conn`."""
+        exchange.started = time.time()
+        conn.exchange = exchange
+        self._send(conn)
+
+    def _send(self, conn):
+        exchange = conn.exchange
+        exchange.address = conn.address
+        exchange.connection = conn.number
+        exchange.sending = time.time()
+        conn.out = exchange.raw
+        conn.stream = HttpStream(Response,
+                                 "https" if conn.key[2] else "http",
+                                 strings=self.strings)
+        conn.stream.expect(exchange.request.method)
+        conn.state = SENDING
+        conn.deadline = time.time() + self.timeout
+        self._poller.set(conn.sock.fileno(), True)
+
+    def _step(self, wait=None):
+        """Wait for the sockets, at most `wait` seconds if it is given,
+        and move on every connection that is ready or has timed out."""
+        now = time.time()
+        deadline = min([ c.deadline for c in self._by_fd.itervalues()
+                         if c.exchange is not None ] or [now + self.timeout])
+        timeout = max(deadline - now, 0)
+        if wait is not None:
+            timeout = min(timeout, wait)
+        for fd in self._poller.poll(timeout):
+            conn = self._by_fd.get(fd)
+            if conn is None:
+                continue
+            if conn.exchange is None:
+                # an idle connection closed by the other end
+                self._close(conn)
+                continue
+            try:
+                self._ready(conn)
+            except (socket.error, ssl.SSLError, ValueError), err:
+                self._drop(conn, str(err) or err.__class__.__name__)
+        now = time.time()
+        for conn in self._by_fd.values():
+            if conn.exchange is not None and conn.deadline <= now:
+                self._drop(conn, "Timed out after {0}s".format(self.timeout),
+                           retry=False)
+
+    def _ready(self, conn):
+        exchange = conn.exchange
+        conn.deadline = time.time() + self.timeout
+        if conn.state == CONNECTING:
+            error = conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                raise socket.error(error, errno.errorcode.get(error, error))
+            exchange.connected = time.time()
+            if not conn.key[2]:
+                self._send(conn)
+                return
+            conn.sock = self.ssl_context.wrap_socket(
+                conn.sock, server_hostname=conn.key[0],
+                do_handshake_on_connect=False)
+            conn.state = HANDSHAKE
+        if conn.state == HANDSHAKE:
+            try:
+                conn.sock.do_handshake()
+            except ssl.SSLWantReadError:
+                self._poller.set(conn.sock.fileno(), False)
+                return
+            except ssl.SSLWantWriteError:
+                self._poller.set(conn.sock.fileno(), True)
+                return
+            exchange.secured = time.time()
+            self._send(conn)
+            return
+        if conn.state == SENDING:
+            try:
+                sent = conn.sock.send(conn.out)
+            except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                return
+            except socket.error, err:
+                if err.errno in _IN_PROGRESS:
+                    return
+                raise
+            conn.out = conn.out[sent:]
+            if conn.out:
+                return
+            exchange.sent = time.time()
+            conn.state = READING
+            self._poller.set(conn.sock.fileno(), False)
+            return
+        self._read(conn)
+
+    def _read(self, conn):
+        exchange = conn.exchange
+        messages = []
+        while True:
+            try:
+                data = conn.sock.recv(RECV_SIZE)
+            except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                break
+            except socket.error, err:
+                if err.errno in _IN_PROGRESS:
+                    break
+                raise
+            if not data:
+                # closed, which ends a response with no length
+                messages.extend(conn.stream.close())
+                if not messages:
+                    raise socket.error(errno.ECONNRESET,
+                                       "Connection closed without a response")
+                conn.used = -1
+                break
+            if exchange.answered is None:
+                exchange.answered = time.time()
+            messages.extend(conn.stream.feed(data))
+            # what TLS has already decrypted will not wake the poller
+            pending = getattr(conn.sock, "pending", None)
+            if messages or pending is None or not pending():
+                break
+        for response in messages:
+            if 100 <= response.status < 200 and response.status != 101:
+                continue #interim, the response proper is still to come
+            self._complete(conn, response)
+            return
+
+    def _complete(self, conn, response):
+        exchange = conn.exchange
+        exchange.done = time.time()
+        conn.exchange = None
+        conn.used = (conn.used + 1 if conn.used >= 0 and
+                     _keep_alive(exchange.request) and _keep_alive(response)
+                     else -1)
+        self._finish(exchange, response)
+        if conn.used < 0 or conn.stream.buffered:
+            self._close(conn)
+            return
+        conn.state = READING
+        conn.stream = None
+        self._pools[conn.key].idle.append(conn)
+        self._idle[conn.sock.fileno()] = conn
+        self._poller.set(conn.sock.fileno(), False)
+
+    def _drop(self, conn, error, retry=True):
+        """Close `conn` after its exchange failed with `error`, and
+        send the exchange again on a new connection if it failed on
+        one that had been used before and had not been answered."""
+        exchange = conn.exchange
+        conn.exchange = None
+        reused = conn.used > 0
+        self._close(conn)
+        if (retry and reused and not exchange.tried and
+            exchange.answered is None):
+            # the other end closed it while it was idle
+            exchange.tried = True
+            exchange.connected = exchange.sending = exchange.sent = None
+            self.scheduler.push(exchange.key, exchange.request, exchange,
+                                first=True)
+        else:
+            exchange.done = time.time()
+            self._fail(exchange, error)
+
+    def _close(self, conn):
+        fd = conn.sock.fileno()
+        if self._by_fd.pop(fd, None) is None:
+            return
+        self._poller.remove(fd)
+        if self._idle.pop(fd, None) is not None:
+            self._pools[conn.key].idle.remove(conn)
+        self._pools[conn.key].open -= 1
+        conn.sock.close()
+
+    def _fail(self, exchange, error):
+        response = Response({"status": 0, "statusText": "",
+                             "httpVersion": "", "cookies": [],
+                             "headers": [],
+                             "content": {"size": 0,
+                                         "mimeType": "x-unknown"},
+                             "redirectURL": "", "headersSize": -1,
+                             "bodySize": -1})
+        response._error = error
+        self._finish(exchange, response)
+
+    def _finish(self, exchange, response):
+        """Make the Entry of the finished `exchange`."""
+        self._in_flight -= 1
+        done = exchange.done or time.time()
+        entry = Entry(empty=True)
+        entry.startedDateTime = _localize_datetime(
+            datetime.fromtimestamp(exchange.started))
+        entry.time = _ms(exchange.queued, done)
+        entry.request = exchange.request
+        entry.response = response
+        entry.cache = Cache(empty=True)
+        timings = entry.timings = Timings(empty=True)
+        timings.blocked = _ms(exchange.queued, exchange.started)
+        timings.dns = exchange.dns if exchange.dns is not None else -1
+        if exchange.connected is not None:
+            timings.connect = _ms(exchange.started, exchange.connected)
+        else:
+            timings.connect = -1
+        timings.ssl = _ms(exchange.connected, exchange.secured)
+        timings.send = max(_ms(exchange.sending, exchange.sent), 0)
+        timings.wait = max(_ms(exchange.sent, exchange.answered), 0)
+        timings.receive = max(_ms(exchange.answered, exchange.done), 0)
+        if exchange.address:
+            entry.serverIPAddress = exchange.address
+            entry.connection = str(exchange.connection)
+        entry._sequence = exchange.sequence
+        self._done.append(entry)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""Sidecar indexes for answering questions about many HARs quickly.
+
+Each HAR gets an index file next to it (the HAR's name plus '.idx')
+holding one row per entry with the fields most questions are about:
+url, host, method, status, mimeType, sizes, startedDateTime and where
+the entry is in the file. It is built the first time the HAR is
+indexed and reused until the HAR changes.
+
+Queries are answered from the rows alone, and only the entries that
+match are ever constructed::
+
+    In [0]: corpus = HarCorpus(glob('./captures/*.har'))
+
+    In [1]: [ e.request.url for path, e in corpus.entries(
+                  host='www.google.com', status=200) ]
+
+A filter is a value the field must equal, a set, list or tuple of
+values it must be one of, or a function of the value that returns
+True for rows to keep. mimeType is matched without its parameters,
+so 'text/html' matches 'text/html; charset=UTF-8'.
+
+"""
+
+import json
+import mmap
+import os
+from collections import namedtuple
+from urlparse import urlparse
+
+try:
+    from ..har import (Entry, MissingValueException, _JsonScanner,
+                       _json_backend)
+except (ImportError, ValueError):
+    from har import (Entry, MissingValueException, _JsonScanner,
+                     _json_backend)
+
+__all__ = ["HarIndex", "HarCorpus", "IndexRow"]
+
+INDEX_VERSION = 1
+
+COLUMNS = ("index", "url", "host", "method", "status", "mimeType",
+           "requestBodySize", "responseBodySize", "contentSize",
+           "startedDateTime", "start", "end")
+
+IndexRow = namedtuple("IndexRow", COLUMNS)
+
+
+def _row(index, entry, span):
+    """Return the index row for the entry dict `entry`."""
+    request = entry.get("request") or {}
+    response = entry.get("response") or {}
+    content = response.get("content") or {}
+    url = request.get("url")
+    mime_type = content.get("mimeType")
+    if mime_type is not None:
+        mime_type = mime_type.split(";", 1)[0].strip().lower()
+    return IndexRow(index, url, urlparse(url).hostname if url else None,
+                    request.get("method"), response.get("status"),
+                    mime_type, request.get("bodySize"),
+                    response.get("bodySize"), content.get("size"),
+                    entry.get("startedDateTime"), span[0], span[1])
+
+
+def _spans(data):
+    """Yield the (start, end) offsets of each entry in the HAR `data`,
+    without decoding them."""
+    scanner = _JsonScanner(data)
+    for key in scanner.iter_keys():
+        if key == "log":
+            break
+        scanner.skip_value()
+    else:
+        raise MissingValueException("log", "HarContainer")
+    for key in scanner.iter_keys():
+        if key == "entries":
+            for _ in scanner.iter_items():
+                yield scanner.skip_value()
+            return
+        scanner.skip_value()
+    raise MissingValueException("entries", "Log")
+
+
+def _matcher(name, wanted):
+    """Return a function of a row that is True if field `name` passes
+    the filter `wanted`."""
+    position = COLUMNS.index(name)
+    if callable(wanted):
+        return lambda row: wanted(row[position])
+    # both are lowercased in the rows
+    folded = name in ("host", "mimeType")
+    if isinstance(wanted, (set, frozenset, list, tuple)):
+        if folded:
+            wanted = [ value.lower() if isinstance(value, basestring)
+                       else value for value in wanted ]
+        wanted = frozenset(wanted)
+        return lambda row: row[position] in wanted
+    if folded and isinstance(wanted, basestring):
+        wanted = wanted.lower()
+    return lambda row: row[position] == wanted
+
+
+class HarIndex(object):
+    """The sidecar index of one HAR.
+
+    The index is read from `index_path` (the HAR's name plus '.idx'
+    by default) if it was built for the HAR as it is now, and built and
+    saved otherwise, or always if `rebuild` is set.
+
+    """
+
+    def __init__(self, path, index_path=None, rebuild=False, backend=None):
+        self.path = path
+        self.index_path = index_path or path + ".idx"
+        self._loads = _json_backend(backend)[0]
+        stat = os.stat(path)
+        self._stamp = [stat.st_size, int(stat.st_mtime * 1000000)]
+        self.rows = None if rebuild else self._load()
+        if self.rows is None:
+            self.rows = self._build()
+            self._save()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'rb') as fd:
+                saved = json.load(fd)
+        except (IOError, ValueError):
+            return None
+        if (saved.get("version") != INDEX_VERSION or
+            saved.get("stamp") != self._stamp or
+            saved.get("columns") != list(COLUMNS)):
+            return None
+        return [ IndexRow(*row) for row in saved["rows"] ]
+
+    def _build(self):
+        loads = self._loads
+        with open(self.path, 'rb') as fd:
+            data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return [ _row(index, loads(data[span[0]:span[1]]), span)
+                         for index, span in enumerate(_spans(data)) ]
+            finally:
+                data.close()
+
+    def _save(self):
+        try:
+            with open(self.index_path, 'wb') as fd:
+                json.dump({"version": INDEX_VERSION, "stamp": self._stamp,
+                           "columns": COLUMNS, "rows": self.rows}, fd)
+        except (IOError, OSError): #a read only directory, say
+            pass
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __repr__(self):
+        return "<HarIndex of {0} entries in {1!r}>".format(len(self),
+                                                           self.path)
+
+    def find(self, **filters):
+        """Return the rows that pass every filter, in file order."""
+        matchers = [ _matcher(name, wanted)
+                     for name, wanted in filters.iteritems() ]
+        return [ row for row in self.rows
+                 if all(match(row) for match in matchers) ]
+
+    def entries(self, lazy=False, trusted=False, **filters):
+        """Yield the Entry of each row that passes every filter. Only
+        these entries are read from the HAR."""
+        rows = self.find(**filters)
+        if not rows:
+            return
+        with open(self.path, 'rb') as fd:
+            data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for row in rows:
+                    yield Entry(self._loads(data[row.start:row.end]),
+                                lazy=lazy, trusted=trusted)
+            finally:
+                data.close()
+
+
+class HarCorpus(object):
+    """The indexes of many HARs, queried together. Each HAR is indexed
+    the first time it is queried."""
+
+    def __init__(self, paths, rebuild=False, backend=None):
+        self.paths = list(paths)
+        self.rebuild = rebuild
+        self.backend = backend
+        self._indexes = {}
+
+    def index(self, path):
+        """Return the HarIndex of `path`."""
+        if path not in self._indexes:
+            self._indexes[path] = HarIndex(path, rebuild=self.rebuild,
+                                           backend=self.backend)
+        return self._indexes[path]
+
+    def __len__(self):
+        return sum(len(self.index(path)) for path in self.paths)
+
+    def __repr__(self):
+        return "<HarCorpus of {0} HARs>".format(len(self.paths))
+
+    def find(self, **filters):
+        """Yield (path, row) for each row of each HAR that passes every
+        filter."""
+        for path in self.paths:
+            for row in self.index(path).find(**filters):
+                yield path, row
+
+    def entries(self, lazy=False, trusted=False, **filters):
+        """Yield (path, entry) for each entry of each HAR that passes
+        every filter."""
+        for path in self.paths:
+            for entry in self.index(path).entries(lazy, trusted, **filters):
+                yield path, entry
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""Replay a stream of Requests with an Engine in each of several worker
+processes, for more throughput than one process can give.
+
+Requests are sharded across the workers by (host, port, scheme), so
+each host's keep-alive connections stay in one worker, and the Entries
+the workers make are merged back in to the order the requests were
+given in::
+
+    In [0]: requests = (e.request for e in HarStream('./big.har'))
+
+    In [1]: with HarWriter('./replayed.har') as hw:
+                for entry in replay(requests, workers=8, per_host=6):
+                    hw.write(entry)
+
+Each entry keeps the `_sequence` of its request. A request without one
+is given its position in the stream, so the entries can always be put
+back in order later. Keyword arguments other than those of replay are
+passed to the Engine of every worker.
+
+At most `window` requests are sent out ahead of the oldest one not yet
+answered, which bounds how many finished entries wait in memory for a
+slow host to catch up. Requests and entries cross between processes as
+plain dicts, in batches of up to `batch`.
+
+"""
+
+import multiprocessing
+import zlib
+from heapq import heappush, heappop
+from Queue import Empty
+from traceback import format_exc
+from urlparse import urlparse
+
+try:
+    from ..har import Entry, Request
+    from .engine import Engine, _pool_key
+except (ImportError, ValueError):
+    from har import Entry, Request
+    from utils.engine import Engine, _pool_key
+
+__all__ = ["replay"]
+
+
+def _shard(request, workers):
+    """Return the worker that requests to the host of `request` go to,
+    the same for every request an Engine would pool together."""
+    key = _pool_key(urlparse(request.url))
+    return zlib.crc32(u"{0}:{1}:{2}".format(*key).encode("utf-8")) % workers
+
+
+def _worker(inbox, outbox, options, batch):
+    """Replay the (position, request dict) batches put in `inbox` until
+    a None is, putting batches of (position, entry dict) in `outbox`."""
+    try:
+        engine = Engine(**options)
+        positions = {}
+        results = []
+
+        def flush():
+            if results:
+                outbox.put(results[:])
+                del results[:]
+
+        def requests():
+            while True:
+                try:
+                    items = inbox.get_nowait()
+                except Empty:
+                    flush()
+                    if engine.in_flight:
+                        yield None
+                        continue
+                    items = inbox.get()
+                if items is None:
+                    return
+                for position, fields in items:
+                    request = Request(fields, trusted=True)
+                    positions[id(request)] = position
+                    yield request
+
+        for entry in engine.run(requests()):
+            results.append((positions.pop(id(entry.request)),
+                            entry.to_dict()))
+            if len(results) >= batch:
+                flush()
+        flush()
+    except Exception:
+        outbox.put(format_exc())
+
+
+def replay(requests, workers=None, window=4096, batch=64, **options):
+    """Return a generator of the Entries of `requests`, replayed by
+    `workers` processes, one per CPU by default, in the order of the
+    requests. See the module documentation."""
+    workers = workers or multiprocessing.cpu_count()
+    outbox = multiprocessing.Queue()
+    inboxes = [ multiprocessing.Queue() for i in range(workers) ]
+    processes = [ multiprocessing.Process(target=_worker,
+                                          args=(inbox, outbox, options, batch))
+                  for inbox in inboxes ]
+    for process in processes:
+        process.daemon = True
+        process.start()
+    requests = iter(requests)
+    batches = [ [] for i in range(workers) ]
+    finished = []
+    sent = done = 0
+    more = True
+    try:
+        while more or done < sent:
+            while more and sent - done < window:
+                try:
+                    request = next(requests)
+                except StopIteration:
+                    more = False
+                    for inbox, items in zip(inboxes, batches):
+                        if items:
+                            inbox.put(items)
+                        inbox.put(None)
+                    break
+                fields = request.to_dict()
+                fields.setdefault("_sequence", sent)
+                shard = _shard(request, workers)
+                batches[shard].append((sent, fields))
+                sent += 1
+                if len(batches[shard]) >= batch:
+                    inboxes[shard].put(batches[shard])
+                    batches[shard] = []
+            if done == sent:
+                continue
+            if more:
+                # everything sent so far has to be out before waiting
+                for i, items in enumerate(batches):
+                    if items:
+                        inboxes[i].put(items)
+                        batches[i] = []
+            results = outbox.get()
+            if not isinstance(results, list):
+                raise RuntimeError("Replay worker failed:\n" + results)
+            for position, fields in results:
+                heappush(finished, (position, fields))
+            while finished and finished[0][0] == done:
+                yield Entry(heappop(finished)[1], trusted=True)
+                done += 1
+    finally:
+        for process in processes:
+            if process.is_alive() and (more or done < sent):
+                process.terminate()
+            process.join()
@@ -14,17 +14,17 @@
 try:
 	from blackmamba import *
 except ImportError:
-	print ("Request engine is based on blackmamba. "
-	       "git clone http://github.com/rootfoo/blackmamba "
-	       "and follow installation instructions for this "
-	       "functionality to work")
-	raise
+	# without blackmamba (git clone http://github.com/rootfoo/blackmamba)
+	# write_entries and response_generator use the built-in Engine
+	run = None
 try:
-	from .har import Request, Response, Timings, Entry
+	from .har import Request, Response, Timings, Entry, Cache, HarWriter
 	from .utils import mario
+	from .utils.engine import Engine
 except ImportError:
-	from harpy.har import Request, Response, Timings, Entry
+	from harpy.har import Request, Response, Timings, Entry, Cache, HarWriter
 	from harpy.utils import mario
+	from harpy.utils.engine import Engine
 import sys
 from urlparse import urlparse
 from datetime import datetime
@@ -64,7 +64,7 @@ def process(request, outlist=None):
 			_serverIPAddress = yield resolve(host)
 
 		# connect
-		start = datetime.now()
+		start = started = datetime.now()
 		yield connect(host, port)
 		_timings.connect = get_time_delta(start)
 		
@@ -95,6 +95,16 @@ def process(request, outlist=None):
 			
 			#entry = E
 			outlist.append(response)
+		elif isinstance(outlist, HarWriter):
+			# written out as soon as it is done, nothing is kept
+			entry = Entry(empty=True)
+			entry.startedDateTime = started
+			entry.time = get_time_delta(started)
+			entry.request = request
+			entry.response = response
+			entry.cache = Cache(empty=True)
+			entry.timings = _timings
+			outlist.write(entry)
 		else:
 			response._timings = _timings
 			
@@ -121,7 +131,21 @@ def make_requests(g):
 	return (process(request) for request in g)
 
 
+def write_entries(g, writer):
+	"""Make the requests in `g`, writing an Entry for each one to
+	the HarWriter `writer` as its response arrives."""
+	if run is None:
+		for entry in Engine().run(g):
+			writer.write(entry)
+		return
+	run(process(request, writer) for request in g)
+
+
 def response_generator(g):
+	if run is None:
+		for entry in Engine().run(g):
+			yield entry.response
+		return
 	outlist = []
 	run(process(request, outlist) for request in g)
 	for response in outlist:
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""Pacing and ordering for the requests an Engine sends.
+
+A Scheduler holds the requests an Engine has taken but not yet sent,
+and picks which one goes next whenever there is room for another::
+
+    In [0]: scheduler = Scheduler(rate=10, burst=5,
+                                  rates={'fragile.example.com': (1, 1)})
+
+    In [1]: engine = Engine(concurrency=200, scheduler=scheduler)
+
+Requests are sent in order of their priority, lowest first. By
+default that is a request's `_priority`, or 0 if it has none, so
+re-tests given a `_priority` of -1 go ahead of new fuzz cases; pass
+`priority`, a function of the request, to work it out otherwise.
+Within a priority the hosts take turns, one request each, so a host
+with thousands of requests waiting does not starve one with a few.
+
+Each host has a token bucket that fills at `rate` requests a second
+up to `burst`, and a request is only sent when its host has a token to
+spend. `rates` maps host names to their own (rate, burst). With no
+rate, hosts are only limited by the connections the Engine may open
+to them. A host that cannot send now (no token, or no connection to
+spare) is passed over for the next one that can, even at a lower
+priority, and keeps its turn for when it can.
+
+How many requests may be in flight at once across every host is the
+Engine's `concurrency`, and how many it takes ahead to choose from is
+its `backlog`.
+
+"""
+
+from bisect import insort
+from collections import deque, OrderedDict
+
+__all__ = ["Scheduler"]
+
+
+def _priority(request):
+    return getattr(request, "_priority", 0)
+
+
+class Scheduler(object):
+    """Queues of waiting requests, by priority and host, with a token
+    bucket per host. See the module documentation."""
+
+    def __init__(self, rate=None, burst=1, rates=None, priority=None):
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates or {}
+        self.priority = priority or _priority
+        # priority -> {key: deque of items}, in turn order
+        self._levels = {}
+        self._priorities = []
+        # host -> [tokens, when they were counted]
+        self._buckets = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __repr__(self):
+        return "<Scheduler of {0} requests to {1} hosts>".format(
+            self._count, len(set(key for hosts in self._levels.itervalues()
+                                 for key in hosts)))
+
+    def push(self, key, request, item, first=False):
+        """Queue `item`, sending `request` to the host of pool `key`,
+        a (host, port, tls). With `first` set it goes ahead of the
+        others waiting for that host, as a retry should."""
+        priority = self.priority(request)
+        hosts = self._levels.get(priority)
+        if hosts is None:
+            hosts = self._levels[priority] = OrderedDict()
+            insort(self._priorities, priority)
+        queue = hosts.get(key)
+        if queue is None:
+            queue = hosts[key] = deque()
+        if first:
+            queue.appendleft(item)
+        else:
+            queue.append(item)
+        self._count += 1
+
+    def pop(self, now, has_room):
+        """Return the item to send next at time `now`, or None if no
+        host with requests waiting has both a token and room, as the
+        function `has_room` of a key says."""
+        for priority in self._priorities:
+            hosts = self._levels[priority]
+            for key in hosts.keys():
+                if not has_room(key) or not self._take(key[0], now):
+                    continue
+                queue = hosts.pop(key)
+                item = queue.popleft()
+                if queue:
+                    # to the back, so the other hosts go first
+                    hosts[key] = queue
+                elif not hosts:
+                    del self._levels[priority]
+                    self._priorities.remove(priority)
+                self._count -= 1
+                return item
+        return None
+
+    def wait(self, now):
+        """Return the seconds until a host waiting only for a token
+        gets one, or None if none is."""
+        soonest = None
+        for hosts in self._levels.itervalues():
+            for key in hosts:
+                rate, burst = self._limit(key[0])
+                if rate is None:
+                    continue
+                tokens = self._tokens(key[0], now, rate, burst)
+                if tokens < 1:
+                    wait = (1 - tokens) / float(rate)
+                    if soonest is None or wait < soonest:
+                        soonest = wait
+        return soonest
+
+    def clear(self):
+        """Drop every waiting item. The token buckets are kept."""
+        self._levels.clear()
+        del self._priorities[:]
+        self._count = 0
+
+    def _limit(self, host):
+        return self.rates.get(host, (self.rate, self.burst))
+
+    def _tokens(self, host, now, rate, burst):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = [burst, now]
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        return bucket[0]
+
+    def _take(self, host, now):
+        """Spend a token of `host`, if it has one."""
+        rate, burst = self._limit(host)
+        if rate is None:
+            return True
+        if self._tokens(host, now, rate, burst) < 1:
+            return False
+        self._buckets[host][0] -= 1
+        return True
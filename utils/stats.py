@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+"""Latency statistics for the entries and pages of a HAR.
+
+timing_stats gives the quantiles and maximum of each timing phase of
+the entries of a Log, grouped by host, URL pattern, status class or
+pageref::
+
+    In [0]: timing_stats(hc.log, by='host')['www.google.com']['wait']
+    Out[0]: {'count': 38, 'p50': 41.0, 'p90': 97.3, 'p99': 180.2,
+             'max': 201.0}
+
+It works on the arrays made by Log.to_columns, and with numpy
+installed every group is summarized with array operations rather than
+entry by entry. page_stats does the same for the PageTimings of the
+pages.
+
+For corpora too big to load, StreamingStats takes entries one at a
+time (from iter_entries, say) and keeps a QuantileSketch per group and
+phase instead of the values, so its memory use does not grow with the
+number of entries::
+
+    In [1]: stats = StreamingStats(by='status')
+
+    In [2]: for path in paths:
+       ...:     stats.update(iter_entries(path, lazy=True))
+
+    In [3]: stats.result()['5xx']['time']['p99']
+
+Timings of -1 mean the phase does not apply and are left out, as are
+missing ones.
+
+"""
+
+import math
+import re
+from bisect import bisect_right
+
+try:
+    import numpy
+except ImportError: #the statistics are worked out in plain Python
+    numpy = None
+
+__all__ = ["PHASES", "QUANTILES", "group_key", "timing_stats", "page_stats",
+           "QuantileSketch", "StreamingStats"]
+
+# the columns of Log.to_columns that are timings
+PHASES = ("time", "blocked", "dns", "connect", "send", "wait", "receive",
+          "ssl")
+
+PAGE_TIMINGS = ("onContentLoad", "onLoad")
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+# path segments that are replaced in URL patterns
+_PATTERN_SEGMENTS = ((re.compile(r'^\d+$'), '{n}'),
+                     (re.compile(r'^[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?'
+                                 r'[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?'
+                                 r'[0-9a-fA-F]{12}$'), '{uuid}'),
+                     (re.compile(r'^(?=.*\d)[0-9a-fA-F]{16,}$'), '{hex}'))
+
+
+def _url_pattern(url):
+    """Return the host and path of `url` with the segments that look
+    like ids replaced, so that /user/12/ and /user/13/ group together."""
+    match = re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*://([^/?#]*)([^?#]*)', url)
+    if not match:
+        return url
+    host, path = match.groups()
+    segments = path.split('/')
+    for position, segment in enumerate(segments):
+        for regex, placeholder in _PATTERN_SEGMENTS:
+            if regex.match(segment):
+                segments[position] = placeholder
+                break
+    return host.lower() + '/'.join(segments)
+
+
+def _host(entry):
+    url = entry.request.url
+    match = re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*://(?:[^@/?#]*@)?'
+                     r'(\[[^\]]*\]|[^:/?#]*)', url)
+    return match.group(1).lower() if match else None
+
+
+def _status_class(entry):
+    status = entry.response.status
+    return "{0}xx".format(status // 100) if status > 0 else None
+
+
+# name -> function of an entry giving its group
+_GROUPS = {"host": _host,
+           "pattern": lambda entry: _url_pattern(entry.request.url),
+           "status": _status_class,
+           "pageref": lambda entry: getattr(entry, "pageref", None),
+           None: lambda entry: None}
+
+
+def group_key(by):
+    """Return the function giving the group of an entry for `by`, one of
+    'host', 'pattern', 'status', 'pageref' or None (one group), or a
+    function of an entry."""
+    if callable(by):
+        function = by
+    else:
+        try:
+            function = _GROUPS[by]
+        except KeyError:
+            raise ValueError("Unknown grouping {0!r}, use one of: {1}".format(
+                by, ", ".join(repr(name) for name in sorted(_GROUPS))))
+
+    def key(entry):
+        try:
+            return function(entry)
+        except (AttributeError, TypeError):
+            return None
+    return key
+
+
+def _quantile_name(quantile):
+    return "p{0:g}".format(quantile * 100)
+
+
+def _summary(values, quantiles):
+    """Summarize the sorted list `values` using linear interpolation
+    between ranks, as numpy.percentile does."""
+    summary = {"count": len(values)}
+    for quantile in quantiles:
+        if not values:
+            summary[_quantile_name(quantile)] = None
+            continue
+        rank = quantile * (len(values) - 1)
+        low = int(math.floor(rank))
+        high = min(low + 1, len(values) - 1)
+        summary[_quantile_name(quantile)] = (
+            values[low] + (values[high] - values[low]) * (rank - low))
+    summary["max"] = values[-1] if values else None
+    return summary
+
+
+def _numpy_summary(values, quantiles):
+    """Summarize the numpy array `values`, which holds no NaNs."""
+    summary = {"count": int(values.size)}
+    if not values.size:
+        summary.update((_quantile_name(q), None) for q in quantiles)
+        summary["max"] = None
+        return summary
+    points = numpy.percentile(values, [ q * 100 for q in quantiles ])
+    for quantile, point in zip(quantiles, points):
+        summary[_quantile_name(quantile)] = float(point)
+    summary["max"] = float(values.max())
+    return summary
+
+
+def _grouped_stats(keys, columns, names, quantiles, use_numpy):
+    """Return {group: {name: summary}} for the parallel sequences
+    `keys` and columns[name]."""
+    if use_numpy:
+        groups, inverse = numpy.unique(numpy.array(keys, dtype=object),
+                                       return_inverse=True)
+        order = numpy.argsort(inverse, kind='mergesort')
+        bounds = numpy.searchsorted(inverse[order],
+                                    numpy.arange(len(groups) + 1))
+        valid = {}
+        for name in names:
+            column = numpy.asarray(columns[name], dtype=numpy.float64)[order]
+            valid[name] = (column, ~(column < 0) & ~numpy.isnan(column))
+        result = {}
+        for position, group in enumerate(groups):
+            start, end = bounds[position], bounds[position + 1]
+            result[group] = dict(
+                (name, _numpy_summary(
+                    column[start:end][usable[start:end]], quantiles))
+                for name, (column, usable) in valid.iteritems())
+        return result
+    rows = {}
+    for position, key in enumerate(keys):
+        rows.setdefault(key, []).append(position)
+    result = {}
+    for group, positions in rows.iteritems():
+        result[group] = {}
+        for name in names:
+            column = columns[name]
+            values = sorted(column[p] for p in positions
+                            if column[p] >= 0) #NaN compares False
+            result[group][name] = _summary(values, quantiles)
+    return result
+
+
+def timing_stats(log, by="host", phases=PHASES, quantiles=QUANTILES,
+                 use_numpy=None):
+    """timing_stats(log, by='host') -> {group: {phase: summary}}
+
+    Summarize each timing phase of the entries of `log` for each group
+    of entries given by `by` (see group_key). A summary is a dict of
+    the count of values, 'p50', 'p90', 'p99' (one for each of
+    `quantiles`) and 'max'; the quantiles and max are None for a group
+    with no values.
+
+    """
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    columns = log.to_columns(use_numpy=use_numpy)
+    key = group_key(by)
+    keys = [ key(entry) for entry in log.entries ]
+    return _grouped_stats(keys, columns, phases, quantiles, use_numpy)
+
+
+def page_stats(log, quantiles=QUANTILES, use_numpy=None):
+    """page_stats(log) -> {timing: summary}
+
+    Summarize onContentLoad and onLoad over the pages of `log`, in the
+    same form as timing_stats.
+
+    """
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    columns = dict((name, []) for name in PAGE_TIMINGS)
+    for page in getattr(log, "pages", None) or []:
+        timings = getattr(page, "pageTimings", None)
+        for name in PAGE_TIMINGS:
+            value = getattr(timings, name, None)
+            if type(value) not in (int, long, float):
+                value = float("nan")
+            columns[name].append(value)
+    keys = [None] * len(columns[PAGE_TIMINGS[0]])
+    if not keys:
+        return dict( (name, _summary([], quantiles)) for name in PAGE_TIMINGS )
+    return _grouped_stats(keys, columns, PAGE_TIMINGS, quantiles,
+                          use_numpy)[None]
+
+
+class QuantileSketch(object):
+    """Approximate quantiles of a stream of non-negative numbers in
+    bounded memory.
+
+    Values are counted in buckets whose bounds grow geometrically, so
+    any quantile returned is within `relative_accuracy` of a value of
+    that rank in the stream. At most `max_buckets` buckets are kept;
+    past that the lowest buckets are merged, which only loses accuracy
+    for the smallest values. The maximum is kept exactly.
+
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets = {} #index -> count
+        self.zeros = 0 #values too small to bucket
+        self.count = 0
+        self.max = None
+
+    def add(self, value, count=1):
+        if value < 0 or value != value: #NaN
+            raise ValueError("QuantileSketch only takes non-negative "
+                             "numbers")
+        self.count += count
+        if self.max is None or value > self.max:
+            self.max = value
+        if value < 1e-9:
+            self.zeros += count
+            return
+        index = int(math.ceil(math.log(value) / self._log_gamma))
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self):
+        indexes = sorted(self.buckets)
+        excess = len(indexes) - self.max_buckets
+        merged = sum(self.buckets.pop(index) for index in indexes[:excess])
+        target = indexes[excess]
+        self.buckets[target] += merged
+
+    def merge(self, other):
+        """Add the values counted by the sketch `other`, which must
+        have the same relative accuracy."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Sketches of different accuracy can not be "
+                             "merged")
+        for index, count in other.buckets.iteritems():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        if other.max is not None and (self.max is None or
+                                      other.max > self.max):
+            self.max = other.max
+        while len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def quantile(self, quantile):
+        """Return the approximate value at `quantile` (0 to 1), or None
+        if nothing has been added."""
+        if not self.count:
+            return None
+        if quantile >= 1:
+            return self.max
+        rank = quantile * (self.count - 1)
+        if rank < self.zeros:
+            return 0.0
+        seen = self.zeros
+        indexes = sorted(self.buckets)
+        counts = []
+        for index in indexes:
+            seen += self.buckets[index]
+            counts.append(seen)
+        index = indexes[min(bisect_right(counts, rank), len(indexes) - 1)]
+        # the middle of the bucket, which is within the accuracy of
+        # every value in it
+        value = 2 * self._gamma ** index / (self._gamma + 1)
+        return min(value, self.max)
+
+    def summary(self, quantiles=QUANTILES):
+        """Return a summary in the form used by timing_stats."""
+        summary = {"count": self.count, "max": self.max}
+        for quantile in quantiles:
+            summary[_quantile_name(quantile)] = self.quantile(quantile)
+        return summary
+
+
+class StreamingStats(object):
+    """timing_stats for entries that are added one at a time, keeping a
+    QuantileSketch per group and phase instead of the values."""
+
+    def __init__(self, by="host", phases=PHASES, quantiles=QUANTILES,
+                 relative_accuracy=0.01):
+        self.key = group_key(by)
+        self.phases = phases
+        self.quantiles = quantiles
+        self.relative_accuracy = relative_accuracy
+        self.sketches = {} #group -> {phase: QuantileSketch}
+
+    def _sketches(self, group):
+        try:
+            return self.sketches[group]
+        except KeyError:
+            sketches = self.sketches[group] = dict(
+                (phase, QuantileSketch(self.relative_accuracy))
+                for phase in self.phases)
+            return sketches
+
+    def add(self, entry):
+        sketches = self._sketches(self.key(entry))
+        timings = getattr(entry, "timings", None)
+        for phase in self.phases:
+            if phase == "time":
+                value = getattr(entry, "time", None)
+            else:
+                value = getattr(timings, phase, None)
+            if type(value) in (int, long, float) and value >= 0:
+                sketches[phase].add(value)
+
+    def update(self, entries):
+        for entry in entries:
+            self.add(entry)
+
+    def merge(self, other):
+        """Add the sketches of the StreamingStats `other`, from another
+        process say."""
+        for group, sketches in other.sketches.iteritems():
+            mine = self._sketches(group)
+            for phase, sketch in sketches.iteritems():
+                if phase in mine:
+                    mine[phase].merge(sketch)
+
+    def result(self):
+        """Return {group: {phase: summary}} as timing_stats does, with
+        approximate quantiles."""
+        return dict( (group, dict( (phase, sketch.summary(self.quantiles))
+                                   for phase, sketch in sketches.iteritems() ))
+                     for group, sketches in self.sketches.iteritems() )